@@ -1,10 +1,14 @@
-from flask import Flask, request, jsonify
+from flask import Flask, request, jsonify, Response, stream_with_context
 from flask_socketio import SocketIO, emit
 from flask_cors import CORS
 from datetime import datetime, timedelta
-from lms_rag import send_continue_chat
+from lms_rag import send_continue_chat, stream_continue_chat, llm_gateway, history_window
+from history_window import HISTORY_PROJECTION
 from model import ChatHistory
 from db_connector import mongodb
+from session_state import SessionStateStore
+from chat_writer import chat_history_writer
+from conversation_cache import conversation_cache
 from dotenv import load_dotenv
 import os
 from bson import ObjectId
@@ -17,6 +21,9 @@ socketio = SocketIO(app, cors_allowed_origins='*', ping_timeout=60)
 # Load environment variables from .env file
 load_dotenv()
 
+# Trạng thái session chat của từng người dùng (collection chat_sessions)
+session_states = SessionStateStore(mongodb)
+
 # Hàm chuyển đổi ObjectId và datetime thành string
 def convert_mongo_objects(data):
     if isinstance(data, list):
@@ -42,36 +49,71 @@ def create_response(data, status_code, message):
 def get_chat_history_collection():
     return mongodb.get_collection('chat_history')
 
-def get_last_session_number(user_id):
-    chat_collection = get_chat_history_collection()
-    last_session = chat_collection.find({'user_id': user_id}).sort('session_number', -1).limit(1)
-    last_session = list(last_session)
-    if not last_session:
-        return 0
-    return last_session[0]['session_number']
+def get_chat_history_by_session(user_id, session_number):
+    # Cuộc hội thoại đang diễn ra được phục vụ từ bộ nhớ
+    cached = conversation_cache.get(user_id, session_number)
+    if cached is not None:
+        return cached
 
-def get_new_session_number(user_id):
-    chat_collection = get_chat_history_collection()
-    last_session_number = get_last_session_number(user_id)
-    last_session_records = list(chat_collection.find({'user_id': user_id, 'session_number': last_session_number}))
+    conversation_cache.begin_load(user_id, session_number)
+    history = None
+    try:
+        chat_collection = get_chat_history_collection()
+        # Tin nhắn còn trong bộ đệm ghi (read-your-writes) - lấy trước khi đọc MongoDB
+        pending = chat_history_writer.pending(user_id, session_number)
+        # Chỉ đọc các tin nhắn gần nhất mà cửa sổ lịch sử cần, với các trường cần thiết
+        chats = list(chat_collection.find(
+            {'user_id': user_id, 'session_number': session_number}, HISTORY_PROJECTION
+        ).sort('created_at', -1).limit(history_window.fetch_limit))
+        chats.reverse()
+        chats = chat_history_writer.merge(chats, pending)[-history_window.fetch_limit:]
+        history = [ChatHistory.from_dict(chat) for chat in chats]
+        return history
+    finally:
+        conversation_cache.finish_load(user_id, session_number, history)
 
-    if not last_session_records:
-        return last_session_number + 1
+def get_session_context(user_id):
+    """
+    Xác định session cho tin nhắn mới và lịch sử hội thoại dùng làm ngữ cảnh
 
-    last_record_time = last_session_records[-1]['created_at']
-    current_time = datetime.utcnow()
-    time_diff = current_time - last_record_time
+    Returns:
+        tuple: (session_number, chat_history)
+    """
+    # Một lệnh findOneAndUpdate trên document trạng thái session của người dùng
+    session_number, is_new_session = session_states.assign(user_id)
 
-    # Start a new session if there's been no activity for 30 minutes or after 15 exchanges
-    if time_diff > timedelta(minutes=30) or len(last_session_records) > 15:
-        return last_session_number + 1
+    if is_new_session:
+        # Start a new conversation
+        conversation_cache.start(user_id, session_number)
+        return session_number, []
+    # Continue existing conversation
+    return session_number, get_chat_history_by_session(user_id, session_number)
 
-    return last_session_number
+def save_exchange(user_id, session_number, user_query, answer):
+    """
+    Lưu câu hỏi và câu trả lời vào chat_history (ghi theo lô, không chờ MongoDB)
 
-def get_chat_history_by_session(user_id, session_number):
-    chat_collection = get_chat_history_collection()
-    chats = list(chat_collection.find({'user_id': user_id, 'session_number': session_number}).sort('created_at', 1))
-    return [ChatHistory.from_dict(chat) for chat in chats]
+    Returns:
+        ChatHistory: Tin nhắn của bot
+    """
+    # Save the user query to the chat history
+    user_chat = ChatHistory(
+        user_id=user_id,
+        content=user_query,
+        is_user=True,
+        session_number=session_number
+    )
+
+    # Save the generated answer to the chat history
+    bot_chat = ChatHistory(
+        user_id=user_id,
+        content=answer,
+        is_user=False,
+        session_number=session_number
+    )
+    chat_history_writer.add([user_chat.to_dict(), bot_chat.to_dict()])
+    conversation_cache.append(user_id, session_number, [user_chat, bot_chat])
+    return bot_chat
 
 @app.route('/chat', methods=['POST'])
 def send_message():
@@ -81,41 +123,9 @@ def send_message():
         user_id = data.get('userId')
 
         if user_query and user_id:
-            chat_collection = get_chat_history_collection()
-            
-            # Get old session number
-            last_session_number = get_last_session_number(user_id)
-            # Get the new session number
-            session_number = get_new_session_number(user_id)
-
-            if session_number > last_session_number:
-                # Start a new conversation
-                answer = send_continue_chat([], user_query)
-            else:
-                # Continue existing conversation
-                chat_history = get_chat_history_by_session(user_id, session_number)
-                if chat_history:
-                    answer = send_continue_chat(chat_history, user_query)
-                else:
-                    answer = send_continue_chat([], user_query)
-
-            # Save the user query to the chat history
-            user_chat = ChatHistory(
-                user_id=user_id,
-                content=user_query,
-                is_user=True,
-                session_number=session_number
-            )
-            chat_collection.insert_one(user_chat.to_dict())
-
-            # Save the generated answer to the chat history
-            bot_chat = ChatHistory(
-                user_id=user_id,
-                content=answer,
-                is_user=False,
-                session_number=session_number
-            )
-            chat_collection.insert_one(bot_chat.to_dict())
+            session_number, chat_history = get_session_context(user_id)
+            answer = send_continue_chat(chat_history, user_query)
+            bot_chat = save_exchange(user_id, session_number, user_query, answer)
 
             return create_response(bot_chat.to_dict(), 200, 'Success')
         return create_response(None, 400, 'No query or userId provided')
@@ -123,6 +133,50 @@ def send_message():
         print(f"Lỗi khi xử lý tin nhắn: {e}")
         return create_response(None, 500, f'Internal Server Error: {str(e)}')
 
+def format_sse(event, data):
+    """
+    Định dạng một Server-Sent Event
+    """
+    return f"event: {event}\ndata: {json.dumps(convert_mongo_objects(data), ensure_ascii=False)}\n\n"
+
+@app.route('/chat/stream', methods=['POST'])
+def stream_message():
+    """
+    Giống POST /chat nhưng trả về câu trả lời dạng Server-Sent Events: các event `chunk`
+    trong lúc LLM sinh câu trả lời, sau đó một event `response` (tin nhắn đã lưu) kèm
+    time-to-first-token và tổng thời gian
+    """
+    data = request.json or {}
+    user_query = data.get('content')
+    user_id = data.get('userId')
+
+    if not user_query or not user_id:
+        return create_response(None, 400, 'No query or userId provided')
+
+    def generate():
+        try:
+            session_number, chat_history = get_session_context(user_id)
+            for event in stream_continue_chat(chat_history, user_query):
+                if event['type'] == 'chunk':
+                    yield format_sse('chunk', {'content': event['content']})
+                else:
+                    # Chỉ lưu khi đã có toàn bộ câu trả lời
+                    bot_chat = save_exchange(user_id, session_number, user_query, event['content'])
+                    yield format_sse('response', {
+                        **bot_chat.to_dict(),
+                        'ttft_ms': event['ttft_ms'],
+                        'total_ms': event['total_ms']
+                    })
+        except Exception as e:
+            print(f"Lỗi khi stream tin nhắn: {e}")
+            yield format_sse('error', {'message': f'Error: {str(e)}'})
+
+    return Response(
+        stream_with_context(generate()),
+        mimetype='text/event-stream',
+        headers={'Cache-Control': 'no-cache', 'X-Accel-Buffering': 'no'}
+    )
+
 @app.route('/chat/history/<user_id>', methods=['GET'])
 def get_chat_history_by_user(user_id):
     try:
@@ -130,7 +184,10 @@ def get_chat_history_by_user(user_id):
         
         # Không chuyển đổi user_id thành ObjectId nữa vì dữ liệu thực tế lưu dưới dạng string
         chat_collection = get_chat_history_collection()
-        chat_history_records = list(chat_collection.find({'user_id': user_id}).sort('created_at', 1))
+        pending = chat_history_writer.pending(user_id)
+        chat_history_records = chat_history_writer.merge(
+            list(chat_collection.find({'user_id': user_id}).sort('created_at', 1)), pending
+        )
         
         print(f"Found {len(chat_history_records)} records for user {user_id}")
         
@@ -152,6 +209,10 @@ def get_chat_history_by_user(user_id):
 @app.route('/chat/clear/<user_id>', methods=['DELETE'])
 def clear_chat_history(user_id):
     try:
+        session_states.reset(user_id)
+        chat_history_writer.discard(user_id)
+        conversation_cache.invalidate_user(user_id)
+
         # Chuyển đổi user_id thành ObjectId nếu cần
         try:
             if not isinstance(user_id, ObjectId) and not user_id.isdigit():
@@ -167,6 +228,20 @@ def clear_chat_history(user_id):
         print(f"Lỗi khi xóa lịch sử chat: {e}")
         return create_response(None, 500, f'Internal Server Error: {str(e)}')
 
+@app.route('/admin/llm/status', methods=['GET'])
+def get_llm_status():
+    # Số lần gọi Gemini đang chạy, độ sâu hàng đợi, số request bị từ chối và thời gian chờ
+    return create_response(llm_gateway.stats(), 200, 'Success')
+
+@app.route('/admin/chat/status', methods=['GET'])
+def get_chat_status():
+    # Bộ đệm ghi lịch sử chat và cache cuộc hội thoại trong bộ nhớ
+    return create_response({
+        'writer': chat_history_writer.stats(),
+        'conversation_cache': conversation_cache.stats(),
+        'history_window': history_window.stats()
+    }, 200, 'Success')
+
 # Socket.IO event handlers for realtime chat
 @socketio.on('connect')
 def handle_connect():
@@ -183,10 +258,10 @@ def handle_message(data):
         user_id = data.get('userId')
         
         if user_query and user_id:
-            chat_collection = get_chat_history_collection()
-            
             # Get session number
-            session_number = get_new_session_number(user_id)
+            session_number, is_new_session = session_states.assign(user_id)
+            if is_new_session:
+                conversation_cache.start(user_id, session_number)
             
             # Save user message
             user_chat = ChatHistory(
@@ -195,13 +270,21 @@ def handle_message(data):
                 is_user=True,
                 session_number=session_number
             )
-            chat_collection.insert_one(user_chat.to_dict())
+            chat_history_writer.add([user_chat.to_dict()])
+            conversation_cache.append(user_id, session_number, [user_chat])
             
             # Get chat history for context
             chat_history = get_chat_history_by_session(user_id, session_number)
             
-            # Generate response
-            answer = send_continue_chat(chat_history, user_query)
+            # Generate response, emitting each chunk as soon as the LLM produces it
+            answer = ''
+            timings = {}
+            for event in stream_continue_chat(chat_history, user_query):
+                if event['type'] == 'chunk':
+                    emit('response_chunk', {'content': event['content'], 'session_number': session_number})
+                else:
+                    answer = event['content']
+                    timings = {'ttft_ms': event['ttft_ms'], 'total_ms': event['total_ms']}
             
             # Save bot response
             bot_chat = ChatHistory(
@@ -210,10 +293,11 @@ def handle_message(data):
                 is_user=False,
                 session_number=session_number
             )
-            chat_collection.insert_one(bot_chat.to_dict())
+            chat_history_writer.add([bot_chat.to_dict()])
+            conversation_cache.append(user_id, session_number, [bot_chat])
             
             # Emit response back to client
-            emit('response', convert_mongo_objects(bot_chat.to_dict()))
+            emit('response', convert_mongo_objects({**bot_chat.to_dict(), **timings}))
         else:
             emit('error', {'message': 'No query or userId provided'})
     except Exception as e:
@@ -0,0 +1,312 @@
+"""
+Async App - Chế độ server bất đồng bộ (aiohttp + python-socketio + motor)
+Cải tiến khả năng chịu tải cho LMS-RAG-Chatbot: mỗi request đang chờ Gemini không chiếm một worker thread
+
+Cung cấp cùng các endpoint chat và event Socket.IO như `app.py`. Bật bằng `SERVER_MODE=async`
+khi chạy `run.py`.
+"""
+
+import asyncio
+import time
+
+import socketio
+from aiohttp import web
+
+from app import convert_mongo_objects, format_sse
+from db_connector import async_mongodb
+from lms_rag import async_send_continue_chat, pipeline_runner, llm_gateway, history_window
+from history_window import HISTORY_PROJECTION
+from model import ChatHistory
+from session_state import AsyncSessionStateStore
+from chat_writer import chat_history_writer
+from conversation_cache import conversation_cache
+
+# Trạng thái session chat của từng người dùng (collection chat_sessions)
+session_states = AsyncSessionStateStore(async_mongodb)
+
+sio = socketio.AsyncServer(async_mode='aiohttp', cors_allowed_origins='*', ping_timeout=60)
+
+
+@web.middleware
+async def cors_middleware(request, handler):
+    # Tương đương CORS(app) của Flask: cho phép mọi origin
+    if request.method == 'OPTIONS':
+        response = web.Response()
+    else:
+        response = await handler(request)
+    response.headers['Access-Control-Allow-Origin'] = '*'
+    response.headers['Access-Control-Allow-Headers'] = 'Content-Type'
+    response.headers['Access-Control-Allow-Methods'] = 'GET, POST, DELETE, OPTIONS'
+    return response
+
+
+web_app = web.Application(middlewares=[cors_middleware])
+sio.attach(web_app)
+routes = web.RouteTableDef()
+
+
+# Hàm tạo response với chuyển đổi các đối tượng MongoDB
+def create_response(data, status_code, message):
+    return web.json_response({
+        'data': convert_mongo_objects(data),
+        'statusCode': status_code,
+        'message': message
+    }, status=status_code)
+
+# Function to get chat history collection
+def get_chat_history_collection():
+    return async_mongodb.get_collection('chat_history')
+
+async def get_chat_history_by_session(user_id, session_number):
+    # Cuộc hội thoại đang diễn ra được phục vụ từ bộ nhớ
+    cached = conversation_cache.get(user_id, session_number)
+    if cached is not None:
+        return cached
+
+    conversation_cache.begin_load(user_id, session_number)
+    history = None
+    try:
+        # Tin nhắn còn trong bộ đệm ghi (read-your-writes) - lấy trước khi đọc MongoDB
+        pending = chat_history_writer.pending(user_id, session_number)
+        # Chỉ đọc các tin nhắn gần nhất mà cửa sổ lịch sử cần, với các trường cần thiết
+        chats = await get_chat_history_collection().find(
+            {'user_id': user_id, 'session_number': session_number}, HISTORY_PROJECTION
+        ).sort('created_at', -1).limit(history_window.fetch_limit).to_list(length=None)
+        chats.reverse()
+        chats = chat_history_writer.merge(chats, pending)[-history_window.fetch_limit:]
+        history = [ChatHistory.from_dict(chat) for chat in chats]
+        return history
+    finally:
+        conversation_cache.finish_load(user_id, session_number, history)
+
+async def get_session_context(user_id):
+    """
+    Xác định session cho tin nhắn mới và lịch sử hội thoại dùng làm ngữ cảnh
+
+    Returns:
+        tuple: (session_number, chat_history)
+    """
+    # Một lệnh findOneAndUpdate trên document trạng thái session của người dùng
+    session_number, is_new_session = await session_states.assign(user_id)
+
+    if is_new_session:
+        # Start a new conversation
+        conversation_cache.start(user_id, session_number)
+        return session_number, []
+    # Continue existing conversation
+    return session_number, await get_chat_history_by_session(user_id, session_number)
+
+async def save_message(user_id, session_number, content, is_user):
+    """
+    Lưu một tin nhắn vào chat_history (ghi theo lô trên thread nền, không chặn event loop)
+
+    Returns:
+        ChatHistory: Tin nhắn đã lưu
+    """
+    chat = ChatHistory(
+        user_id=user_id,
+        content=content,
+        is_user=is_user,
+        session_number=session_number
+    )
+    # add() chỉ đưa vào bộ đệm, nhưng ghi đồng bộ bằng pymongo khi bộ đệm đầy hoặc khi tắt ghi theo lô
+    await asyncio.get_running_loop().run_in_executor(None, chat_history_writer.add, [chat.to_dict()])
+    conversation_cache.append(user_id, session_number, [chat])
+    return chat
+
+async def save_exchange(user_id, session_number, user_query, answer):
+    """
+    Lưu câu hỏi và câu trả lời vào chat_history
+
+    Returns:
+        ChatHistory: Tin nhắn của bot
+    """
+    await save_message(user_id, session_number, user_query, True)
+    return await save_message(user_id, session_number, answer, False)
+
+@routes.post('/chat')
+async def send_message(request):
+    try:
+        data = await request.json()
+        user_query = data.get('content')
+        user_id = data.get('userId')
+
+        if user_query and user_id:
+            session_number, chat_history = await get_session_context(user_id)
+            answer = await async_send_continue_chat(chat_history, user_query)
+            bot_chat = await save_exchange(user_id, session_number, user_query, answer)
+
+            return create_response(bot_chat.to_dict(), 200, 'Success')
+        return create_response(None, 400, 'No query or userId provided')
+    except Exception as e:
+        print(f"Lỗi khi xử lý tin nhắn: {e}")
+        return create_response(None, 500, f'Internal Server Error: {str(e)}')
+
+def _timings(start_time, first_chunk):
+    total_ms = (time.perf_counter() - start_time) * 1000
+    ttft_ms = (first_chunk[0] - start_time) * 1000 if first_chunk else total_ms
+    return {'ttft_ms': round(ttft_ms, 1), 'total_ms': round(total_ms, 1)}
+
+@routes.post('/chat/stream')
+async def stream_message(request):
+    """
+    Giống POST /chat/stream của `app.py`: các event `chunk`, sau đó event `response` kèm thời gian
+    """
+    data = await request.json()
+    user_query = data.get('content')
+    user_id = data.get('userId')
+
+    if not user_query or not user_id:
+        return create_response(None, 400, 'No query or userId provided')
+
+    response = web.StreamResponse(headers={
+        'Content-Type': 'text/event-stream',
+        'Cache-Control': 'no-cache',
+        'X-Accel-Buffering': 'no'
+    })
+    await response.prepare(request)
+
+    start_time = time.perf_counter()
+    first_chunk = []
+
+    async def send_chunk(text):
+        if not first_chunk:
+            first_chunk.append(time.perf_counter())
+        await response.write(format_sse('chunk', {'content': text}).encode('utf-8'))
+
+    try:
+        session_number, chat_history = await get_session_context(user_id)
+        answer = await async_send_continue_chat(chat_history, user_query, on_chunk=send_chunk)
+        if not first_chunk and answer:
+            await send_chunk(answer)
+
+        # Chỉ lưu khi đã có toàn bộ câu trả lời
+        bot_chat = await save_exchange(user_id, session_number, user_query, answer)
+        await response.write(format_sse('response', {
+            **bot_chat.to_dict(),
+            **_timings(start_time, first_chunk)
+        }).encode('utf-8'))
+    except Exception as e:
+        print(f"Lỗi khi stream tin nhắn: {e}")
+        await response.write(format_sse('error', {'message': f'Error: {str(e)}'}).encode('utf-8'))
+
+    await response.write_eof()
+    return response
+
+@routes.get('/chat/history/{user_id}')
+async def get_chat_history_by_user(request):
+    try:
+        user_id = request.match_info['user_id']
+        pending = chat_history_writer.pending(user_id)
+        chat_history_records = chat_history_writer.merge(await get_chat_history_collection().find(
+            {'user_id': user_id}
+        ).sort('created_at', 1).to_list(length=None), pending)
+
+        # Group by session for easier frontend usage
+        sessions = {}
+        for record in chat_history_records:
+            sessions.setdefault(record['session_number'], []).append(record)
+
+        return create_response(sessions, 200, 'Success')
+    except Exception as e:
+        print(f"Lỗi khi lấy lịch sử chat: {e}")
+        return create_response(None, 500, f'Internal Server Error: {str(e)}')
+
+@routes.delete('/chat/clear/{user_id}')
+async def clear_chat_history(request):
+    try:
+        user_id = request.match_info['user_id']
+        await session_states.reset(user_id)
+        # Chờ lần ghi đang chạy xong trên thread khác, không chặn event loop
+        await asyncio.get_running_loop().run_in_executor(None, chat_history_writer.discard, user_id)
+        conversation_cache.invalidate_user(user_id)
+        result = await get_chat_history_collection().delete_many({'user_id': user_id})
+        return create_response(None, 200, f'Chat history cleared for user {user_id}. Deleted {result.deleted_count} messages.')
+    except Exception as e:
+        print(f"Lỗi khi xóa lịch sử chat: {e}")
+        return create_response(None, 500, f'Internal Server Error: {str(e)}')
+
+@routes.get('/admin/pipeline/status')
+async def pipeline_status(request):
+    return create_response(pipeline_runner.stats(), 200, 'Success')
+
+@routes.get('/admin/llm/status')
+async def llm_status(request):
+    return create_response(llm_gateway.stats(), 200, 'Success')
+
+@routes.get('/admin/chat/status')
+async def chat_status(request):
+    return create_response({
+        'writer': chat_history_writer.stats(),
+        'conversation_cache': conversation_cache.stats(),
+        'history_window': history_window.stats()
+    }, 200, 'Success')
+
+web_app.add_routes(routes)
+
+# Socket.IO event handlers for realtime chat
+@sio.event
+async def connect(sid, environ):
+    print('Client connected')
+
+@sio.event
+async def disconnect(sid):
+    print('Client disconnected')
+
+@sio.on('message')
+async def handle_message(sid, data):
+    try:
+        user_query = data.get('content')
+        user_id = data.get('userId')
+
+        if user_query and user_id:
+            start_time = time.perf_counter()
+            first_chunk = []
+            session_number, is_new_session = await session_states.assign(user_id)
+            if is_new_session:
+                conversation_cache.start(user_id, session_number)
+
+            # Save user message, then get chat history for context
+            await save_message(user_id, session_number, user_query, True)
+            chat_history = await get_chat_history_by_session(user_id, session_number)
+
+            async def send_chunk(text):
+                if not first_chunk:
+                    first_chunk.append(time.perf_counter())
+                await sio.emit('response_chunk', {'content': text, 'session_number': session_number}, to=sid)
+
+            # Generate response, emitting each chunk as soon as the LLM produces it
+            answer = await async_send_continue_chat(chat_history, user_query, on_chunk=send_chunk)
+            if not first_chunk and answer:
+                await send_chunk(answer)
+
+            # Save bot response and emit it back to client
+            bot_chat = await save_message(user_id, session_number, answer, False)
+            await sio.emit('response', convert_mongo_objects({
+                **bot_chat.to_dict(),
+                **_timings(start_time, first_chunk)
+            }), to=sid)
+        else:
+            await sio.emit('error', {'message': 'No query or userId provided'}, to=sid)
+    except Exception as e:
+        print(f"Socket error: {e}")
+        await sio.emit('error', {'message': f'Error: {str(e)}'}, to=sid)
+
+async def _on_cleanup(app):
+    # Ghi nốt các tin nhắn còn trong bộ đệm trước khi tắt
+    await asyncio.get_running_loop().run_in_executor(None, chat_history_writer.close)
+    async_mongodb.close()
+    pipeline_runner.executor.shutdown(wait=False)
+
+web_app.on_cleanup.append(_on_cleanup)
+
+def run_async_server(host='0.0.0.0', port=8080):
+    """
+    Chạy server bất đồng bộ (một event loop, pipeline chạy trên executor có giới hạn)
+    """
+    print(f"Chạy server async trên cổng {port} "
+          f"(pipeline executor: {pipeline_runner.max_workers} thread)")
+    web.run_app(web_app, host=host, port=port)
+
+if __name__ == '__main__':
+    run_async_server()
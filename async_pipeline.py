@@ -0,0 +1,396 @@
+"""
+Async Pipeline - Chạy pipeline trả lời câu hỏi theo từng bước, đồng bộ hoặc bất đồng bộ
+Cải tiến khả năng chịu tải cho LMS-RAG-Chatbot: thời gian chờ Gemini không chiếm worker thread
+
+Pipeline được viết dưới dạng generator: phần xử lý đồng bộ (cache, phân loại intent, truy vấn
+MongoDB, tìm kiếm FAISS) chạy giữa các lần `yield`, còn mỗi lần gọi LLM được `yield` ra ngoài dưới
+dạng một bước (`LLMCall` / `ChainCall`) và nhận lại kết quả:
+
+    answer = yield LLMCall(prompt)
+
+`run_pipeline` thực hiện các bước bằng `invoke` / `stream` ngay trên thread hiện tại.
+`AsyncPipelineRunner` chạy phần đồng bộ trên một executor có giới hạn và chờ LLM bằng
+`ainvoke` / `astream` trên event loop, nên số request đồng thời không bị giới hạn bởi số thread.
+
+Cả hai có thể nhận một `LLMGateway` (`llm_gateway.py`): mỗi bước giữ một slot của gateway trong lúc
+gọi LLM. Lỗi từ gateway (quá tải) không được trả về pipeline mà kết thúc pipeline ngay.
+
+Khi có `Deadline` (`deadline.py`), bước không thể xong trước thời hạn sẽ không được chờ tiếp:
+nếu bước có `fallback` (câu trả lời dựng từ dữ liệu đã truy xuất), pipeline kết thúc với câu
+trả lời đó (không lưu cache); nếu không, `DeadlineExceeded` được trả về pipeline như một lỗi LLM.
+"""
+
+import asyncio
+import inspect
+import threading
+from collections import namedtuple
+from concurrent.futures import ThreadPoolExecutor, TimeoutError as FutureTimeoutError
+from contextlib import asynccontextmanager, contextmanager
+
+from deadline import DeadlineExceeded
+from llm_gateway import LLMOverloadedError
+
+# Gọi LLM với prompt dạng chuỗi; kết quả trả về generator là nội dung câu trả lời (str).
+# fallback: hàm () -> str tạo câu trả lời không cần LLM khi hết thời hạn (None nếu không có)
+LLMCall = namedtuple("LLMCall", ["prompt", "stream", "fallback"], defaults=[True, None])
+
+# Gọi một LangChain runnable (ví dụ RAG chain); kết quả trả về generator giống `chain.invoke`:
+# dict với RAG chain, str với chain chỉ sinh văn bản (stuff-documents chain, prompt | llm | parser)
+ChainCall = namedtuple("ChainCall", ["chain", "inputs", "stream", "fallback"], defaults=[True, None])
+
+# Không bắt đầu gọi LLM khi thời hạn còn lại ít hơn mức này (giây)
+MIN_CALL_SECONDS = 0.5
+
+# Thread chạy lời gọi LLM có thời hạn ở chế độ đồng bộ (lời gọi quá hạn chạy tiếp đến khi Gemini trả về)
+_deadline_executor = ThreadPoolExecutor(max_workers=32, thread_name_prefix="llm-call")
+
+
+def _advance(steps, value, error):
+    """
+    Chạy generator đến bước tiếp theo
+
+    Returns:
+        tuple: (True, bước tiếp theo) hoặc (False, kết quả cuối cùng của pipeline)
+    """
+    try:
+        if error is not None:
+            return True, steps.throw(error)
+        return True, steps.send(value)
+    except StopIteration as stop:
+        return False, stop.value
+
+
+def _check_remaining(deadline):
+    """
+    Số giây còn lại để chạy một bước
+
+    Raises:
+        DeadlineExceeded: Không đủ thời gian để bắt đầu gọi LLM
+    """
+    remaining = deadline.remaining()
+    if remaining < MIN_CALL_SECONDS:
+        raise DeadlineExceeded(f"còn {remaining:.2f}s")
+    return remaining
+
+
+def _waited_until_deadline(error, deadline):
+    """
+    Chờ slot của gateway quá lâu vì thời hạn của request (không phải vì `max_wait_seconds` của gateway)
+    """
+    return error.reason == "wait_timeout" and deadline.remaining() < MIN_CALL_SECONDS
+
+
+@contextmanager
+def _no_slot():
+    yield
+
+
+@asynccontextmanager
+async def _no_async_slot():
+    yield
+
+
+@asynccontextmanager
+async def _released_on_exit(gateway):
+    try:
+        yield
+    finally:
+        gateway.release()
+
+
+def run_pipeline(steps, llm, sink=None, gateway=None, deadline=None):
+    """
+    Chạy pipeline trên thread hiện tại
+
+    Args:
+        steps: Generator của pipeline
+        llm: Chat model (có `invoke` / `stream`)
+        sink: Hàm nhận từng đoạn câu trả lời khi request đang stream (None nếu không stream)
+        gateway: `LLMGateway` giới hạn số lần gọi LLM đồng thời (None nếu không giới hạn)
+        deadline: `Deadline` của request (None nếu không giới hạn thời gian)
+
+    Returns:
+        Kết quả cuối cùng của pipeline
+
+    Raises:
+        LLMOverloadedError: Gateway từ chối một lần gọi LLM
+    """
+    value, error = None, None
+    try:
+        while True:
+            has_step, step = _advance(steps, value, error)
+            if not has_step:
+                return step
+
+            value, error = None, None
+            try:
+                if deadline is None:
+                    with gateway.slot() if gateway else _no_slot():
+                        value = _call_step(llm, step, sink)
+                else:
+                    value = _call_step_with_deadline(llm, step, sink, gateway, deadline)
+            except LLMOverloadedError:
+                raise
+            except DeadlineExceeded as e:
+                if step.fallback is None:
+                    # Pipeline xử lý như một lỗi LLM (ví dụ bỏ qua bước trích xuất tên bằng LLM)
+                    error = e
+                    continue
+                print(f"Hết thời hạn request ({e}), trả lời bằng dữ liệu đã truy xuất")
+                return step.fallback()
+            except Exception as e:
+                # Trả lỗi về pipeline để các nhánh try/except của pipeline xử lý
+                error = e
+    finally:
+        steps.close()
+
+
+def _call_step(llm, step, sink):
+    if isinstance(step, LLMCall):
+        return _call_llm(llm, step, sink)
+    return _call_chain(step, sink)
+
+
+def _call_step_with_deadline(llm, step, sink, gateway, deadline):
+    """
+    Gọi LLM trên thread riêng và chỉ chờ đến thời hạn của request
+
+    Slot của gateway được giữ đến khi lời gọi thực sự kết thúc (kể cả khi đã quá hạn),
+    để lời gọi bị bỏ lại không làm vượt giới hạn số lần gọi Gemini đồng thời.
+
+    Raises:
+        DeadlineExceeded: Không xong trước thời hạn
+    """
+    remaining = _check_remaining(deadline)
+    if gateway:
+        try:
+            gateway.acquire(timeout=remaining)
+        except LLMOverloadedError as e:
+            if _waited_until_deadline(e, deadline):
+                raise DeadlineExceeded("hết thời hạn khi chờ slot LLM") from e
+            raise
+
+    # Sau khi quá hạn, các đoạn stream còn lại không được gửi cho người dùng nữa
+    active = [True]
+    guarded_sink = None if sink is None else (lambda text: sink(text) if active[0] else None)
+    try:
+        future = _deadline_executor.submit(_call_step, llm, step, guarded_sink)
+    except BaseException:
+        if gateway:
+            gateway.release()
+        raise
+    if gateway:
+        future.add_done_callback(lambda _: gateway.release())
+
+    try:
+        return future.result(timeout=deadline.remaining())
+    except FutureTimeoutError:
+        active[0] = False
+        raise DeadlineExceeded(f"LLM chưa trả lời sau {deadline.seconds}s")
+
+
+def _call_llm(llm, step, sink):
+    if sink is None or not step.stream:
+        return llm.invoke(step.prompt).content
+
+    parts = []
+    for chunk in llm.stream(step.prompt):
+        if chunk.content:
+            parts.append(chunk.content)
+            sink(chunk.content)
+    return "".join(parts)
+
+
+def _call_chain(step, sink):
+    if sink is None or not step.stream:
+        return step.chain.invoke(step.inputs)
+
+    response, answer_parts = {}, []
+    for chunk in step.chain.stream(step.inputs):
+        for text in _collect_chunk(chunk, response, answer_parts):
+            sink(text)
+    return _chain_result(response, answer_parts)
+
+
+def _collect_chunk(chunk, response, answer_parts):
+    """
+    Gộp một chunk stream của chain vào kết quả
+
+    Chunk là str (chain chỉ sinh văn bản) hoặc dict (RAG chain, câu trả lời nằm ở key "answer").
+
+    Returns:
+        list: Các đoạn câu trả lời cần gửi cho người dùng
+    """
+    if isinstance(chunk, str):
+        answer_parts.append(chunk)
+        return [chunk] if chunk else []
+
+    texts = []
+    response.setdefault("answer", "")
+    for key, value in chunk.items():
+        if key == "answer":
+            answer_parts.append(value)
+            texts.append(value)
+        else:
+            response[key] = value
+    return texts
+
+
+def _chain_result(response, answer_parts):
+    """
+    Kết quả của chain sau khi stream: str nếu chain chỉ sinh văn bản, dict nếu không
+    """
+    answer = "".join(answer_parts)
+    if "answer" not in response:
+        return answer
+    response["answer"] = answer
+    return response
+
+
+class AsyncPipelineRunner:
+    """
+    Chạy pipeline trên event loop asyncio
+
+    Phần xử lý đồng bộ giữa các bước chạy trên ThreadPoolExecutor có `max_workers` thread;
+    các lần gọi LLM dùng `ainvoke` / `astream` nên không giữ thread nào trong lúc chờ Gemini.
+
+    Args:
+        llm: Chat model (có `ainvoke` / `astream`)
+        max_workers (int): Số thread tối đa cho phần xử lý đồng bộ (MongoDB, FAISS, cache)
+        gateway: `LLMGateway` giới hạn số lần gọi LLM đồng thời (None nếu không giới hạn)
+    """
+    def __init__(self, llm, max_workers=8, gateway=None):
+        self.llm = llm
+        self.max_workers = max_workers
+        self.gateway = gateway
+        self.executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="pipeline")
+        self._lock = threading.Lock()
+        self.running = 0
+        self.completed = 0
+        self.degraded = 0
+        self.llm_calls = 0
+
+    async def run(self, steps, on_chunk=None, deadline=None):
+        """
+        Chạy pipeline cho một request
+
+        Args:
+            steps: Generator của pipeline
+            on_chunk: Hàm (hoặc coroutine function) nhận từng đoạn câu trả lời; None nếu không stream
+            deadline: `Deadline` của request (None nếu không giới hạn thời gian)
+
+        Returns:
+            Kết quả cuối cùng của pipeline
+
+        Raises:
+            LLMOverloadedError: Gateway từ chối một lần gọi LLM
+        """
+        loop = asyncio.get_running_loop()
+        with self._lock:
+            self.running += 1
+        try:
+            value, error = None, None
+            while True:
+                has_step, step = await loop.run_in_executor(self.executor, _advance, steps, value, error)
+                if not has_step:
+                    return step
+
+                value, error = None, None
+                try:
+                    value = await self._call_step_with_deadline(step, on_chunk, deadline)
+                except LLMOverloadedError:
+                    raise
+                except DeadlineExceeded as e:
+                    if step.fallback is None:
+                        error = e
+                        continue
+                    with self._lock:
+                        self.degraded += 1
+                    print(f"Hết thời hạn request ({e}), trả lời bằng dữ liệu đã truy xuất")
+                    return await loop.run_in_executor(self.executor, step.fallback)
+                except Exception as e:
+                    error = e
+        finally:
+            try:
+                steps.close()
+            except ValueError:
+                # Request bị hủy trong lúc generator đang chạy trên executor
+                pass
+            with self._lock:
+                self.running -= 1
+                self.completed += 1
+
+    async def _call_step_with_deadline(self, step, on_chunk, deadline):
+        """
+        Raises:
+            DeadlineExceeded: Không xong trước thời hạn (lời gọi LLM bị hủy, slot được trả ngay)
+        """
+        if deadline is None:
+            return await self._call_step_in_slot(step, on_chunk, None)
+        remaining = _check_remaining(deadline)
+        try:
+            return await asyncio.wait_for(self._call_step_in_slot(step, on_chunk, deadline), remaining)
+        except asyncio.TimeoutError as e:
+            if deadline.remaining() >= MIN_CALL_SECONDS:
+                # Timeout của chính lời gọi LLM, không phải thời hạn của request
+                raise
+            raise DeadlineExceeded(f"LLM chưa trả lời sau {deadline.seconds}s") from e
+
+    async def _call_step_in_slot(self, step, on_chunk, deadline):
+        if self.gateway is None:
+            slot = _no_async_slot()
+        else:
+            try:
+                await self.gateway.acquire_async(None if deadline is None else _check_remaining(deadline))
+            except LLMOverloadedError as e:
+                if deadline is not None and _waited_until_deadline(e, deadline):
+                    raise DeadlineExceeded("hết thời hạn khi chờ slot LLM") from e
+                raise
+            slot = _released_on_exit(self.gateway)
+
+        async with slot:
+            with self._lock:
+                self.llm_calls += 1
+            if isinstance(step, LLMCall):
+                return await self._call_llm(step, on_chunk)
+            return await self._call_chain(step, on_chunk)
+
+    async def _emit(self, on_chunk, text):
+        result = on_chunk(text)
+        if inspect.isawaitable(result):
+            await result
+
+    async def _call_llm(self, step, on_chunk):
+        if on_chunk is None or not step.stream:
+            return (await self.llm.ainvoke(step.prompt)).content
+
+        parts = []
+        async for chunk in self.llm.astream(step.prompt):
+            if chunk.content:
+                parts.append(chunk.content)
+                await self._emit(on_chunk, chunk.content)
+        return "".join(parts)
+
+    async def _call_chain(self, step, on_chunk):
+        if on_chunk is None or not step.stream:
+            return await step.chain.ainvoke(step.inputs)
+
+        response, answer_parts = {}, []
+        async for chunk in step.chain.astream(step.inputs):
+            for text in _collect_chunk(chunk, response, answer_parts):
+                await self._emit(on_chunk, text)
+        return _chain_result(response, answer_parts)
+
+    def stats(self):
+        """
+        Số pipeline đang chạy / đã xong / trả lời bằng dữ liệu đã truy xuất khi hết thời hạn,
+        số lần gọi LLM và số thread của executor
+        """
+        with self._lock:
+            return {
+                "running": self.running,
+                "completed": self.completed,
+                "degraded": self.degraded,
+                "llm_calls": self.llm_calls,
+                "max_workers": self.max_workers
+            }
@@ -0,0 +1,1028 @@
+#!/usr/bin/env python3
+"""
+Script đo hiệu năng cho LMS-RAG-Chatbot
+
+Cách dùng:
+    python benchmark.py startup      # So sánh thời gian khởi tạo vector store có / không có snapshot
+    python benchmark.py preprocess   # Đếm số round trip MongoDB khi tiền xử lý dữ liệu
+    python benchmark.py fuzzy        # Thời gian tìm tên gần đúng trên index dựng sẵn
+    python benchmark.py intent       # Độ trễ và độ khớp của bộ phân loại intent
+    python benchmark.py coalesce     # Số lần gọi LLM khi nhiều người hỏi cùng câu hỏi đồng thời
+    python benchmark.py swr          # Độ trễ p99 của câu hỏi nóng qua các thời điểm cache hết hạn
+    python benchmark.py async        # Throughput theo số request đồng thời: worker thread và pipeline async
+    python benchmark.py gateway      # Đợt tăng đột biến với quota Gemini giả lập: có / không có LLM gateway
+    python benchmark.py deadline     # Độ trễ p99 khi LLM thỉnh thoảng treo: có / không có thời hạn request
+    python benchmark.py hybrid       # Tìm kiếm vector + từ khóa: tuần tự / song song gộp bằng RRF
+    python benchmark.py writes       # Ghi lịch sử chat: insert_one trên đường trả lời / write-behind theo lô
+    python benchmark.py conversations  # Đọc lịch sử hội thoại mỗi lượt: MongoDB / cache cuộc hội thoại
+    python benchmark.py history      # Số token lịch sử trong prompt theo từng lượt: toàn bộ / cửa sổ + tóm tắt
+"""
+
+import argparse
+import contextlib
+import io
+import random
+import re
+import time
+from collections import Counter
+
+from pymongo import monitoring
+
+
+class CommandCounter(monitoring.CommandListener):
+    """
+    Đếm số lệnh (round trip) gửi đến MongoDB theo tên lệnh
+    """
+    def __init__(self):
+        self.commands = Counter()
+
+    def started(self, event):
+        self.commands[event.command_name] += 1
+
+    def succeeded(self, event):
+        pass
+
+    def failed(self, event):
+        pass
+
+    def total(self):
+        return sum(self.commands.values())
+
+    def reset(self):
+        self.commands.clear()
+
+
+def benchmark_startup(args):
+    """
+    Đo thời gian khởi tạo vector store khi xây dựng lại toàn bộ và khi nạp snapshot
+    """
+    # Import ở đây vì lms_rag khởi tạo vector store ngay khi được import
+    import lms_rag
+
+    print("\n===== ĐO THỜI GIAN KHỞI TẠO VECTOR STORE =====")
+    print(f"Lần import lms_rag: {lms_rag.vector_store_stats}")
+
+    results = {}
+    for label, force_rebuild in (("rebuild", True), ("snapshot", False)):
+        timings = []
+        for _ in range(args.repeat):
+            start_time = time.perf_counter()
+            lms_rag.build_vector_store(force_rebuild=force_rebuild)
+            timings.append(time.perf_counter() - start_time)
+            print(f"- {label}: embedding cache {lms_rag.vector_store_stats.get('embedding_cache')}")
+        results[label] = timings
+
+    print("\nKết quả:")
+    for label, timings in results.items():
+        print(f"- {label:<8}: trung bình {sum(timings) / len(timings):.2f}s "
+              f"(min {min(timings):.2f}s, max {max(timings):.2f}s, {len(timings)} lần)")
+
+    if results["snapshot"]:
+        speedup = (sum(results["rebuild"]) / len(results["rebuild"])) / \
+                  max(sum(results["snapshot"]) / len(results["snapshot"]), 1e-9)
+        print(f"Nạp snapshot nhanh hơn {speedup:.1f} lần")
+
+
+def benchmark_preprocess(args):
+    """
+    So sánh số round trip MongoDB khi xây dựng văn bản giảng viên:
+    cách cũ (một truy vấn khóa học cho mỗi giảng viên) và cách hiện tại (gom trong bộ nhớ)
+    """
+    # Listener phải được đăng ký trước khi MongoClient được tạo (khi import lms_rag)
+    counter = CommandCounter()
+    monitoring.register(counter)
+
+    import lms_rag
+    from db_connector import mongodb
+
+    def legacy_preprocess():
+        courses = mongodb.get_courses(limit=None)
+        mentors = mongodb.get_mentors(limit=None)
+        texts = [lms_rag.build_course_text(course) for course in courses]
+        for mentor in mentors:
+            mentor_courses = mongodb.get_courses_by_mentor(mentor.get('_id'), limit=None)
+            texts.append(lms_rag.build_mentor_text(mentor, mentor_courses))
+        return texts
+
+    print("\n===== ĐẾM ROUND TRIP MONGODB KHI TIỀN XỬ LÝ =====")
+    results = {}
+    for label, func in (("n+1", legacy_preprocess), ("grouped", lms_rag.preprocess_mongodb_data)):
+        counter.reset()
+        start_time = time.perf_counter()
+        texts = func()
+        elapsed = time.perf_counter() - start_time
+        results[label] = (counter.total(), dict(counter.commands), elapsed, texts)
+
+    print("\nKết quả:")
+    for label, (total, commands, elapsed, texts) in results.items():
+        print(f"- {label:<8}: {total} round trips {commands}, {elapsed:.2f}s, {len(texts)} văn bản")
+
+    if sorted(results["n+1"][3]) == sorted(results["grouped"][3]):
+        print("Văn bản tạo ra giống hệt nhau giữa hai cách")
+    else:
+        print("CẢNH BÁO: Văn bản tạo ra khác nhau giữa hai cách")
+
+
+# Câu hỏi thực tế của người dùng (đã ẩn danh) dùng cho benchmark phân loại intent
+INTENT_QUERY_CORPUS = [
+    "Có khóa học nào về lập trình web không?",
+    "Liệt kê tất cả khóa học về Python",
+    "Khóa học Python nào phù hợp cho người mới bắt đầu?",
+    "Liệt kê tất cả khóa học về Web",
+    "Liệt kê tất cả các khóa học",
+    "Cho tôi thông tin chi tiết về khóa học [Lập trình Python cơ bản]",
+    "Khóa học \"ReactJS từ A đến Z\" gồm những bài học nào?",
+    "Nội dung khóa học Machine Learning có những gì?",
+    "So sánh khóa học [Python cơ bản] và [Java cơ bản]",
+    "Khóa Python và khóa Java khác gì nhau?",
+    "Nên chọn khóa học React hay Angular?",
+    "Khóa nào tốt hơn cho người mới: HTML hay Python?",
+    "Giảng viên Nguyễn Văn An là ai?",
+    "Thông tin về giảng viên Trần Thị Bình",
+    "Giảng viên tên Hùng dạy những khóa nào?",
+    "Thầy Minh dạy môn gì?",
+    "Cô Lan có bao nhiêu năm kinh nghiệm?",
+    "Tìm kiếm giảng viên có chuyên môn AI",
+    "Giảng viên nào chuyên về data science?",
+    "Ai là chuyên gia về bảo mật mạng?",
+    "Giảng viên có kinh nghiệm 5 năm trở lên",
+    "Ai dạy khóa học Docker?",
+    "Học phí khóa học Python là bao nhiêu?",
+    "Khóa học Java mất bao nhiêu tiền?",
+    "Giá khóa học thiết kế UI UX",
+    "Đánh giá của học viên về khóa học React thế nào?",
+    "Khóa học này có tốt không?",
+    "Review khóa học machine learning",
+    "Có khóa học online về tiếng Anh giao tiếp không?",
+    "Tôi muốn học về trí tuệ nhân tạo",
+    "Danh sách khóa học lập trình di động",
+    "Khóa học mã số 65f1a2b3c4d5e6f7a8b9c0d1 là gì?",
+    "Xin chào",
+    "Cảm ơn bạn nhiều",
+    "Làm sao để đăng ký tài khoản?",
+    "Tôi nên bắt đầu học lập trình từ đâu?",
+    "Giảng viên của khóa học NodeJS có kinh nghiệm không?",
+    "Có những giảng viên nào dạy về cloud?",
+    "Khóa học 'Excel nâng cao' có chứng chỉ không?",
+    "khoá học nào dạy về blockchain",
+]
+
+
+def legacy_classify_query_intent(query):
+    """
+    Bản cũ của classify_query_intent (giữ lại để so sánh độ trễ và độ khớp kết quả)
+    """
+    query_lower = query.lower()
+    
+    # Định nghĩa các pattern cho từng loại intent
+    intent_patterns = {
+        'course_search': [
+            r'khóa học', r'khoá học', r'course', r'các khóa', 
+            r'liệt kê.*khóa', r'có khóa', r'tìm khóa',
+            r'khóa học về', r'học về', r'học online',
+            r'danh sách.*khóa', r'thông tin.*khóa'
+        ],
+        'course_detail': [
+            r'chi tiết.*khóa học', r'thông tin chi tiết.*khóa', 
+            r'nội dung.*khóa', r'bài học.*khóa',
+            r'có những gì.*khóa', r'khóa học.*gồm',
+            r'\[(.*?)\]', r'"(.*?)"', r'\'(.*?)\'',  # Khóa học trong ngoặc
+            r'khóa học mã số'
+        ],
+        'mentor_search': [
+            r'giảng viên', r'giáo viên', r'mentor', r'teacher',
+            r'người dạy', r'ai dạy', r'người hướng dẫn'
+        ],
+        'mentor_by_name': [
+            r'giảng viên tên', r'giáo viên tên',
+            r'thông tin.*giảng viên', r'thông tin.*giáo viên',
+            r'giảng viên.*là ai', r'thầy', r'cô'
+        ],
+        'mentor_by_specialization': [
+            r'giảng viên.*chuyên', r'giáo viên.*chuyên',
+            r'giảng viên.*expert', r'chuyên gia về',
+            r'giảng viên.*về', r'ai.*chuyên.*về'
+        ],
+        'course_comparison': [
+            r'so sánh.*khóa', r'khóa nào tốt hơn',
+            r'khóa.*hay hơn', r'nên chọn khóa',
+            r'khác nhau.*khóa', r'đâu tốt hơn',
+            r'.*và.*khác gì nhau'
+        ],
+        'price_question': [
+            r'giá.*khóa', r'học phí', r'chi phí', 
+            r'bao nhiêu tiền', r'mất bao nhiêu'
+        ],
+        'rating_question': [
+            r'đánh giá', r'rating', r'review',
+            r'feedback', r'nhận xét', r'tốt không'
+        ]
+    }
+    
+    # Ngưỡng điểm tối thiểu để xác định intent
+    MIN_INTENT_SCORE = 1
+    
+    # Điểm số cho mỗi intent (để xác định độ tin cậy)
+    intent_scores = {intent: 0 for intent in intent_patterns}
+    
+    # Tính điểm cho mỗi intent dựa trên số lượng pattern khớp
+    for intent, patterns in intent_patterns.items():
+        for pattern in patterns:
+            if re.search(pattern, query_lower):
+                # Tăng điểm cho intent này
+                intent_scores[intent] += 1
+                
+                # Bonus points cho một số điều kiện đặc biệt
+                if intent == 'course_comparison' and re.search(r'so sánh.*khóa', query_lower):
+                    intent_scores[intent] += 2  # Boost cho so sánh rõ ràng
+                
+                if intent == 'mentor_by_name' and re.search(r'giảng viên tên', query_lower):
+                    intent_scores[intent] += 2  # Boost cho tìm giảng viên theo tên rõ ràng
+                    
+                if intent == 'course_detail' and any(re.search(pattern, query_lower) for pattern in [r'\[(.*?)\]', r'"(.*?)"', r'\'(.*?)\'']):
+                    intent_scores[intent] += 2  # Boost cho chi tiết khóa học cụ thể
+    
+    # Xác định tất cả intent có điểm số > ngưỡng tối thiểu
+    matched_intents = [intent for intent, score in intent_scores.items() if score >= MIN_INTENT_SCORE]
+    
+    # Sắp xếp intent theo điểm số
+    sorted_intents = sorted(intent_scores.items(), key=lambda x: x[1], reverse=True)
+    
+    # Xác định intent chính (có điểm cao nhất và vượt ngưỡng)
+    primary_intent = sorted_intents[0][0] if sorted_intents and sorted_intents[0][1] >= MIN_INTENT_SCORE else None
+    
+    # Xử lý các trường hợp xung đột
+    if len(matched_intents) > 1:
+        # Nếu có sự chênh lệch không đáng kể giữa hai intent hàng đầu, xem xét ưu tiên
+        top_score = sorted_intents[0][1]
+        second_score = sorted_intents[1][1]
+        
+        if top_score - second_score <= 1:  # Điểm chênh lệch nhỏ
+            # Ưu tiên theo thứ tự
+            priority_order = [
+                'course_comparison',  # Ưu tiên cao nhất cho so sánh
+                'course_detail',       # Sau đó đến chi tiết khóa học
+                'mentor_by_name',      # Tiếp theo là tìm giảng viên theo tên
+                'mentor_by_specialization', 
+                'price_question', 
+                'rating_question',
+                'mentor_search',
+                'course_search'        # Ưu tiên thấp nhất
+            ]
+            
+            # Tìm intent có ưu tiên cao nhất trong các intent matched
+            for intent in priority_order:
+                if intent in matched_intents:
+                    primary_intent = intent
+                    break
+    
+    # Nếu không tìm thấy intent cụ thể, mặc định là course_search
+    if not primary_intent:
+        primary_intent = 'course_search'  # Default intent
+    
+    # Xác định các intent phụ (có điểm > ngưỡng và không phải intent chính)
+    secondary_intents = [intent for intent in matched_intents if intent != primary_intent]
+    
+    # Độ tin cậy của intent chính (tỷ lệ phần trăm)
+    primary_confidence = 0
+    if primary_intent in intent_scores and sum(intent_scores.values()) > 0:
+        primary_confidence = (intent_scores[primary_intent] / sum(intent_scores.values())) * 100
+    
+    return {
+        'primary_intent': primary_intent,
+        'all_intents': matched_intents,
+        'secondary_intents': secondary_intents,
+        'intent_scores': intent_scores,
+        'confidence': primary_confidence
+    }
+
+
+def benchmark_intent(args):
+    """
+    Độ trễ mỗi lần gọi và độ khớp kết quả giữa IntentClassifier và bản phân loại cũ
+    """
+    from intent_classifier import intent_classifier
+
+    queries = list(INTENT_QUERY_CORPUS)
+    if args.corpus:
+        with open(args.corpus, 'r', encoding='utf-8') as f:
+            queries.extend(line.strip() for line in f if line.strip())
+    if args.chat_history:
+        # Câu hỏi thật của người dùng trong MongoDB
+        from db_connector import mongodb
+        collection = mongodb.get_collection('chat_history')
+        queries.extend(doc['content'] for doc in collection.find(
+            {"is_user": True}, {"content": 1}).sort("created_at", -1).limit(args.chat_history)
+            if doc.get('content'))
+
+    print(f"\n===== PHÂN LOẠI INTENT ({len(queries)} câu hỏi, {args.repeat} lần lặp) =====")
+
+    results = {}
+    for label, func in (("legacy", legacy_classify_query_intent),
+                        ("compiled", lambda q: intent_classifier.classify(q, verbose=False))):
+        start_time = time.perf_counter()
+        for _ in range(args.repeat):
+            outputs = [func(query) for query in queries]
+        elapsed = time.perf_counter() - start_time
+        results[label] = (elapsed * 1e6 / (args.repeat * len(queries)), outputs)
+
+    for label, (per_call_us, _) in results.items():
+        print(f"- {label:<8}: {per_call_us:.1f} µs / câu hỏi")
+    print(f"Nhanh hơn {results['legacy'][0] / max(results['compiled'][0], 1e-9):.1f} lần")
+
+    mismatches = [
+        (query, old['primary_intent'], new['primary_intent'])
+        for query, old, new in zip(queries, results["legacy"][1], results["compiled"][1])
+        if old != new
+    ]
+    print(f"Khớp kết quả: {len(queries) - len(mismatches)}/{len(queries)}")
+    for query, old, new in mismatches[:10]:
+        print(f"  KHÁC: '{query}' -> cũ: {old}, mới: {new}")
+
+
+def _random_vietnamese_names(count, seed=42):
+    """
+    Sinh tên tiếng Việt ngẫu nhiên (có dấu) cho benchmark
+    """
+    rng = random.Random(seed)
+    family = ["Nguyễn", "Trần", "Lê", "Phạm", "Hoàng", "Huỳnh", "Phan", "Vũ", "Võ", "Đặng", "Bùi", "Đỗ"]
+    middle = ["Văn", "Thị", "Hữu", "Đức", "Minh", "Thanh", "Ngọc", "Quang", "Thu", "Xuân", "Gia", "Bảo"]
+    given = ["An", "Bình", "Cường", "Dũng", "Giang", "Hà", "Hải", "Hùng", "Khánh", "Linh", "Long",
+             "Mai", "Nam", "Nghĩa", "Phong", "Phúc", "Quân", "Sơn", "Tâm", "Thảo", "Trang", "Tuấn", "Vy", "Yến"]
+    return [f"{rng.choice(family)} {rng.choice(middle)} {rng.choice(given)} {rng.choice(given)}"
+            for _ in range(count)]
+
+
+def benchmark_fuzzy(args):
+    """
+    So sánh tìm tên gần đúng: duyệt toàn bộ danh sách (cách cũ) và FuzzyNameIndex
+    """
+    import unicodedata
+    from fuzzywuzzy import fuzz
+    from fuzzy_index import FuzzyNameIndex
+
+    users = [{"_id": i, "name": name} for i, name in enumerate(_random_vietnamese_names(args.size))]
+    rng = random.Random(7)
+    queries = []
+    for _ in range(args.queries):
+        name = rng.choice(users)["name"]
+        # Gõ thiếu một ký tự như người dùng thật
+        position = rng.randrange(len(name))
+        queries.append(name[:position] + name[position + 1:])
+
+    print(f"\n===== FUZZY NAME LOOKUP ({args.size} tên, {args.queries} câu hỏi) =====")
+
+    start_time = time.perf_counter()
+    index = FuzzyNameIndex(users, lambda user: user["name"])
+    print(f"Dựng index: {time.perf_counter() - start_time:.2f}s")
+
+    start_time = time.perf_counter()
+    for query in queries:
+        index.search(query, limit=5, score_cutoff=60)
+    indexed_ms = (time.perf_counter() - start_time) * 1000 / len(queries)
+    print(f"- index : {indexed_ms:.3f} ms / câu hỏi")
+
+    def normalize_text(text):
+        text = unicodedata.normalize('NFD', text.lower())
+        return ''.join(c for c in text if not unicodedata.combining(c))
+
+    baseline_queries = queries[:args.baseline_queries]
+    if baseline_queries:
+        start_time = time.perf_counter()
+        for query in baseline_queries:
+            matches = []
+            for user in users:
+                ratio = fuzz.ratio(normalize_text(user["name"]), normalize_text(query))
+                if ratio > 60:
+                    matches.append((user, ratio))
+            matches.sort(key=lambda x: x[1], reverse=True)
+        scan_ms = (time.perf_counter() - start_time) * 1000 / len(baseline_queries)
+        print(f"- scan  : {scan_ms:.3f} ms / câu hỏi ({len(baseline_queries)} câu hỏi)")
+        print(f"Index nhanh hơn {scan_ms / max(indexed_ms, 1e-9):.0f} lần")
+
+
+def benchmark_coalesce(args):
+    """
+    Đợt request dồn dập với LLM giả lập chậm: đếm số lần gọi LLM có / không có SingleFlight
+    """
+    import threading
+    from single_flight import SingleFlight
+
+    rng = random.Random(11)
+    distinct = INTENT_QUERY_CORPUS[:args.distinct]
+    burst = [rng.choice(distinct) for _ in range(args.requests)]
+
+    print(f"\n===== REQUEST COALESCING ({args.requests} request, {len(distinct)} câu hỏi khác nhau, "
+          f"LLM giả lập {args.llm_ms} ms) =====")
+
+    for label, coalescer in (("không gộp", None), ("single-flight", SingleFlight())):
+        response_cache = {}
+        llm_calls = Counter()
+        lock = threading.Lock()
+
+        def answer(query):
+            # Giống send_continue_chat: kiểm tra cache, trượt thì gọi LLM rồi lưu cache
+            if query in response_cache:
+                return response_cache[query]
+            with lock:
+                llm_calls[query] += 1
+            time.sleep(args.llm_ms / 1000)
+            response_cache[query] = f"answer: {query}"
+            return response_cache[query]
+
+        def handle(query):
+            if coalescer is None:
+                return answer(query)
+            return coalescer.do(query.lower().strip(), lambda: answer(query))
+
+        threads = [threading.Thread(target=handle, args=(query,)) for query in burst]
+        start_time = time.perf_counter()
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        elapsed = time.perf_counter() - start_time
+
+        print(f"- {label:<13}: {sum(llm_calls.values())} lần gọi LLM cho {len(llm_calls)} câu hỏi, {elapsed:.2f}s"
+              + (f" {coalescer.stats()}" if coalescer else ""))
+
+
+def _percentile(values, percent):
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(len(ordered) * percent / 100))]
+
+
+def benchmark_swr(args):
+    """
+    Câu hỏi nóng với TTL ngắn: so sánh độ trễ khi mục hết hạn bị xóa (cũ) và stale-while-revalidate
+    """
+    import tempfile
+    import threading
+    from response_cache import ResponseCache
+
+    queries = INTENT_QUERY_CORPUS[:args.hot]
+    print(f"\n===== STALE-WHILE-REVALIDATE ({args.hot} câu hỏi nóng, TTL {args.ttl}s, "
+          f"LLM giả lập {args.llm_ms} ms, {args.threads} thread x {args.seconds}s) =====")
+
+    modes = (("hết hạn = xóa", 0, 0), ("stale-while-revalidate", 1, args.beta))
+    for label, stale_hours, early_refresh_beta in modes:
+        response_cache = ResponseCache(
+            cache_dir=tempfile.mkdtemp(prefix="swr-benchmark-"), max_age_hours=args.ttl / 3600,
+            cleanup_interval_minutes=60, stale_hours=stale_hours, early_refresh_beta=early_refresh_beta
+        )
+        latencies, llm_calls = [], Counter()
+        lock = threading.Lock()
+
+        def generate(query):
+            start_time = time.perf_counter()
+            with lock:
+                llm_calls[query] += 1
+            time.sleep(args.llm_ms / 1000)
+            response = f"answer: {query} @ {time.time():.3f}"
+            response_cache.set(query, response, compute_seconds=time.perf_counter() - start_time)
+            return response
+
+        def worker(seed):
+            rng = random.Random(seed)
+            deadline = time.perf_counter() + args.seconds
+            while time.perf_counter() < deadline:
+                query = rng.choice(queries)
+                start_time = time.perf_counter()
+                if response_cache.get(query, refresh=lambda: generate(query)) is None:
+                    generate(query)
+                with lock:
+                    latencies.append((time.perf_counter() - start_time) * 1000)
+                time.sleep(0.005)
+
+        # Ẩn log của cache cho từng request
+        with contextlib.redirect_stdout(io.StringIO()):
+            threads = [threading.Thread(target=worker, args=(seed,)) for seed in range(args.threads)]
+            for thread in threads:
+                thread.start()
+            for thread in threads:
+                thread.join()
+
+        slow = sum(1 for latency in latencies if latency >= args.llm_ms / 2)
+        print(f"- {label:<22}: p50 {_percentile(latencies, 50):.2f} ms, p99 {_percentile(latencies, 99):.2f} ms, "
+              f"p99.9 {_percentile(latencies, 99.9):.2f} ms, {slow} request chờ LLM, "
+              f"{sum(llm_calls.values())} lần gọi LLM, {len(latencies)} request")
+        print(f"  {response_cache.lookup_stats()}")
+
+
+class _SlowFakeLLM:
+    """
+    LLM giả lập: mỗi lần gọi mất `llm_ms` (chặn thread với invoke, không chặn với ainvoke)
+    """
+    class _Message:
+        def __init__(self, content):
+            self.content = content
+
+    def __init__(self, llm_ms):
+        self.llm_seconds = llm_ms / 1000
+
+    def invoke(self, prompt):
+        time.sleep(self.llm_seconds)
+        return self._Message(f"answer: {prompt}")
+
+    async def ainvoke(self, prompt):
+        import asyncio
+        await asyncio.sleep(self.llm_seconds)
+        return self._Message(f"answer: {prompt}")
+
+
+def benchmark_async(args):
+    """
+    Throughput khi tăng số request đồng thời với cùng số thread:
+    pipeline chạy trọn trên worker thread (như Flask) và pipeline async (LLM chờ trên event loop)
+    """
+    import asyncio
+    from concurrent.futures import ThreadPoolExecutor
+    from async_pipeline import LLMCall, run_pipeline, AsyncPipelineRunner
+
+    llm = _SlowFakeLLM(args.llm_ms)
+
+    def steps(query):
+        # Phần đồng bộ giả lập (cache, MongoDB, FAISS) rồi một lần gọi LLM
+        time.sleep(args.work_ms / 1000)
+        answer = yield LLMCall(query)
+        return answer
+
+    print(f"\n===== ASYNC PIPELINE ({args.threads} thread, LLM giả lập {args.llm_ms} ms, "
+          f"xử lý đồng bộ {args.work_ms} ms, {args.per_client} request mỗi client) =====")
+
+    for concurrency in args.concurrency:
+        total = concurrency * args.per_client
+
+        with ThreadPoolExecutor(max_workers=args.threads) as pool:
+            start_time = time.perf_counter()
+            futures = [pool.submit(run_pipeline, steps(f"q{i}"), llm) for i in range(total)]
+            for future in futures:
+                future.result()
+            threaded_rps = total / (time.perf_counter() - start_time)
+
+        runner = AsyncPipelineRunner(llm, max_workers=args.threads)
+
+        async def client(client_id):
+            for i in range(args.per_client):
+                await runner.run(steps(f"q{client_id}-{i}"))
+
+        async def run_clients():
+            await asyncio.gather(*(client(client_id) for client_id in range(concurrency)))
+
+        start_time = time.perf_counter()
+        asyncio.run(run_clients())
+        async_rps = total / (time.perf_counter() - start_time)
+        runner.executor.shutdown()
+
+        print(f"- {concurrency:>4} request đồng thời: worker thread {threaded_rps:7.1f} req/s, "
+              f"async {async_rps:7.1f} req/s")
+
+
+class _QuotaFakeLLM:
+    """
+    LLM giả lập có quota: quá `quota` lần gọi đồng thời thì lỗi sau `error_ms`, tự retry `max_retries` lần
+    (như `max_retries` của ChatGoogleGenerativeAI)
+    """
+    def __init__(self, llm_ms, quota, max_retries=3, error_ms=50):
+        import threading
+        self.llm_seconds = llm_ms / 1000
+        self.error_seconds = error_ms / 1000
+        self.quota = quota
+        self.max_retries = max_retries
+        self._lock = threading.Lock()
+        self._in_flight = 0
+        self.attempts = 0
+        self.quota_errors = 0
+
+    def invoke(self, prompt):
+        for attempt in range(self.max_retries + 1):
+            with self._lock:
+                self.attempts += 1
+                self._in_flight += 1
+                over_quota = self._in_flight > self.quota
+            try:
+                if not over_quota:
+                    time.sleep(self.llm_seconds)
+                    return _SlowFakeLLM._Message(f"answer: {prompt}")
+                time.sleep(self.error_seconds)
+                with self._lock:
+                    self.quota_errors += 1
+            finally:
+                with self._lock:
+                    self._in_flight -= 1
+            # Backoff giữa các lần retry
+            time.sleep(self.error_seconds * (2 ** attempt))
+        raise RuntimeError("429 Resource has been exhausted")
+
+
+def benchmark_gateway(args):
+    """
+    Đợt request tăng đột biến vượt quota Gemini: so sánh khi mọi request gọi thẳng LLM và khi qua LLMGateway
+    """
+    from concurrent.futures import ThreadPoolExecutor
+    from async_pipeline import LLMCall, run_pipeline
+    from llm_gateway import LLMGateway, LLMOverloadedError
+
+    print(f"\n===== LLM GATEWAY ({args.requests} request đồng thời, quota {args.quota} lần gọi đồng thời, "
+          f"LLM giả lập {args.llm_ms} ms, hàng đợi {args.queue}, chờ tối đa {args.wait}s) =====")
+
+    def steps(query):
+        try:
+            answer = yield LLMCall(query)
+        except Exception:
+            answer = None  # Pipeline trả câu trả lời lỗi chung
+        return answer
+
+    gateways = (("gọi thẳng", None), ("qua gateway", LLMGateway(args.quota, args.queue, args.wait)))
+    for label, gateway in gateways:
+        llm = _QuotaFakeLLM(args.llm_ms, args.quota)
+        outcomes = {"ok": [], "error": [], "busy": []}
+
+        def handle(query):
+            start_time = time.perf_counter()
+            try:
+                kind = "ok" if run_pipeline(steps(query), llm, gateway=gateway) else "error"
+            except LLMOverloadedError:
+                kind = "busy"
+            outcomes[kind].append((time.perf_counter() - start_time) * 1000)
+
+        start_time = time.perf_counter()
+        with ThreadPoolExecutor(max_workers=args.requests) as pool:
+            list(pool.map(handle, [f"q{i}" for i in range(args.requests)]))
+        elapsed = time.perf_counter() - start_time
+
+        def describe(latencies):
+            if not latencies:
+                return "0"
+            return f"{len(latencies)} (p50 {_percentile(latencies, 50):.0f} ms, p99 {_percentile(latencies, 99):.0f} ms)"
+
+        print(f"- {label:<11}: trả lời được {describe(outcomes['ok'])}, lỗi {describe(outcomes['error'])}, "
+              f"từ chối sớm {describe(outcomes['busy'])}")
+        print(f"  {llm.attempts} lần gửi đến Gemini, {llm.quota_errors} lỗi quota, {elapsed:.2f}s"
+              + (f", {gateway.stats()}" if gateway else ""))
+
+
+class _HangingFakeLLM:
+    """
+    LLM giả lập: đa số lần gọi mất `llm_ms`, một tỷ lệ `hang_rate` treo `hang_ms` (timeout + retry của Gemini)
+    """
+    def __init__(self, llm_ms, hang_ms, hang_rate, seed=5):
+        import threading
+        self.llm_seconds = llm_ms / 1000
+        self.hang_seconds = hang_ms / 1000
+        self.hang_rate = hang_rate
+        self._rng = random.Random(seed)
+        self._lock = threading.Lock()
+
+    def invoke(self, prompt):
+        with self._lock:
+            hang = self._rng.random() < self.hang_rate
+        time.sleep(self.hang_seconds if hang else self.llm_seconds)
+        return _SlowFakeLLM._Message(f"answer: {prompt}")
+
+
+def benchmark_deadline(args):
+    """
+    Độ trễ đuôi khi LLM thỉnh thoảng treo: không giới hạn và có thời hạn request
+    (quá hạn thì trả lời bằng dữ liệu đã truy xuất)
+    """
+    from concurrent.futures import ThreadPoolExecutor
+    from async_pipeline import LLMCall, run_pipeline
+    from deadline import Deadline
+
+    print(f"\n===== DEADLINE ({args.requests} request, {args.threads} thread, LLM giả lập {args.llm_ms} ms, "
+          f"{args.hang_rate:.0%} treo {args.hang_ms} ms, thời hạn {args.deadline}s) =====")
+
+    def steps(query):
+        answer = yield LLMCall(query, fallback=lambda: "degraded")
+        return answer
+
+    for label, deadline_seconds in (("không giới hạn", None), ("có thời hạn", args.deadline)):
+        llm = _HangingFakeLLM(args.llm_ms, args.hang_ms, args.hang_rate)
+        latencies, degraded = [], []
+
+        def handle(query):
+            start_time = time.perf_counter()
+            deadline = Deadline(deadline_seconds) if deadline_seconds else None
+            answer = run_pipeline(steps(query), llm, deadline=deadline)
+            latencies.append((time.perf_counter() - start_time) * 1000)
+            if answer == "degraded":
+                degraded.append(query)
+
+        with contextlib.redirect_stdout(io.StringIO()):
+            with ThreadPoolExecutor(max_workers=args.threads) as pool:
+                list(pool.map(handle, [f"q{i}" for i in range(args.requests)]))
+
+        print(f"- {label:<14}: p50 {_percentile(latencies, 50):.0f} ms, p99 {_percentile(latencies, 99):.0f} ms, "
+              f"max {max(latencies):.0f} ms, {len(degraded)} câu trả lời dựng từ dữ liệu đã truy xuất")
+
+
+def benchmark_hybrid(args):
+    """
+    Độ trễ bước truy xuất khi tìm kiếm vector và tìm kiếm từ khóa chạy tuần tự / song song,
+    và độ phủ của kết quả gộp RRF so với chỉ tìm kiếm vector
+    """
+    from hybrid_retriever import HybridRetriever, reciprocal_rank_fusion
+
+    print(f"\n===== HYBRID ({args.queries} câu hỏi, vector {args.vector_ms} ms, từ khóa {args.keyword_ms} ms) =====")
+    rng = random.Random(11)
+    course_ids = [f"c{i}" for i in range(200)]
+    cases = []
+    for _ in range(args.queries):
+        relevant = rng.sample(course_ids, 6)
+        # Vector search bỏ sót một phần khóa học liên quan (tên riêng, từ viết tắt), từ khóa bỏ sót phần khác
+        vector_hits = relevant[:4] + rng.sample(course_ids, 6)
+        keyword_hits = relevant[2:] + rng.sample(course_ids, 2)
+        cases.append((set(relevant), vector_hits, keyword_hits))
+
+    def vector_search(case):
+        time.sleep(args.vector_ms / 1000)
+        return case[1]
+
+    def keyword_search(case):
+        time.sleep(args.keyword_ms / 1000)
+        return case[2]
+
+    def recall(results, relevant):
+        return len(relevant & set(results)) / len(relevant)
+
+    start_time = time.perf_counter()
+    with contextlib.redirect_stdout(io.StringIO()):
+        serial = [reciprocal_rank_fusion([vector_search(case), keyword_search(case)], key=str)[:10] for case in cases]
+    serial_ms = (time.perf_counter() - start_time) * 1000 / len(cases)
+
+    retriever = HybridRetriever({"vector": vector_search, "keyword": keyword_search}, key=str, max_results=10)
+    start_time = time.perf_counter()
+    with contextlib.redirect_stdout(io.StringIO()):
+        parallel = [retriever.retrieve(case) for case in cases]
+    parallel_ms = (time.perf_counter() - start_time) * 1000 / len(cases)
+    retriever.executor.shutdown()
+
+    vector_recall = sum(recall(case[1][:10], case[0]) for case in cases) / len(cases)
+    fused_recall = sum(recall(results, case[0]) for results, case in zip(parallel, cases)) / len(cases)
+    assert serial == parallel
+    print(f"- tuần tự : {serial_ms:.1f} ms / câu hỏi")
+    print(f"- song song: {parallel_ms:.1f} ms / câu hỏi")
+    print(f"- độ phủ top 10: chỉ vector {vector_recall:.0%}, gộp RRF {fused_recall:.0%}")
+
+
+class _FakeChatCollection:
+    """
+    Collection giả lập: mỗi lần gọi mất một round trip `rtt_ms`, insert_many thêm `per_doc_ms` cho mỗi document
+    """
+    def __init__(self, rtt_ms, per_doc_ms):
+        import threading
+        self.rtt_seconds = rtt_ms / 1000
+        self.per_doc_seconds = per_doc_ms / 1000
+        self.documents = []
+        self.documents_by_user = {}
+        self.calls = 0
+        self.busy_seconds = 0.0
+        self._lock = threading.Lock()
+
+    def insert_one(self, document):
+        self.insert_many([document])
+
+    def insert_many(self, documents, ordered=True):
+        duration = self.rtt_seconds + self.per_doc_seconds * len(documents)
+        time.sleep(duration)
+        with self._lock:
+            self.calls += 1
+            self.busy_seconds += duration
+            self.documents.extend(documents)
+            for document in documents:
+                self.documents_by_user.setdefault(document["user_id"], []).append(document)
+
+
+def benchmark_writes(args):
+    """
+    Độ trễ ghi trên đường trả lời và throughput ghi: hai insert_one mỗi lượt / write-behind theo lô
+    """
+    from concurrent.futures import ThreadPoolExecutor
+    from chat_writer import ChatHistoryWriter
+
+    total = args.threads * args.exchanges
+    print(f"\n===== WRITES ({total} lượt hỏi đáp, {args.threads} thread, round trip {args.rtt_ms} ms) =====")
+
+    def exchange_documents(user, i):
+        now = time.time()
+        return [{"_id": f"{user}:{i}:{is_user}", "user_id": str(user), "session_number": 1,
+                 "created_at": now, "is_user": is_user} for is_user in (True, False)]
+
+    for label in ("insert_one", "write-behind"):
+        collection = _FakeChatCollection(args.rtt_ms, args.per_doc_ms)
+        writer = ChatHistoryWriter(lambda: collection, batch_size=args.batch_size,
+                                   flush_interval=args.flush_ms / 1000)
+        latencies, overlay_misses = [], []
+
+        def run_user(user):
+            for i in range(args.exchanges):
+                # Thời gian sinh câu trả lời giữa hai lần ghi
+                time.sleep(args.think_ms / 1000)
+                documents = exchange_documents(user, i)
+                start_time = time.perf_counter()
+                if label == "insert_one":
+                    for document in documents:
+                        collection.insert_one(document)
+                else:
+                    writer.add(documents)
+                latencies.append((time.perf_counter() - start_time) * 1000)
+                if label == "write-behind":
+                    # Lượt sau phải thấy tin nhắn vừa ghi (MongoDB hoặc bộ đệm)
+                    pending = writer.pending(user, 1)
+                    stored = list(collection.documents_by_user.get(str(user), []))
+                    if len(writer.merge(stored, pending)) < 2 * (i + 1):
+                        overlay_misses.append(i)
+
+        with contextlib.redirect_stdout(io.StringIO()):
+            with ThreadPoolExecutor(max_workers=args.threads) as pool:
+                list(pool.map(run_user, range(args.threads)))
+            writer.close()
+
+        assert len(collection.documents) == 2 * total
+        print(f"- {label:<12}: ghi trên đường trả lời p50 {_percentile(latencies, 50):.2f} ms, "
+              f"p99 {_percentile(latencies, 99):.2f} ms; {collection.calls} lần gọi MongoDB, "
+              f"{2 * total / collection.busy_seconds:.0f} tin nhắn / giây MongoDB bận" +
+              (f", {len(overlay_misses)} lượt thiếu lịch sử" if label == "write-behind" else ""))
+
+
+def benchmark_conversations(args):
+    """
+    Số lần đọc MongoDB và thời gian lấy lịch sử hội thoại mỗi lượt: đọc lại cả session / cache write-through
+    """
+    from conversation_cache import ConversationCache
+
+    print(f"\n===== CONVERSATIONS ({args.users} người dùng x {args.turns} lượt, "
+          f"đọc MongoDB {args.rtt_ms} ms + {args.per_doc_ms} ms/tin nhắn) =====")
+    stored = {}
+    reads = []
+
+    def read_session(key):
+        time.sleep((args.rtt_ms + args.per_doc_ms * len(stored.get(key, []))) / 1000)
+        reads.append(key)
+        return list(stored.get(key, []))
+
+    for label, cache in (("MongoDB", None), ("cache", ConversationCache())):
+        stored.clear()
+        reads.clear()
+        latencies = []
+        for turn in range(args.turns):
+            for user in range(args.users):
+                key = (str(user), 1)
+                start_time = time.perf_counter()
+                if cache is None:
+                    history = read_session(key)
+                else:
+                    if turn == 0:
+                        cache.start(*key)
+                    history = cache.get(*key)
+                    if history is None:
+                        cache.begin_load(*key)
+                        history = read_session(key)
+                        cache.finish_load(*key, history)
+                latencies.append((time.perf_counter() - start_time) * 1000)
+                assert len(history) == 2 * turn
+                messages = [f"user {turn}", f"bot {turn}"]
+                stored.setdefault(key, []).extend(messages)
+                if cache is not None:
+                    cache.append(*key, messages)
+        print(f"- {label:<8}: {len(reads)} lần đọc MongoDB, lấy lịch sử p50 {_percentile(latencies, 50):.2f} ms, "
+              f"p99 {_percentile(latencies, 99):.2f} ms")
+
+
+def benchmark_history(args):
+    """
+    Số token lịch sử hội thoại đưa vào prompt ở mỗi lượt: toàn bộ session / cửa sổ + tóm tắt cuốn chiếu
+    """
+    from types import SimpleNamespace
+    from history_window import HistoryWindow, estimate_tokens
+
+    print(f"\n===== HISTORY ({args.turns} lượt, câu trả lời ~{args.answer_chars} ký tự, "
+          f"cửa sổ {args.max_turns} lượt / {args.token_budget} token) =====")
+
+    def summarize(previous_summary, messages):
+        # Bản tóm tắt giả lập có độ dài cố định
+        return "tóm tắt " * 60
+
+    window = HistoryWindow(summarize=summarize, max_turns=args.max_turns, token_budget=args.token_budget)
+    chat_history = []
+    with contextlib.redirect_stdout(io.StringIO()):
+        rows = []
+        for turn in range(1, args.turns + 1):
+            summary, recent = window.build(chat_history)
+            # Chờ bản tóm tắt nền để lượt sau dùng được
+            window.executor.submit(lambda: None).result()
+            before = sum(estimate_tokens(chat.content) for chat in chat_history)
+            after = estimate_tokens(summary) + sum(estimate_tokens(chat.content) for chat in recent)
+            rows.append((turn, before, after, summary is not None))
+            chat_history.append(SimpleNamespace(id=f"u{turn}", is_user=True, content="Câu hỏi về khóa học " * 4))
+            chat_history.append(SimpleNamespace(id=f"b{turn}", is_user=False, content="x" * args.answer_chars))
+    window.executor.shutdown()
+
+    for turn, before, after, summarized in rows:
+        print(f"- lượt {turn:>2}: toàn bộ ~{before:>5} token, cửa sổ ~{after:>5} token{' (có tóm tắt)' if summarized else ''}")
+    print(f"  {window.stats()}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Đo hiệu năng LMS-RAG-Chatbot")
+    subparsers = parser.add_subparsers(dest="command", required=True)
+
+    startup_parser = subparsers.add_parser("startup", help="Thời gian khởi tạo vector store")
+    startup_parser.add_argument("--repeat", type=int, default=1, help="Số lần lặp mỗi chế độ")
+    startup_parser.set_defaults(func=benchmark_startup)
+
+    preprocess_parser = subparsers.add_parser("preprocess", help="Số round trip MongoDB khi tiền xử lý")
+    preprocess_parser.set_defaults(func=benchmark_preprocess)
+
+    fuzzy_parser = subparsers.add_parser("fuzzy", help="Thời gian tìm tên gần đúng")
+    fuzzy_parser.add_argument("--size", type=int, default=100000, help="Số tên trong index")
+    fuzzy_parser.add_argument("--queries", type=int, default=1000, help="Số câu hỏi tìm kiếm")
+    fuzzy_parser.add_argument("--baseline-queries", type=int, default=3,
+                              help="Số câu hỏi chạy với cách duyệt toàn bộ (chậm)")
+    fuzzy_parser.set_defaults(func=benchmark_fuzzy)
+
+    intent_parser = subparsers.add_parser("intent", help="Độ trễ và độ khớp phân loại intent")
+    intent_parser.add_argument("--repeat", type=int, default=200, help="Số lần lặp toàn bộ corpus")
+    intent_parser.add_argument("--corpus", help="File câu hỏi bổ sung (mỗi dòng một câu)")
+    intent_parser.add_argument("--chat-history", type=int, default=0,
+                               help="Thêm N câu hỏi gần nhất của người dùng từ MongoDB chat_history")
+    intent_parser.set_defaults(func=benchmark_intent)
+
+    coalesce_parser = subparsers.add_parser("coalesce", help="Số lần gọi LLM khi có đợt request giống nhau")
+    coalesce_parser.add_argument("--requests", type=int, default=200, help="Số request đồng thời")
+    coalesce_parser.add_argument("--distinct", type=int, default=5, help="Số câu hỏi khác nhau")
+    coalesce_parser.add_argument("--llm-ms", type=int, default=500, help="Độ trễ LLM giả lập (ms)")
+    coalesce_parser.set_defaults(func=benchmark_coalesce)
+
+    swr_parser = subparsers.add_parser("swr", help="Độ trễ p99 qua các thời điểm cache hết hạn")
+    swr_parser.add_argument("--hot", type=int, default=5, help="Số câu hỏi nóng")
+    swr_parser.add_argument("--ttl", type=float, default=2.0, help="TTL của cache (giây)")
+    swr_parser.add_argument("--llm-ms", type=int, default=300, help="Độ trễ LLM giả lập (ms)")
+    swr_parser.add_argument("--threads", type=int, default=8, help="Số thread gửi request")
+    swr_parser.add_argument("--seconds", type=float, default=10, help="Thời gian chạy mỗi chế độ (giây)")
+    swr_parser.add_argument("--beta", type=float, default=1.0, help="Hệ số làm mới sớm theo xác suất")
+    swr_parser.set_defaults(func=benchmark_swr)
+
+    async_parser = subparsers.add_parser("async", help="Throughput theo số request đồng thời")
+    async_parser.add_argument("--threads", type=int, default=8, help="Số worker thread / thread của executor")
+    async_parser.add_argument("--concurrency", type=int, nargs="+", default=[8, 32, 128, 256],
+                              help="Các mức request đồng thời")
+    async_parser.add_argument("--per-client", type=int, default=4, help="Số request mỗi client")
+    async_parser.add_argument("--llm-ms", type=int, default=300, help="Độ trễ LLM giả lập (ms)")
+    async_parser.add_argument("--work-ms", type=float, default=2, help="Thời gian xử lý đồng bộ mỗi request (ms)")
+    async_parser.set_defaults(func=benchmark_async)
+
+    gateway_parser = subparsers.add_parser("gateway", help="Đợt tăng đột biến vượt quota Gemini")
+    gateway_parser.add_argument("--requests", type=int, default=200, help="Số request đồng thời")
+    gateway_parser.add_argument("--quota", type=int, default=8, help="Số lần gọi Gemini đồng thời tối đa")
+    gateway_parser.add_argument("--queue", type=int, default=32, help="Độ dài hàng đợi của gateway")
+    gateway_parser.add_argument("--wait", type=float, default=2, help="Thời gian chờ tối đa trong hàng đợi (giây)")
+    gateway_parser.add_argument("--llm-ms", type=int, default=300, help="Độ trễ LLM giả lập (ms)")
+    gateway_parser.set_defaults(func=benchmark_gateway)
+
+    deadline_parser = subparsers.add_parser("deadline", help="Độ trễ p99 khi LLM thỉnh thoảng treo")
+    deadline_parser.add_argument("--requests", type=int, default=400, help="Số request")
+    deadline_parser.add_argument("--threads", type=int, default=32, help="Số request đồng thời")
+    deadline_parser.add_argument("--llm-ms", type=int, default=300, help="Độ trễ LLM thông thường (ms)")
+    deadline_parser.add_argument("--hang-ms", type=int, default=8000, help="Độ trễ khi LLM treo (ms)")
+    deadline_parser.add_argument("--hang-rate", type=float, default=0.03, help="Tỷ lệ lần gọi bị treo")
+    deadline_parser.add_argument("--deadline", type=float, default=2.0, help="Thời hạn mỗi request (giây)")
+    deadline_parser.set_defaults(func=benchmark_deadline)
+
+    hybrid_parser = subparsers.add_parser("hybrid", help="Tìm kiếm vector + từ khóa tuần tự / song song")
+    hybrid_parser.add_argument("--queries", type=int, default=50, help="Số câu hỏi")
+    hybrid_parser.add_argument("--vector-ms", type=int, default=40, help="Độ trễ tìm kiếm vector giả lập (ms)")
+    hybrid_parser.add_argument("--keyword-ms", type=int, default=30, help="Độ trễ tìm kiếm từ khóa giả lập (ms)")
+    hybrid_parser.set_defaults(func=benchmark_hybrid)
+
+    writes_parser = subparsers.add_parser("writes", help="Ghi lịch sử chat: insert_one / write-behind theo lô")
+    writes_parser.add_argument("--threads", type=int, default=32, help="Số request đồng thời")
+    writes_parser.add_argument("--exchanges", type=int, default=50, help="Số lượt hỏi đáp mỗi thread")
+    writes_parser.add_argument("--think-ms", type=float, default=20, help="Thời gian sinh câu trả lời giả lập (ms)")
+    writes_parser.add_argument("--rtt-ms", type=float, default=2.0, help="Round trip MongoDB giả lập (ms)")
+    writes_parser.add_argument("--per-doc-ms", type=float, default=0.02, help="Chi phí ghi mỗi document (ms)")
+    writes_parser.add_argument("--batch-size", type=int, default=100, help="Số tin nhắn mỗi lô")
+    writes_parser.add_argument("--flush-ms", type=float, default=200, help="Chu kỳ ghi của write-behind (ms)")
+    writes_parser.set_defaults(func=benchmark_writes)
+
+    conversations_parser = subparsers.add_parser("conversations", help="Đọc lịch sử hội thoại: MongoDB / cache")
+    conversations_parser.add_argument("--users", type=int, default=50, help="Số người dùng")
+    conversations_parser.add_argument("--turns", type=int, default=8, help="Số lượt hỏi đáp mỗi người dùng")
+    conversations_parser.add_argument("--rtt-ms", type=float, default=2.0, help="Round trip MongoDB giả lập (ms)")
+    conversations_parser.add_argument("--per-doc-ms", type=float, default=0.05, help="Chi phí đọc mỗi tin nhắn (ms)")
+    conversations_parser.set_defaults(func=benchmark_conversations)
+
+    history_parser = subparsers.add_parser("history", help="Số token lịch sử trong prompt theo từng lượt")
+    history_parser.add_argument("--turns", type=int, default=8, help="Số lượt hỏi đáp")
+    history_parser.add_argument("--answer-chars", type=int, default=2400, help="Độ dài câu trả lời của bot (ký tự)")
+    history_parser.add_argument("--max-turns", type=int, default=3, help="Số lượt tối đa gửi nguyên văn")
+    history_parser.add_argument("--token-budget", type=int, default=1200, help="Ngân sách token cho lịch sử")
+    history_parser.set_defaults(func=benchmark_history)
+
+    args = parser.parse_args()
+    args.func(args)
+
+
+if __name__ == "__main__":
+    main()
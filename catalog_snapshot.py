@@ -0,0 +1,491 @@
+"""
+Catalog Snapshot - Bản sao dữ liệu khóa học / giảng viên trong bộ nhớ
+Cải tiến độ trễ cho LMS-RAG-Chatbot: các xử lý theo intent tra cứu dict thay vì truy vấn MongoDB
+"""
+
+import os
+import re
+import threading
+import time
+from collections import deque
+from datetime import datetime
+from functools import lru_cache
+
+from bson import ObjectId
+
+from db_connector import mongodb
+from fuzzy_index import FuzzyNameIndex, normalize_catalog_text
+
+_OBJECT_ID_PATTERN = re.compile(r'\b[0-9a-f]{24}\b', re.IGNORECASE)
+
+# Tên ngắn hơn ngưỡng này không được dùng để nhận diện khóa học / giảng viên trong văn bản
+MIN_MENTIONED_NAME_LENGTH = 4
+
+
+@lru_cache(maxsize=512)
+def _compile_pattern(fragment):
+    """
+    Biên dịch chuỗi tìm kiếm giống `$regex` với option "i" của MongoDB
+    (chuỗi không phải regex hợp lệ được so khớp nguyên văn)
+    """
+    try:
+        return re.compile(fragment, re.IGNORECASE)
+    except re.error:
+        return re.compile(re.escape(fragment), re.IGNORECASE)
+
+
+def _as_list(value):
+    if value is None:
+        return []
+    if isinstance(value, (list, tuple)):
+        return list(value)
+    return [value]
+
+
+def _to_object_ids(ids):
+    object_ids = []
+    for entity_id in ids:
+        try:
+            object_ids.append(ObjectId(entity_id))
+        except Exception:
+            object_ids.append(entity_id)
+    return object_ids
+
+
+def _index_by(index, keys, item):
+    for key in keys:
+        key = normalize_catalog_text(key) if isinstance(key, str) else key
+        if key:
+            index.setdefault(key, []).append(item)
+
+
+def _replace_documents(documents, scope_ids, replacements):
+    """
+    Thay các document có id trong `scope_ids` bằng bản mới (giữ nguyên vị trí), xóa các id
+    không còn bản mới và thêm document mới vào cuối
+    """
+    scope_ids = {str(document_id) for document_id in scope_ids}
+    replacements_by_id = {str(document['_id']): document for document in replacements}
+    results = []
+    for document in documents:
+        document_id = str(document['_id'])
+        if document_id not in scope_ids:
+            results.append(document)
+        elif document_id in replacements_by_id:
+            results.append(replacements_by_id.pop(document_id))
+    results.extend(replacements_by_id.values())
+    return results
+
+
+class _NameMatcher:
+    """
+    Automaton Aho-Corasick trên tên đã chuẩn hóa: tìm mọi tên xuất hiện trong văn bản
+    (kể cả các tên lồng nhau / chồng lên nhau) trong một lần duyệt văn bản
+
+    Args:
+        names: Danh sách (tên, giá trị); `find` trả về giá trị của các tên được tìm thấy
+    """
+    def __init__(self, names):
+        self._goto = [{}]
+        self._fail = [0]
+        self._output = [[]]
+        for name, value in names:
+            node = 0
+            for ch in name:
+                next_node = self._goto[node].get(ch)
+                if next_node is None:
+                    next_node = len(self._goto)
+                    self._goto[node][ch] = next_node
+                    self._goto.append({})
+                    self._fail.append(0)
+                    self._output.append([])
+                node = next_node
+            self._output[node].append(value)
+
+        # Liên kết fail theo chiều rộng: node nông hơn luôn được xử lý trước
+        queue = deque(self._goto[0].values())
+        while queue:
+            node = queue.popleft()
+            for ch, child in self._goto[node].items():
+                fail = self._fail[node]
+                while fail and ch not in self._goto[fail]:
+                    fail = self._fail[fail]
+                self._fail[child] = self._goto[fail].get(ch, 0)
+                self._output[child] = self._output[child] + self._output[self._fail[child]]
+                queue.append(child)
+
+    def find(self, text):
+        values = []
+        node = 0
+        for ch in text:
+            while node and ch not in self._goto[node]:
+                node = self._fail[node]
+            node = self._goto[node].get(ch, 0)
+            values.extend(self._output[node])
+        return values
+
+
+class CatalogSnapshot:
+    """
+    Các index dạng dict trên toàn bộ khóa học active, giảng viên và user của giảng viên
+
+    Snapshot không bao giờ bị sửa sau khi tạo: làm mới dữ liệu là tạo snapshot mới
+    rồi đổi tham chiếu, nên các request đang đọc snapshot cũ không bị ảnh hưởng.
+    """
+    def __init__(self, courses, mentors):
+        self.loaded_time = datetime.now()
+
+        # Giữ nguyên thứ tự MongoDB trả về để kết quả giống với truy vấn trực tiếp
+        self.course_list = list(courses)
+        self.mentor_list = list(mentors)
+
+        self.courses_by_id = {str(course['_id']): course for course in self.course_list}
+        self.mentors_by_id = {str(mentor['_id']): mentor for mentor in self.mentor_list}
+
+        # User của giảng viên đã được $lookup sẵn trong `userInfo`
+        self.users_by_id = {}
+        self.mentor_by_user_id = {}
+        for mentor in self.mentor_list:
+            user = mentor.get('userInfo')
+            if user and user.get('_id') is not None:
+                self.users_by_id[str(user['_id'])] = user
+            if mentor.get('user') is not None:
+                self.mentor_by_user_id[str(mentor['user'])] = mentor
+        self.user_list = list(self.users_by_id.values())
+
+        self.courses_by_name = {}
+        self.courses_by_category = {}
+        self.courses_by_tag = {}
+        self.courses_by_level = {}
+        self.courses_by_mentor = {}
+        for course in self.course_list:
+            _index_by(self.courses_by_name, [course.get('name')], course)
+            _index_by(self.courses_by_category, _as_list(course.get('categories')), course)
+            _index_by(self.courses_by_tag, _as_list(course.get('tags')), course)
+            _index_by(self.courses_by_level, [course.get('level')], course)
+            if course.get('mentor') is not None:
+                self.courses_by_mentor.setdefault(str(course['mentor']), []).append(course)
+
+        self.users_by_name = {}
+        for user in self.user_list:
+            _index_by(self.users_by_name, [user.get('name')], user)
+
+        self.mentors_by_specialization = {}
+        for mentor in self.mentor_list:
+            _index_by(self.mentors_by_specialization, _as_list(mentor.get('specialization')), mentor)
+
+        # Tên khóa học / giảng viên -> key entity, dùng để tìm entity được nhắc đến trong câu trả lời
+        mentioned_names = []
+        for name, courses in self.courses_by_name.items():
+            if len(name) >= MIN_MENTIONED_NAME_LENGTH:
+                mentioned_names.append((name, [f"course:{course['_id']}" for course in courses]))
+        for name, users in self.users_by_name.items():
+            if len(name) >= MIN_MENTIONED_NAME_LENGTH:
+                mentors = [self.mentor_by_user_id.get(str(user['_id'])) for user in users]
+                mentioned_names.append((name, [f"mentor:{mentor['_id']}" for mentor in mentors if mentor is not None]))
+        self._name_matcher = _NameMatcher(mentioned_names)
+
+        # Index tên gần đúng cho các trường hợp không khớp chính xác
+        self.user_name_index = FuzzyNameIndex(self.user_list, lambda user: user.get('name'))
+        self.course_name_index = FuzzyNameIndex(self.course_list, lambda course: course.get('name'))
+
+    @classmethod
+    def load(cls):
+        """
+        Tạo snapshot từ MongoDB: một aggregation cho khóa học và một cho giảng viên
+        """
+        return cls(mongodb.get_courses(limit=None), mongodb.get_mentors(limit=None))
+
+    def with_changes(self, course_ids, mentor_ids, courses, mentors):
+        """
+        Tạo snapshot mới từ snapshot này, chỉ thay các khóa học / giảng viên trong phạm vi thay đổi
+
+        Args:
+            course_ids, mentor_ids: Id các khóa học / giảng viên đã được đọc lại; id không có
+                trong `courses` / `mentors` bị coi là đã xóa (hoặc không còn active)
+            courses, mentors: Document mới (cùng dạng với `load()`) của các id trên
+
+        Returns:
+            CatalogSnapshot: Snapshot mới (snapshot hiện tại không bị sửa)
+        """
+        return CatalogSnapshot(
+            _replace_documents(self.course_list, course_ids, courses),
+            _replace_documents(self.mentor_list, mentor_ids, mentors)
+        )
+
+    def stats(self):
+        return {
+            'courses': len(self.course_list),
+            'mentors': len(self.mentor_list),
+            'users': len(self.user_list),
+            'loaded_time': self.loaded_time.isoformat()
+        }
+
+    def mentioned_entity_keys(self, text):
+        """
+        Key ("course:<id>" / "mentor:<id>") của các khóa học / giảng viên được nhắc đến
+        trong văn bản, theo id hoặc theo tên (không phân biệt dấu)
+        """
+        if not text:
+            return set()
+
+        keys = set()
+        for object_id in _OBJECT_ID_PATTERN.findall(text):
+            object_id = object_id.lower()
+            if object_id in self.courses_by_id:
+                keys.add(f"course:{object_id}")
+            elif object_id in self.mentors_by_id:
+                keys.add(f"mentor:{object_id}")
+
+        for entity_keys in self._name_matcher.find(normalize_catalog_text(text)):
+            keys.update(entity_keys)
+        return keys
+
+    # ----- Khóa học -----
+
+    def get_course(self, course_id):
+        return self.courses_by_id.get(str(course_id))
+
+    def active_courses(self, limit=None):
+        return self.course_list[:limit] if limit else list(self.course_list)
+
+    def find_courses_by_name(self, fragment, limit=None):
+        """
+        Khóa học có tên chứa `fragment` (như `{"name": {"$regex": fragment, "$options": "i"}}`)
+        """
+        pattern = _compile_pattern(fragment)
+        results = [course for course in self.course_list if pattern.search(course.get('name') or '')]
+        # Khóa học trùng tên hoàn toàn (không phân biệt dấu) luôn được giữ lại, xếp trước
+        exact = self.courses_by_name.get(normalize_catalog_text(fragment), [])
+        if exact:
+            exact_ids = {id(course) for course in exact}
+            results = exact + [course for course in results if id(course) not in exact_ids]
+        return results[:limit] if limit else results
+
+    def find_courses_by_name_keywords(self, keywords, limit=None):
+        """
+        Khóa học có tên chứa TẤT CẢ các từ khóa
+        """
+        patterns = [_compile_pattern(keyword) for keyword in keywords]
+        if not patterns:
+            return []
+        results = [
+            course for course in self.course_list
+            if all(pattern.search(course.get('name') or '') for pattern in patterns)
+        ]
+        return results[:limit] if limit else results
+
+    def search_courses(self, keyword, limit=None):
+        """
+        Tìm khóa học theo từ khóa trong tên, mô tả, tags (giống `mongodb.search_courses`)
+        """
+        pattern = _compile_pattern(keyword)
+        results = []
+        for course in self.course_list:
+            fields = [course.get('name'), course.get('description')] + _as_list(course.get('tags'))
+            if any(isinstance(field, str) and pattern.search(field) for field in fields):
+                results.append(course)
+                if limit and len(results) >= limit:
+                    break
+        print(f"Đã tìm thấy {len(results)} khóa học có từ khóa '{keyword}' (catalog snapshot)")
+        return results
+
+    def fuzzy_find_courses(self, name, limit=5, score_cutoff=60):
+        """
+        Khóa học có tên gần giống `name` (không phân biệt dấu)
+
+        Returns:
+            list: Danh sách (khóa học, điểm 0-100) theo điểm giảm dần
+        """
+        return self.course_name_index.search(name, limit=limit, score_cutoff=score_cutoff)
+
+    def courses_in_category(self, category):
+        return list(self.courses_by_category.get(normalize_catalog_text(category), []))
+
+    def courses_with_tag(self, tag):
+        return list(self.courses_by_tag.get(normalize_catalog_text(tag), []))
+
+    def courses_at_level(self, level):
+        return list(self.courses_by_level.get(normalize_catalog_text(level), []))
+
+    def courses_of_mentor(self, mentor_id):
+        return list(self.courses_by_mentor.get(str(mentor_id), []))
+
+    # ----- Giảng viên / user -----
+
+    def get_mentor(self, mentor_id):
+        return self.mentors_by_id.get(str(mentor_id))
+
+    def get_user(self, user_id):
+        return self.users_by_id.get(str(user_id)) if user_id is not None else None
+
+    def mentor_user(self, mentor):
+        """
+        User (tên, email...) của giảng viên
+        """
+        if not mentor:
+            return None
+        return mentor.get('userInfo') or self.get_user(mentor.get('user'))
+
+    def mentors(self, limit=None):
+        return self.mentor_list[:limit] if limit else list(self.mentor_list)
+
+    def users(self):
+        return list(self.user_list)
+
+    def find_users_by_name(self, fragment):
+        """
+        User có tên chứa `fragment` (như `{"name": {"$regex": fragment, "$options": "i"}}`)
+        """
+        pattern = _compile_pattern(fragment)
+        results = [user for user in self.user_list if pattern.search(user.get('name') or '')]
+        exact = self.users_by_name.get(normalize_catalog_text(fragment), [])
+        if exact:
+            exact_ids = {id(user) for user in exact}
+            results = exact + [user for user in results if id(user) not in exact_ids]
+        return results
+
+    def fuzzy_find_users(self, name, limit=5, score_cutoff=60):
+        """
+        User (của giảng viên) có tên gần giống `name` (không phân biệt dấu)
+
+        Returns:
+            list: Danh sách (user, điểm 0-100) theo điểm giảm dần
+        """
+        return self.user_name_index.search(name, limit=limit, score_cutoff=score_cutoff)
+
+    def mentors_for_users(self, user_ids):
+        mentors, seen = [], set()
+        for user_id in user_ids:
+            mentor = self.mentor_by_user_id.get(str(user_id))
+            if mentor is not None and id(mentor) not in seen:
+                seen.add(id(mentor))
+                mentors.append(mentor)
+        return mentors
+
+    def find_mentors(self, specialization=None, min_experience=None):
+        """
+        Giảng viên theo chuyên môn (chứa chuỗi, không phân biệt hoa thường) và số năm kinh nghiệm tối thiểu
+        """
+        if specialization:
+            pattern = _compile_pattern(specialization)
+            exact_ids = {id(mentor) for mentor in
+                         self.mentors_by_specialization.get(normalize_catalog_text(specialization), [])}
+            mentors = [
+                mentor for mentor in self.mentor_list
+                if id(mentor) in exact_ids
+                or any(isinstance(item, str) and pattern.search(item)
+                       for item in _as_list(mentor.get('specialization')))
+            ]
+        else:
+            mentors = list(self.mentor_list)
+
+        if min_experience:
+            mentors = [mentor for mentor in mentors if (mentor.get('experience') or 0) >= min_experience]
+        return mentors
+
+
+class CatalogStore:
+    """
+    Giữ snapshot catalog hiện tại và làm mới định kỳ trong thread nền
+
+    Snapshot được nạp ở lần dùng đầu tiên; `refresh()` tạo snapshot mới rồi đổi tham chiếu
+    (thao tác gán là nguyên tử), nên người đọc luôn thấy một snapshot đầy đủ.
+    """
+    def __init__(self, refresh_interval_seconds=300):
+        self.refresh_interval_seconds = refresh_interval_seconds
+        self._snapshot = None
+        self._lock = threading.Lock()
+        # Tránh để cập nhật tăng dần và làm mới toàn bộ ghi đè snapshot của nhau
+        self._update_lock = threading.Lock()
+        self._refresh_thread = None
+
+    def get(self):
+        """
+        Lấy snapshot hiện tại (nạp lần đầu nếu chưa có)
+        """
+        snapshot = self._snapshot
+        if snapshot is None:
+            with self._lock:
+                if self._snapshot is None:
+                    self._snapshot = self._load()
+                    self._start_refresh_thread()
+                snapshot = self._snapshot
+        return snapshot
+
+    def _load(self):
+        start_time = time.perf_counter()
+        snapshot = CatalogSnapshot.load()
+        elapsed = time.perf_counter() - start_time
+        print(f"Đã nạp catalog snapshot {snapshot.stats()} trong {elapsed:.2f}s")
+        return snapshot
+
+    def refresh(self):
+        """
+        Nạp lại dữ liệu từ MongoDB và thay snapshot hiện tại; giữ snapshot cũ nếu có lỗi
+        """
+        with self._update_lock:
+            try:
+                snapshot = self._load()
+            except Exception as e:
+                print(f"Lỗi khi làm mới catalog snapshot, tiếp tục dùng bản cũ: {e}")
+                return False
+            self._snapshot = snapshot
+            return True
+
+    def apply_changes(self, course_ids, mentor_ids):
+        """
+        Cập nhật snapshot theo các khóa học / giảng viên đã thay đổi, chỉ đọc lại các document đó từ MongoDB
+
+        Args:
+            course_ids, mentor_ids: Id các khóa học / giảng viên đã thêm / sửa / xóa (kể cả các entity
+                liên quan có dữ liệu lookup thay đổi, ví dụ khóa học của giảng viên đổi tên)
+
+        Returns:
+            bool: False nếu có lỗi (giữ snapshot cũ)
+        """
+        course_ids, mentor_ids = set(course_ids), set(mentor_ids)
+        if not course_ids and not mentor_ids:
+            return True
+
+        with self._update_lock:
+            snapshot = self._snapshot
+            if snapshot is None:
+                # Chưa nạp lần nào: lần `get()` đầu tiên sẽ đọc toàn bộ dữ liệu mới
+                return True
+            try:
+                start_time = time.perf_counter()
+                courses = mongodb.get_courses({"_id": {"$in": _to_object_ids(course_ids)}}) if course_ids else []
+                mentors = mongodb.get_mentors({"_id": {"$in": _to_object_ids(mentor_ids)}}) if mentor_ids else []
+                snapshot = snapshot.with_changes(course_ids, mentor_ids, courses, mentors)
+            except Exception as e:
+                print(f"Lỗi khi cập nhật catalog snapshot, tiếp tục dùng bản cũ: {e}")
+                return False
+            self._snapshot = snapshot
+            elapsed = time.perf_counter() - start_time
+            print(f"Đã cập nhật catalog snapshot ({len(course_ids)} khóa học, {len(mentor_ids)} giảng viên) "
+                  f"trong {elapsed:.2f}s: {snapshot.stats()}")
+            return True
+
+    def _start_refresh_thread(self):
+        """
+        Khởi động thread làm mới snapshot định kỳ
+        """
+        if self.refresh_interval_seconds <= 0 or self._refresh_thread is not None:
+            return
+
+        def refresh_task():
+            while True:
+                time.sleep(self.refresh_interval_seconds)
+                self.refresh()
+
+        # Tạo và khởi động thread với daemon=True để tránh chặn chương trình khi tắt
+        self._refresh_thread = threading.Thread(target=refresh_task, daemon=True)
+        self._refresh_thread.start()
+        print(f"Đã khởi động thread làm mới catalog snapshot (chạy mỗi {self.refresh_interval_seconds} giây)")
+
+
+# Instance mặc định
+catalog = CatalogStore(
+    refresh_interval_seconds=int(os.getenv('CATALOG_SNAPSHOT_REFRESH_SECONDS', 300))
+)
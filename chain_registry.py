@@ -0,0 +1,51 @@
+"""
+Chain Registry - Các RAG chain dựng sẵn cho từng loại filter retriever
+Cải tiến độ trễ cho LMS-RAG-Chatbot: mỗi request chỉ tra dict thay vì dựng retriever / chain mới
+"""
+
+import threading
+import time
+from collections import namedtuple
+
+RAGChains = namedtuple("RAGChains", ["retriever", "history_aware_retriever", "rag_chain"])
+
+
+class ChainRegistry:
+    """
+    Giữ một bộ chain cho mỗi loại filter (ví dụ None / "course" / "mentor") trên vector store hiện tại
+
+    Chain của LangChain không giữ trạng thái giữa các lần invoke nên dùng chung giữa các thread
+    là an toàn. Khi vector store thay đổi, bộ chain mới được dựng xong rồi mới thay tham chiếu
+    (thao tác gán là nguyên tử), nên request đang chạy vẫn dùng trọn bộ chain cũ.
+
+    Args:
+        build_chains: Hàm (vector_store, filter_type) -> RAGChains
+        filter_types: Các loại filter cần dựng sẵn
+    """
+    def __init__(self, build_chains, filter_types):
+        self.build_chains = build_chains
+        self.filter_types = tuple(filter_types)
+        self.version = 0
+        self._chains = {}
+        self._lock = threading.Lock()
+
+    def rebuild(self, vector_store):
+        """
+        Dựng lại toàn bộ chain cho vector store mới và thay thế bộ chain hiện tại
+        """
+        with self._lock:
+            start_time = time.perf_counter()
+            chains = {filter_type: self.build_chains(vector_store, filter_type) for filter_type in self.filter_types}
+            self._chains = chains
+            self.version += 1
+            print(f"Đã dựng {len(chains)} RAG chain (phiên bản {self.version}) "
+                  f"trong {(time.perf_counter() - start_time) * 1000:.1f} ms")
+
+    def get(self, filter_type=None):
+        """
+        Bộ chain dựng sẵn của loại filter
+
+        Returns:
+            RAGChains
+        """
+        return self._chains[filter_type]
@@ -0,0 +1,264 @@
+"""
+Chat Writer - Ghi lịch sử chat theo lô (write-behind) thay vì insert_one trên đường trả lời
+Cải tiến độ trễ và throughput ghi cho LMS-RAG-Chatbot
+
+Tin nhắn được đưa vào bộ đệm và một thread nền ghi chúng bằng `insert_many` (có thứ tự) khi
+bộ đệm đủ `batch_size` hoặc sau mỗi `flush_interval` giây. Tin nhắn chưa ghi vẫn được đọc thấy
+qua `pending()` (read-your-writes), nên lượt hỏi tiếp theo vẫn có đủ lịch sử hội thoại.
+
+Chỉ lỗi kết nối / timeout mới được ghi lại ở lần sau; tin nhắn bị MongoDB từ chối (validation...)
+được bỏ qua và ghi log, để không chặn các tin nhắn phía sau. Khi bộ đệm đầy (MongoDB ngừng hoạt động
+lâu), tin nhắn mới được ghi đồng bộ, nên lỗi được trả về cho request thay vì bộ đệm tăng mãi.
+"""
+
+import atexit
+import os
+import threading
+
+from pymongo.errors import BulkWriteError, ConnectionFailure, ExecutionTimeout
+
+from db_connector import mongodb
+
+DUPLICATE_KEY_ERROR = 11000
+
+# Lỗi tạm thời: tin nhắn được giữ lại để ghi ở lần sau
+RETRYABLE_ERRORS = (ConnectionFailure, ExecutionTimeout)
+
+
+class ChatHistoryWriter:
+    """
+    Bộ ghi write-behind cho collection chat_history
+
+    Args:
+        get_collection: Hàm trả về collection (pymongo) để ghi
+        batch_size (int): Số tin nhắn tối đa mỗi lần insert_many (đủ thì ghi ngay)
+        flush_interval (float): Thời gian tối đa (giây) một tin nhắn nằm trong bộ đệm
+        enabled (bool): False để ghi đồng bộ ngay khi `add` (không dùng bộ đệm)
+        max_buffered (int): Số tin nhắn tối đa chờ ghi; vượt quá thì `add` ghi đồng bộ
+    """
+    def __init__(self, get_collection, batch_size=100, flush_interval=0.2, enabled=True, max_buffered=10000):
+        self.get_collection = get_collection
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self.enabled = enabled
+        self.max_buffered = max_buffered
+
+        self._cond = threading.Condition()
+        # Chỉ một lần ghi tại một thời điểm để giữ đúng thứ tự tin nhắn
+        self._flush_lock = threading.Lock()
+        self._buffer = []
+        self._in_flight = []
+        self._closed = False
+        self._thread = None
+
+        self.batches = 0
+        self.written = 0
+        self.failed_batches = 0
+        self.dropped = 0
+        self.sync_writes = 0
+
+    def _start(self):
+        # Gọi khi đang giữ self._cond
+        self._thread = threading.Thread(target=self._run, name="chat-writer", daemon=True)
+        self._thread.start()
+        atexit.register(self.close)
+
+    def _run(self):
+        while True:
+            with self._cond:
+                self._cond.wait_for(
+                    lambda: self._closed or len(self._buffer) >= self.batch_size, timeout=self.flush_interval
+                )
+                closed = self._closed
+            self.flush()
+            if closed:
+                return
+
+    def add(self, documents):
+        """
+        Đưa các tin nhắn (dict đã `to_dict()`) vào hàng đợi ghi, theo đúng thứ tự
+        """
+        if not self.enabled:
+            self.get_collection().insert_many(documents, ordered=True)
+            return
+
+        with self._cond:
+            if self._closed:
+                raise RuntimeError("ChatHistoryWriter đã đóng")
+            full = len(self._buffer) + len(self._in_flight) + len(documents) > self.max_buffered
+            if full:
+                self.sync_writes += 1
+        if full:
+            # Bộ đệm đầy: ghi đồng bộ, lỗi (nếu có) được trả về cho request
+            print(f"Bộ đệm ghi lịch sử chat đầy ({self.max_buffered} tin nhắn), ghi đồng bộ")
+            self.get_collection().insert_many(documents, ordered=True)
+            return
+
+        with self._cond:
+            if self._closed:
+                raise RuntimeError("ChatHistoryWriter đã đóng")
+            self._buffer.extend(documents)
+            if self._thread is None:
+                self._start()
+            if len(self._buffer) >= self.batch_size:
+                self._cond.notify()
+
+    def flush(self):
+        """
+        Ghi toàn bộ tin nhắn đang chờ bằng một insert_many có thứ tự
+
+        Tin nhắn chưa ghi được do lỗi kết nối / timeout được giữ lại ở đầu bộ đệm để ghi ở lần sau.
+        Tin nhắn bị MongoDB từ chối bị bỏ qua (ghi log), các tin nhắn sau nó vẫn được ghi.
+
+        Returns:
+            int: Số tin nhắn đã ghi
+        """
+        with self._flush_lock:
+            with self._cond:
+                batch, self._buffer = self._buffer, []
+                self._in_flight = batch
+            if not batch:
+                return 0
+
+            written, dropped, done = 0, 0, 0
+            while done < len(batch):
+                try:
+                    self.get_collection().insert_many(batch[done:], ordered=True)
+                    written += len(batch) - done
+                    done = len(batch)
+                except BulkWriteError as e:
+                    inserted = e.details.get('nInserted', 0)
+                    written += inserted
+                    done += inserted
+                    write_errors = e.details.get('writeErrors', [])
+                    if not write_errors:
+                        # Chỉ lỗi write concern: các tin nhắn đã được ghi
+                        written += len(batch) - done
+                        done = len(batch)
+                        continue
+                    if write_errors[0].get('code') == DUPLICATE_KEY_ERROR:
+                        # Tin nhắn đã được ghi ở lần thử trước
+                        written += 1
+                    else:
+                        dropped += 1
+                        print(f"Bỏ qua tin nhắn {batch[done].get('_id')} bị MongoDB từ chối: "
+                              f"{write_errors[0].get('errmsg')}")
+                    done += 1
+                except RETRYABLE_ERRORS as e:
+                    print(f"Lỗi khi ghi lịch sử chat theo lô, sẽ ghi lại ở lần sau: {e}")
+                    break
+                except Exception as e:
+                    # Không xác định được tin nhắn lỗi trong lô: ghi từng tin nhắn để bỏ qua tin nhắn lỗi
+                    print(f"Lỗi khi ghi lịch sử chat theo lô, ghi từng tin nhắn: {e}")
+                    single_written, single_dropped, done = self._insert_one_by_one(batch, done)
+                    written += single_written
+                    dropped += single_dropped
+
+            with self._cond:
+                self._in_flight = []
+                self._buffer = batch[done:] + self._buffer
+                self.batches += 1
+                self.written += written
+                self.dropped += dropped
+                if done < len(batch) or dropped:
+                    self.failed_batches += 1
+            return written
+
+    def _insert_one_by_one(self, batch, start):
+        """
+        Ghi lần lượt từng tin nhắn từ vị trí `start`, bỏ qua tin nhắn bị từ chối
+
+        Returns:
+            tuple: (số tin nhắn đã ghi, số tin nhắn bị bỏ qua, vị trí tin nhắn đầu tiên chưa xử lý)
+        """
+        written, dropped, position = 0, 0, start
+        collection = self.get_collection()
+        while position < len(batch):
+            try:
+                collection.insert_one(batch[position])
+                written += 1
+            except RETRYABLE_ERRORS as e:
+                print(f"Lỗi khi ghi lịch sử chat, sẽ ghi lại ở lần sau: {e}")
+                break
+            except Exception as e:
+                if getattr(e, 'code', None) == DUPLICATE_KEY_ERROR:
+                    written += 1
+                else:
+                    dropped += 1
+                    print(f"Bỏ qua tin nhắn {batch[position].get('_id')} không ghi được: {e}")
+            position += 1
+        return written, dropped, position
+
+    def pending(self, user_id, session_number=None):
+        """
+        Các tin nhắn của người dùng chưa được ghi xuống MongoDB
+
+        Gọi trước khi đọc MongoDB rồi gộp bằng `merge`: tin nhắn được ghi xong giữa hai lần đọc
+        sẽ có trong kết quả MongoDB và được loại trùng theo _id.
+        """
+        user_id = str(user_id)
+        with self._cond:
+            return [
+                dict(document) for document in self._in_flight + self._buffer
+                if document['user_id'] == user_id
+                and (session_number is None or document['session_number'] == session_number)
+            ]
+
+    @staticmethod
+    def merge(records, pending):
+        """
+        Gộp kết quả đọc từ MongoDB với các tin nhắn chưa ghi (loại trùng theo _id, sắp xếp theo created_at)
+        """
+        if not pending:
+            return records
+        seen_ids = {record['_id'] for record in records}
+        merged = records + [document for document in pending if document['_id'] not in seen_ids]
+        merged.sort(key=lambda record: record['created_at'])
+        return merged
+
+    def discard(self, user_id):
+        """
+        Bỏ các tin nhắn chưa ghi của người dùng (khi xóa lịch sử chat)
+
+        Chờ lần ghi đang chạy xong, để không có tin nhắn nào được ghi sau khi lịch sử đã bị xóa.
+        """
+        user_id = str(user_id)
+        with self._flush_lock:
+            with self._cond:
+                self._buffer = [document for document in self._buffer if document['user_id'] != user_id]
+
+    def close(self):
+        """
+        Ghi nốt các tin nhắn đang chờ và dừng thread nền (khi server tắt)
+        """
+        with self._cond:
+            if self._closed:
+                return
+            self._closed = True
+            self._cond.notify()
+        if self._thread is not None:
+            self._thread.join(timeout=10)
+        self.flush()
+
+    def stats(self):
+        with self._cond:
+            return {
+                "buffered": len(self._buffer),
+                "in_flight": len(self._in_flight),
+                "batches": self.batches,
+                "written": self.written,
+                "failed_batches": self.failed_batches,
+                "dropped": self.dropped,
+                "sync_writes": self.sync_writes,
+                "avg_batch_size": round(self.written / self.batches, 2) if self.batches else 0.0
+            }
+
+
+# Bộ ghi dùng chung cho cả server threaded và async
+chat_history_writer = ChatHistoryWriter(
+    lambda: mongodb.get_collection('chat_history'),
+    batch_size=int(os.getenv('CHAT_WRITE_BATCH_SIZE', 100)),
+    flush_interval=float(os.getenv('CHAT_WRITE_FLUSH_MS', 200)) / 1000,
+    enabled=os.getenv('CHAT_WRITE_BEHIND', 'True').lower() == 'true',
+    max_buffered=int(os.getenv('CHAT_WRITE_MAX_BUFFERED', 10000))
+)
@@ -0,0 +1,141 @@
+"""
+Conversation Cache - Lịch sử các cuộc hội thoại đang diễn ra trong bộ nhớ, theo (user_id, session_number)
+Cải tiến độ trễ cho LMS-RAG-Chatbot: lượt hỏi tiếp theo không phải đọc lại cả session từ MongoDB
+
+Cache được cập nhật cùng lúc với việc lưu tin nhắn (write-through), nên cuộc hội thoại đang
+diễn ra được phục vụ hoàn toàn từ bộ nhớ. Cuộc hội thoại không hoạt động quá `ttl_seconds`
+hoặc ít được dùng nhất (khi vượt `max_conversations`) bị loại khỏi cache.
+"""
+
+import os
+import threading
+import time
+from collections import OrderedDict
+
+
+class ConversationCache:
+    """
+    LRU có TTL cho danh sách tin nhắn (ChatHistory) của từng cuộc hội thoại
+
+    Khi cache chưa có cuộc hội thoại, lịch sử được đọc từ MongoDB qua `begin_load` / `finish_load`:
+    nếu trong lúc đọc có tin nhắn mới được thêm vào cuộc hội thoại đó, kết quả đọc (có thể thiếu
+    tin nhắn mới) không được đưa vào cache.
+
+    Args:
+        max_conversations (int): Số cuộc hội thoại tối đa trong cache
+        ttl_seconds (float): Thời gian tối đa một cuộc hội thoại không hoạt động còn được giữ
+    """
+    def __init__(self, max_conversations=10000, ttl_seconds=1800):
+        self.max_conversations = max_conversations
+        self.ttl_seconds = ttl_seconds
+        self._entries = OrderedDict()  # (user_id, session_number) -> (danh sách tin nhắn, expires_at)
+        self._loading = {}  # key -> [số lần đọc đang chạy, có tin nhắn mới trong lúc đọc]
+        self._lock = threading.Lock()
+
+        self.hits = 0
+        self.misses = 0
+
+    @staticmethod
+    def _key(user_id, session_number):
+        return str(user_id), session_number
+
+    def _put(self, key, messages, now):
+        self._entries[key] = (messages, now + self.ttl_seconds)
+        self._entries.move_to_end(key)
+        while len(self._entries) > self.max_conversations:
+            self._entries.popitem(last=False)
+
+    def get(self, user_id, session_number):
+        """
+        Returns:
+            list: Bản sao danh sách tin nhắn của cuộc hội thoại, None nếu không có trong cache
+        """
+        key = self._key(user_id, session_number)
+        now = time.time()
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None or entry[1] <= now:
+                if entry is not None:
+                    del self._entries[key]
+                self.misses += 1
+                return None
+            self.hits += 1
+            self._put(key, entry[0], now)
+            return list(entry[0])
+
+    def start(self, user_id, session_number):
+        """
+        Đưa vào cache một cuộc hội thoại mới (chưa có tin nhắn)
+        """
+        with self._lock:
+            self._put(self._key(user_id, session_number), [], time.time())
+
+    def begin_load(self, user_id, session_number):
+        """
+        Đánh dấu bắt đầu đọc lịch sử từ MongoDB (gọi trước khi đọc)
+        """
+        key = self._key(user_id, session_number)
+        with self._lock:
+            loading = self._loading.setdefault(key, [0, False])
+            loading[0] += 1
+
+    def finish_load(self, user_id, session_number, messages):
+        """
+        Đưa lịch sử vừa đọc vào cache, trừ khi có tin nhắn mới được thêm trong lúc đọc
+
+        Args:
+            messages: Lịch sử đã đọc, None nếu đọc thất bại (chỉ kết thúc lượt đọc)
+        """
+        key = self._key(user_id, session_number)
+        with self._lock:
+            loading = self._loading.get(key)
+            if loading is None:
+                return
+            loading[0] -= 1
+            if loading[0] == 0:
+                del self._loading[key]
+            if messages is not None and not loading[1] and key not in self._entries:
+                self._put(key, list(messages), time.time())
+
+    def append(self, user_id, session_number, messages):
+        """
+        Thêm tin nhắn vừa lưu vào cuộc hội thoại (write-through); bỏ qua nếu cuộc hội thoại không có trong cache
+        """
+        key = self._key(user_id, session_number)
+        now = time.time()
+        with self._lock:
+            if key in self._loading:
+                self._loading[key][1] = True
+            entry = self._entries.get(key)
+            if entry is None:
+                return
+            self._put(key, entry[0] + list(messages), now)
+
+    def invalidate_user(self, user_id):
+        """
+        Xóa mọi cuộc hội thoại của người dùng khỏi cache (khi xóa lịch sử chat)
+        """
+        user_id = str(user_id)
+        with self._lock:
+            for key in [key for key in self._entries if key[0] == user_id]:
+                del self._entries[key]
+            for key, loading in self._loading.items():
+                if key[0] == user_id:
+                    loading[1] = True
+
+    def stats(self):
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                "conversations": len(self._entries),
+                "hits": self.hits,
+                "misses": self.misses,
+                "hit_rate": round(self.hits / lookups, 3) if lookups else 0.0
+            }
+
+
+# Cache dùng chung cho cả server threaded và async
+conversation_cache = ConversationCache(
+    max_conversations=int(os.getenv('CONVERSATION_CACHE_SIZE', 10000)),
+    ttl_seconds=float(os.getenv('CONVERSATION_CACHE_TTL_SECONDS', 1800))
+)
@@ -137,6 +137,39 @@ class MongoDBConnector:
         print(f"Đã tìm thấy {len(courses)} khóa học của giảng viên {mentor_id}")
         return courses
     
+    def get_courses_grouped_by_mentor(self, mentor_ids=None):
+        """
+        Lấy khóa học active của nhiều giảng viên trong MỘT aggregation (nhóm theo giảng viên)
+
+        Args:
+            mentor_ids: Danh sách id giảng viên, None để lấy cho tất cả giảng viên
+
+        Returns:
+            dict: {id giảng viên (str): danh sách khóa học}
+        """
+        courses_collection = self.get_collection('courses')
+
+        query = {"status": "active", "mentor": {"$ne": None}}
+        if mentor_ids is not None:
+            object_ids = []
+            for mentor_id in mentor_ids:
+                try:
+                    object_ids.append(ObjectId(mentor_id) if isinstance(mentor_id, str) else mentor_id)
+                except:
+                    object_ids.append(mentor_id)
+            query["mentor"] = {"$in": object_ids}
+
+        pipeline = [
+            {"$match": query},
+            # Chỉ lấy các trường cần cho danh sách khóa học của giảng viên
+            {"$project": {"name": 1, "price": 1, "level": 1, "ratings": 1, "mentor": 1}},
+            {"$group": {"_id": "$mentor", "courses": {"$push": "$$ROOT"}}}
+        ]
+
+        grouped = {str(group['_id']): group['courses'] for group in courses_collection.aggregate(pipeline)}
+        print(f"Đã lấy khóa học của {len(grouped)} giảng viên trong một truy vấn")
+        return grouped
+
     def get_courses_by_category(self, category, limit=None):
         """
         Lấy danh sách khóa học theo danh mục
@@ -316,8 +349,56 @@ class MongoDBConnector:
             self.db = None
             print("Đã đóng kết nối MongoDB")
 
+class AsyncMongoDBConnector:
+    """
+    Kết nối MongoDB bất đồng bộ (motor) cho chế độ server async (`async_app.py`)
+
+    Client được tạo khi dùng lần đầu, trên event loop đang chạy.
+    """
+    def __init__(self):
+        self.client = None
+        self.db = None
+
+    def connect(self):
+        """
+        Kết nối đến MongoDB bằng motor
+        """
+        if self.client is None:
+            from motor.motor_asyncio import AsyncIOMotorClient
+
+            mongodb_uri = os.getenv('MONGODB_URI')
+            if not mongodb_uri:
+                raise ValueError("MongoDB URI không được cấu hình trong file .env")
+
+            try:
+                self.client = AsyncIOMotorClient(mongodb_uri)
+                self.db = self.client[os.getenv('MONGODB_DB_NAME', 'trannghia')]
+                print("Kết nối MongoDB (async) thành công")
+            except Exception as e:
+                print(f"Lỗi kết nối MongoDB (async): {e}")
+                raise
+
+        return self.db
+
+    def get_collection(self, collection_name):
+        """
+        Lấy collection (motor) từ database
+        """
+        return self.connect()[collection_name]
+
+    def close(self):
+        """
+        Đóng kết nối MongoDB (async)
+        """
+        if self.client:
+            self.client.close()
+            self.client = None
+            self.db = None
+            print("Đã đóng kết nối MongoDB (async)")
+
 # Singleton instance
 mongodb = MongoDBConnector() 
+async_mongodb = AsyncMongoDBConnector()
 
 # Hàm kiểm tra kết nối và dữ liệu trong MongoDB
 def check_database_connection():
@@ -0,0 +1,144 @@
+"""
+DB Indexes - Khai báo, tạo index MongoDB cho các truy vấn nóng và kiểm tra query plan bằng explain()
+Cải tiến độ trễ MongoDB cho LMS-RAG-Chatbot: truy vấn chat_history không chậm dần khi collection lớn lên
+
+Chạy như một bước migration:
+    python db_indexes.py        # Tạo index còn thiếu rồi kiểm tra, thoát với mã 1 nếu còn COLLSCAN
+"""
+
+import sys
+from collections import namedtuple
+
+from bson import ObjectId
+from pymongo import ASCENDING, DESCENDING, IndexModel
+
+# Index cần có cho từng collection (create_indexes bỏ qua index đã tồn tại)
+INDEX_SPECS = {
+    "chat_history": [
+        # Lịch sử một session (sort theo created_at) và session cuối của người dùng
+        IndexModel([("user_id", ASCENDING), ("session_number", ASCENDING), ("created_at", ASCENDING)],
+                   name="user_session_created"),
+        # Toàn bộ lịch sử của người dùng (GET /chat/history/<user_id>)
+        IndexModel([("user_id", ASCENDING), ("created_at", ASCENDING)], name="user_created"),
+    ],
+    "courses": [
+        IndexModel([("mentor", ASCENDING), ("status", ASCENDING)], name="mentor_status"),
+    ],
+    "mentors": [
+        IndexModel([("user", ASCENDING)], name="user"),
+    ],
+    "users": [
+        IndexModel([("name", ASCENDING)], name="name"),
+    ],
+}
+
+# Dạng truy vấn nóng: tên, collection, filter, sort (giá trị chỉ dùng để lấy query plan)
+QueryShape = namedtuple("QueryShape", ["name", "collection", "filter", "sort"])
+
+HOT_QUERIES = [
+    QueryShape("lịch sử một session", "chat_history",
+               {"user_id": "explain", "session_number": 1}, [("created_at", DESCENDING)]),
+    QueryShape("session cuối của người dùng", "chat_history",
+               {"user_id": "explain"}, [("session_number", DESCENDING)]),
+    QueryShape("lịch sử của người dùng", "chat_history",
+               {"user_id": "explain"}, [("created_at", ASCENDING)]),
+    QueryShape("khóa học của giảng viên", "courses",
+               {"mentor": ObjectId(), "status": "active"}, None),
+    QueryShape("giảng viên theo user", "mentors",
+               {"user": {"$in": [ObjectId()]}}, None),
+    QueryShape("user theo tên", "users",
+               {"name": {"$regex": "explain", "$options": "i"}}, None),
+]
+
+
+class CollectionScanError(Exception):
+    """
+    Có truy vấn nóng phải quét toàn bộ collection (COLLSCAN)
+    """
+    def __init__(self, query_names):
+        super().__init__(f"Truy vấn không dùng index (COLLSCAN): {', '.join(query_names)}")
+        self.query_names = query_names
+
+
+def ensure_indexes(db, specs=INDEX_SPECS):
+    """
+    Tạo các index đã khai báo (idempotent)
+
+    Returns:
+        dict: {collection: danh sách tên index}
+    """
+    created = {}
+    for collection_name, indexes in specs.items():
+        created[collection_name] = db[collection_name].create_indexes(indexes)
+        print(f"Index của {collection_name}: {', '.join(created[collection_name])}")
+    return created
+
+
+def _plan_stages(plan):
+    """
+    Tất cả các stage trong một cây query plan (kể cả dạng queryPlan của slot-based engine)
+    """
+    if isinstance(plan, dict):
+        if "stage" in plan:
+            yield plan["stage"]
+        for value in plan.values():
+            yield from _plan_stages(value)
+    elif isinstance(plan, list):
+        for item in plan:
+            yield from _plan_stages(item)
+
+
+def find_collection_scans(db, queries=HOT_QUERIES):
+    """
+    Chạy explain() cho từng dạng truy vấn nóng
+
+    Returns:
+        list: Tên các truy vấn có winning plan là COLLSCAN
+    """
+    scans = []
+    for query in queries:
+        cursor = db[query.collection].find(query.filter)
+        if query.sort:
+            cursor = cursor.sort(query.sort)
+        winning_plan = cursor.explain().get("queryPlanner", {}).get("winningPlan", {})
+        stages = list(_plan_stages(winning_plan))
+        print(f"Query plan '{query.name}' ({query.collection}): {' <- '.join(stages)}")
+        if "COLLSCAN" in stages:
+            scans.append(query.name)
+    return scans
+
+
+def verify_query_plans(db, queries=HOT_QUERIES):
+    """
+    Kiểm tra không truy vấn nóng nào phải quét toàn bộ collection
+
+    Raises:
+        CollectionScanError: Có truy vấn dùng COLLSCAN
+    """
+    scans = find_collection_scans(db, queries)
+    if scans:
+        raise CollectionScanError(scans)
+
+
+def provision_indexes(db):
+    """
+    Bước migration: tạo index còn thiếu rồi kiểm tra query plan
+
+    Raises:
+        CollectionScanError: Có truy vấn nóng vẫn dùng COLLSCAN sau khi tạo index
+    """
+    ensure_indexes(db)
+    verify_query_plans(db)
+
+
+if __name__ == "__main__":
+    from db_connector import mongodb
+
+    try:
+        provision_indexes(mongodb.connect())
+        print("Tất cả truy vấn nóng đều dùng index")
+    except CollectionScanError as e:
+        print(f"LỖI: {e}")
+        sys.exit(1)
+    finally:
+        mongodb.close()
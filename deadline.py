@@ -0,0 +1,33 @@
+"""
+Deadline - Thời hạn xử lý của một request, truyền qua các bước của pipeline
+Cải tiến độ trễ đuôi cho LMS-RAG-Chatbot: không request nào chờ Gemini lâu hơn thời hạn
+"""
+
+import time
+
+
+class DeadlineExceeded(Exception):
+    """
+    Bước xử lý không thể hoàn thành trước thời hạn của request
+    """
+
+
+class Deadline:
+    """
+    Thời điểm request phải có câu trả lời
+
+    Args:
+        seconds (float): Thời gian tối đa tính từ lúc tạo
+    """
+    def __init__(self, seconds):
+        self.seconds = seconds
+        self.expires_at = time.perf_counter() + seconds
+
+    def remaining(self):
+        """
+        Số giây còn lại (0 nếu đã quá hạn)
+        """
+        return max(0.0, self.expires_at - time.perf_counter())
+
+    def expired(self):
+        return self.remaining() <= 0
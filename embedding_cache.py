@@ -0,0 +1,394 @@
+"""
+Embedding Cache - Lưu embeddings theo nội dung để không phải tính lại cho văn bản không đổi
+Cải tiến thời gian xây dựng vector store cho LMS-RAG-Chatbot
+"""
+
+import os
+import re
+import json
+import hashlib
+import threading
+from collections import OrderedDict
+from contextlib import contextmanager
+
+try:
+    import fcntl
+except ImportError:  # Windows: không có khóa file, chỉ khóa giữa các luồng trong tiến trình
+    fcntl = None
+
+import numpy as np
+from langchain_core.embeddings import Embeddings
+
+
+class EmbeddingCache:
+    """
+    Cache embeddings trên đĩa, key là hash của (tên mô hình, văn bản)
+
+    Cấu trúc thư mục (mỗi mô hình một thư mục con):
+        cache_dir/<model>/meta.json    -> số chiều và kiểu dữ liệu
+        cache_dir/<model>/keys.txt     -> key của từng dòng (append-only)
+        cache_dir/<model>/vectors.bin  -> ma trận float16/float32 liên tục, đọc bằng memory map
+        cache_dir/<model>/.lock        -> khóa file giữa các tiến trình dùng chung cache
+
+    Nhiều tiến trình (Flask, aiohttp, CLI) có thể dùng chung một thư mục cache: ghi thêm giữ khóa
+    độc quyền, đọc giữ khóa chia sẻ, và index key -> dòng được đồng bộ lại với đĩa dưới khóa
+    trước mỗi lần đọc / ghi.
+    """
+    def __init__(self, cache_dir="embedding_cache", model_name="default", dtype="float16"):
+        self.model_name = model_name
+        self.dtype = np.dtype(dtype)
+        self.model_dir = os.path.join(cache_dir, re.sub(r'[^A-Za-z0-9_.-]+', '_', model_name))
+        self.meta_path = os.path.join(self.model_dir, "meta.json")
+        self.keys_path = os.path.join(self.model_dir, "keys.txt")
+        self.vectors_path = os.path.join(self.model_dir, "vectors.bin")
+        self.lock_path = os.path.join(self.model_dir, ".lock")
+
+        self.dim = None
+        self._key_to_row = {}
+        self._matrix = None
+        # Vị trí đã đọc tới trong keys.txt và inode của nó (inode đổi khi tiến trình khác nén cache)
+        self._keys_offset = 0
+        self._keys_inode = None
+        self._lock = threading.RLock()
+        self._file_lock_depth = 0
+        self.hits = 0
+        self.misses = 0
+
+        # Tạo thư mục cache nếu chưa tồn tại
+        if not os.path.exists(self.model_dir):
+            os.makedirs(self.model_dir, exist_ok=True)
+
+        with self._lock, self._file_lock():
+            self._load_index()
+
+    @contextmanager
+    def _file_lock(self, shared=False):
+        """
+        Khóa file giữa các tiến trình (không làm gì nếu hệ điều hành không hỗ trợ fcntl)
+
+        Luôn được gọi khi đang giữ `self._lock`; gọi lồng nhau (ví dụ `_load_index` -> `clear_all`)
+        dùng lại khóa đang giữ thay vì khóa lại file.
+        """
+        if fcntl is None or self._file_lock_depth:
+            self._file_lock_depth += 1
+            try:
+                yield
+            finally:
+                self._file_lock_depth -= 1
+            return
+        with open(self.lock_path, 'a') as lock_file:
+            fcntl.flock(lock_file, fcntl.LOCK_SH if shared else fcntl.LOCK_EX)
+            self._file_lock_depth += 1
+            try:
+                yield
+            finally:
+                self._file_lock_depth -= 1
+                fcntl.flock(lock_file, fcntl.LOCK_UN)
+
+    def _load_index(self):
+        """
+        Nạp index key -> dòng; bỏ qua các dòng ghi dở nếu tiến trình trước bị dừng giữa chừng
+        """
+        try:
+            if os.path.exists(self.meta_path):
+                with open(self.meta_path, 'r', encoding='utf-8') as f:
+                    meta = json.load(f)
+                if np.dtype(meta.get('dtype')) != self.dtype:
+                    print(f"Kiểu dữ liệu embedding cache thay đổi ({meta.get('dtype')} -> {self.dtype}), tạo cache mới")
+                    self.clear_all()
+                    return
+                self.dim = meta.get('dim')
+
+            self._key_to_row = {}
+            self._matrix = None
+            self._keys_offset = 0
+            self._keys_inode = None
+            if self.dim is None:
+                return
+
+            keys = []
+            if os.path.exists(self.keys_path):
+                with open(self.keys_path, 'r', encoding='utf-8') as f:
+                    keys = [line.strip() for line in f if line.strip()]
+
+            row_bytes = self.dim * self.dtype.itemsize
+            vectors_size = os.path.getsize(self.vectors_path) if os.path.exists(self.vectors_path) else 0
+            row_count = min(len(keys), vectors_size // row_bytes)
+
+            # Cắt bỏ phần ghi dở để dòng mới ghi thêm luôn khớp giữa keys và vectors
+            if len(keys) != row_count or vectors_size != row_count * row_bytes or not os.path.exists(self.keys_path):
+                with open(self.vectors_path, 'ab'):
+                    pass
+                os.truncate(self.vectors_path, row_count * row_bytes)
+                with open(self.keys_path, 'w', encoding='utf-8') as f:
+                    f.write(''.join(f"{key}\n" for key in keys[:row_count]))
+                print(f"Đã sửa embedding cache bị ghi dở, giữ lại {row_count} vectors")
+
+            self._key_to_row = {key: row for row, key in enumerate(keys[:row_count])}
+            keys_stat = os.stat(self.keys_path)
+            self._keys_offset = keys_stat.st_size
+            self._keys_inode = keys_stat.st_ino
+            print(f"Đã nạp embedding cache với {len(self._key_to_row)} vectors ({self.model_name})")
+        except Exception as e:
+            print(f"Lỗi khi nạp embedding cache, tạo cache mới: {e}")
+            self.clear_all()
+
+    def _sync_with_disk(self):
+        """
+        Đồng bộ index key -> dòng với các dòng tiến trình khác đã ghi thêm (gọi khi đang giữ khóa file)
+
+        Nếu keys.txt bị thay bằng file mới (tiến trình khác nén cache) thì nạp lại toàn bộ index,
+        còn không thì chỉ đọc phần keys ghi thêm sau vị trí đã đọc.
+        """
+        try:
+            if self.dim is None and os.path.exists(self.meta_path):
+                self._load_index()
+                return
+            if not os.path.exists(self.keys_path):
+                if self._key_to_row:
+                    self._load_index()
+                return
+
+            keys_stat = os.stat(self.keys_path)
+            if keys_stat.st_ino != self._keys_inode or keys_stat.st_size < self._keys_offset:
+                self._load_index()
+                return
+            if keys_stat.st_size == self._keys_offset:
+                return
+
+            with open(self.keys_path, 'rb') as f:
+                f.seek(self._keys_offset)
+                appended = f.read()
+            # Chỉ nhận các dòng đã ghi trọn vẹn
+            appended = appended[:appended.rfind(b'\n') + 1]
+            for key in appended.decode('utf-8').split():
+                self._key_to_row.setdefault(key, len(self._key_to_row))
+            self._keys_offset += len(appended)
+            self._matrix = None
+        except Exception as e:
+            print(f"Lỗi khi đồng bộ embedding cache: {e}")
+
+    def _get_matrix(self):
+        """
+        Memory map ma trận vectors (mở lại sau mỗi lần ghi thêm)
+        """
+        row_count = len(self._key_to_row)
+        if row_count == 0:
+            return None
+        if self._matrix is None or self._matrix.shape[0] != row_count:
+            self._matrix = np.memmap(self.vectors_path, dtype=self.dtype, mode='r', shape=(row_count, self.dim))
+        return self._matrix
+
+    def _get_cache_key(self, text):
+        """
+        Tạo key cache từ tên mô hình và nội dung văn bản
+        """
+        hasher = hashlib.blake2b(digest_size=16)
+        hasher.update(self.model_name.encode('utf-8'))
+        hasher.update(b'\0')
+        hasher.update(text.encode('utf-8'))
+        return hasher.hexdigest()
+
+    def get_many(self, texts):
+        """
+        Lấy embeddings đã cache cho danh sách văn bản
+
+        Returns:
+            list: Vector (list float) cho văn bản đã cache, None cho văn bản chưa có
+        """
+        with self._lock, self._file_lock(shared=True):
+            self._sync_with_disk()
+            matrix = self._get_matrix()
+            results = [None] * len(texts)
+            hit_positions, hit_rows = [], []
+            for position, text in enumerate(texts):
+                row = self._key_to_row.get(self._get_cache_key(text))
+                if row is not None and matrix is not None:
+                    hit_positions.append(position)
+                    hit_rows.append(row)
+
+            if hit_rows:
+                # Đọc tất cả các dòng trúng cache trong một lần truy cập memory map
+                hit_vectors = np.asarray(matrix[hit_rows], dtype=np.float32).tolist()
+                for position, vector in zip(hit_positions, hit_vectors):
+                    results[position] = vector
+
+            self.hits += len(hit_rows)
+            self.misses += len(texts) - len(hit_rows)
+            return results
+
+    def put_many(self, texts, vectors):
+        """
+        Lưu embeddings của các văn bản vào cache
+        """
+        if not texts:
+            return
+
+        with self._lock, self._file_lock():
+            # Đọc lại số dòng dưới khóa: tiến trình khác có thể vừa ghi thêm
+            self._sync_with_disk()
+            new_keys, new_vectors, seen_keys = [], [], set()
+            for text, vector in zip(texts, vectors):
+                key = self._get_cache_key(text)
+                if key in self._key_to_row or key in seen_keys:
+                    continue
+                seen_keys.add(key)
+                new_keys.append(key)
+                new_vectors.append(vector)
+
+            if not new_keys:
+                return
+
+            matrix = np.asarray(new_vectors, dtype=self.dtype)
+            if self.dim is None:
+                self.dim = int(matrix.shape[1])
+                with open(self.meta_path, 'w', encoding='utf-8') as f:
+                    json.dump({'dim': self.dim, 'dtype': self.dtype.name, 'model_name': self.model_name}, f)
+
+            try:
+                # Ghi vectors trước rồi mới ghi keys: key chỉ được dùng khi vector đã nằm trên đĩa
+                with open(self.vectors_path, 'ab') as f:
+                    f.write(matrix.tobytes())
+                with open(self.keys_path, 'a', encoding='utf-8') as f:
+                    f.write(''.join(f"{key}\n" for key in new_keys))
+            except Exception as e:
+                print(f"Lỗi khi lưu embedding cache: {e}")
+                # Nạp lại từ đĩa để cắt bỏ phần ghi dở
+                self._load_index()
+                return
+
+            start_row = len(self._key_to_row)
+            for offset, key in enumerate(new_keys):
+                self._key_to_row[key] = start_row + offset
+            keys_stat = os.stat(self.keys_path)
+            self._keys_offset = keys_stat.st_size
+            self._keys_inode = keys_stat.st_ino
+            self._matrix = None
+
+    def compact(self, live_texts, min_stale_ratio=0.5):
+        """
+        Nén cache, chỉ giữ embeddings của các văn bản đang nằm trong vector store
+
+        Cache chỉ ghi thêm nên lớn dần khi catalog thay đổi; chỉ nén khi tỷ lệ dòng không còn
+        dùng vượt `min_stale_ratio` để tránh ghi lại toàn bộ file sau mỗi lần cập nhật nhỏ.
+
+        Args:
+            live_texts: Các văn bản (chunks) của vector store hiện tại
+            min_stale_ratio (float): Tỷ lệ dòng không còn dùng tối thiểu để nén
+
+        Returns:
+            int: Số vectors đã xóa khỏi cache
+        """
+        with self._lock, self._file_lock():
+            self._sync_with_disk()
+            total = len(self._key_to_row)
+            live_keys = {self._get_cache_key(text) for text in live_texts}
+            kept = sorted((row, key) for key, row in self._key_to_row.items() if key in live_keys)
+            removed = total - len(kept)
+            if total == 0 or removed <= total * min_stale_ratio:
+                return 0
+
+            try:
+                matrix = self._get_matrix()
+                kept_vectors = np.ascontiguousarray(matrix[[row for row, _ in kept]]) if kept else np.empty((0, self.dim), dtype=self.dtype)
+                self._matrix = None
+                with open(self.vectors_path + ".tmp", 'wb') as f:
+                    f.write(kept_vectors.tobytes())
+                with open(self.keys_path + ".tmp", 'w', encoding='utf-8') as f:
+                    f.write(''.join(f"{key}\n" for _, key in kept))
+                # Xóa keys trước: nếu dừng giữa chừng, cache chỉ bị rỗng chứ không lệch giữa keys và vectors
+                os.remove(self.keys_path)
+                os.replace(self.vectors_path + ".tmp", self.vectors_path)
+                os.replace(self.keys_path + ".tmp", self.keys_path)
+            except Exception as e:
+                print(f"Lỗi khi nén embedding cache: {e}")
+                self._load_index()
+                return 0
+
+            self._load_index()
+            print(f"Đã nén embedding cache: xóa {removed} vectors không còn dùng, giữ lại {len(kept)}")
+            return removed
+
+    def stats(self):
+        """
+        Thống kê số lần trúng / trượt cache kể từ khi khởi động (hoặc lần reset gần nhất)
+        """
+        with self._lock:
+            total = self.hits + self.misses
+            return {
+                'entries': len(self._key_to_row),
+                'hits': self.hits,
+                'misses': self.misses,
+                'hit_rate': round(self.hits / total, 4) if total else 0.0
+            }
+
+    def reset_stats(self):
+        with self._lock:
+            self.hits = 0
+            self.misses = 0
+
+    def clear_all(self):
+        """
+        Xóa toàn bộ embeddings đã cache của mô hình
+        """
+        with self._lock, self._file_lock():
+            for path in (self.meta_path, self.keys_path, self.vectors_path):
+                if os.path.exists(path):
+                    os.remove(path)
+            self.dim = None
+            self._key_to_row = {}
+            self._matrix = None
+            self._keys_offset = 0
+            self._keys_inode = None
+            print(f"Đã xóa embedding cache ({self.model_name})")
+
+
+class CachedEmbeddings(Embeddings):
+    """
+    Bọc một đối tượng Embeddings của LangChain: văn bản đã có trong EmbeddingCache
+    không được đưa qua mô hình nữa, chỉ các văn bản mới mới được tính embeddings
+
+    Chỉ embeddings của documents (chunks khi xây dựng vector store) được lưu xuống đĩa. Embeddings
+    câu hỏi nằm trong một LRU trong bộ nhớ có giới hạn, để cache trên đĩa không lớn dần theo lượng truy vấn.
+
+    Args:
+        base_embeddings: Đối tượng Embeddings của LangChain
+        cache (EmbeddingCache): Cache trên đĩa cho embeddings của documents
+        query_cache_size (int): Số câu hỏi tối đa giữ embeddings trong bộ nhớ
+    """
+    def __init__(self, base_embeddings, cache, query_cache_size=4096):
+        self.base_embeddings = base_embeddings
+        self.cache = cache
+        self.query_cache_size = query_cache_size
+        self._query_vectors = OrderedDict()
+        self._query_lock = threading.Lock()
+
+    def embed_documents(self, texts):
+        texts = list(texts)
+        vectors = self.cache.get_many(texts)
+
+        missing_indexes = [i for i, vector in enumerate(vectors) if vector is None]
+        if missing_indexes:
+            # Loại bỏ văn bản trùng lặp trước khi đưa qua mô hình
+            missing_texts = list(dict.fromkeys(texts[i] for i in missing_indexes))
+            computed = dict(zip(missing_texts, self.base_embeddings.embed_documents(missing_texts)))
+            self.cache.put_many(missing_texts, [computed[text] for text in missing_texts])
+            for i in missing_indexes:
+                vectors[i] = list(computed[texts[i]])
+
+        return vectors
+
+    def embed_query(self, text):
+        with self._query_lock:
+            vector = self._query_vectors.get(text)
+            if vector is not None:
+                self._query_vectors.move_to_end(text)
+                return list(vector)
+
+        vector = self.base_embeddings.embed_query(text)
+        with self._query_lock:
+            self._query_vectors[text] = vector
+            self._query_vectors.move_to_end(text)
+            while len(self._query_vectors) > self.query_cache_size:
+                self._query_vectors.popitem(last=False)
+        return list(vector)
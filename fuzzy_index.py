@@ -0,0 +1,123 @@
+"""
+Fuzzy Name Index - Tìm tên gần đúng (không phân biệt dấu) cho giảng viên và khóa học
+Cải tiến độ trễ cho LMS-RAG-Chatbot: lọc ứng viên bằng trigram, chỉ chấm điểm các ứng viên
+"""
+
+import unicodedata
+
+import numpy as np
+from rapidfuzz import fuzz, process
+
+
+def normalize_catalog_text(text):
+    """
+    Chuẩn hóa tên / danh mục để làm key index: chữ thường, bỏ dấu, gộp khoảng trắng
+    """
+    if not isinstance(text, str):
+        return ""
+    text = unicodedata.normalize('NFD', text.lower().replace('đ', 'd'))
+    text = ''.join(c for c in text if not unicodedata.combining(c))
+    return ' '.join(text.split())
+
+
+def _trigrams(normalized):
+    """
+    Tập trigram của chuỗi đã chuẩn hóa (thêm khoảng trắng hai đầu để tên ngắn vẫn có trigram)
+    """
+    padded = f"  {normalized} "
+    return {padded[i:i + 3] for i in range(len(padded) - 2)}
+
+
+class FuzzyNameIndex:
+    """
+    Index tên dựng sẵn: tên đã chuẩn hóa + inverted index trigram -> vị trí
+
+    Mỗi lần tìm chỉ đọc posting list của các trigram trong câu hỏi, đếm số trigram chung
+    bằng numpy, rồi chấm điểm `fuzz.ratio` (thang 0-100 như thefuzz) cho tối đa
+    `max_candidates` ứng viên trong một lần gọi `process.cdist`.
+
+    Args:
+        items: Danh sách đối tượng cần tìm (document MongoDB)
+        get_name: Hàm lấy tên từ một đối tượng
+        max_candidates: Số ứng viên tối đa được chấm điểm cho mỗi lần tìm
+        max_postings: Tổng độ dài posting list tối đa được đọc; bỏ bớt các trigram phổ biến nhất khi vượt
+    """
+    def __init__(self, items, get_name, max_candidates=256, max_postings=50000):
+        self.max_candidates = max_candidates
+        self.max_postings = max_postings
+        self.items = []
+        self.names = []
+
+        postings = {}
+        for item in items:
+            normalized = normalize_catalog_text(get_name(item))
+            if not normalized:
+                continue
+            position = len(self.items)
+            self.items.append(item)
+            self.names.append(normalized)
+            for gram in _trigrams(normalized):
+                postings.setdefault(gram, []).append(position)
+
+        self._postings = {gram: np.asarray(positions, dtype=np.int32) for gram, positions in postings.items()}
+
+    def __len__(self):
+        return len(self.items)
+
+    def _candidates(self, query_grams):
+        posting_lists = sorted(
+            (self._postings[gram] for gram in query_grams if gram in self._postings),
+            key=len
+        )
+        if not posting_lists:
+            return np.empty(0, dtype=np.int32)
+
+        # Trigram hiếm phân biệt tốt hơn: bỏ các trigram quá phổ biến khi tổng posting quá lớn
+        selected, total = [], 0
+        for positions in posting_lists:
+            if selected and total + len(positions) > self.max_postings:
+                break
+            selected.append(positions)
+            total += len(positions)
+
+        # Đếm theo các vị trí có trong posting list (không cấp phát mảng theo kích thước catalog)
+        matched, counts = np.unique(np.concatenate(selected), return_counts=True)
+        if len(matched) > self.max_candidates:
+            top = np.argpartition(counts, -self.max_candidates)[-self.max_candidates:]
+            matched = matched[top]
+        return matched
+
+    def search(self, name, limit=5, score_cutoff=60):
+        """
+        Tìm các đối tượng có tên gần giống nhất
+
+        Args:
+            name (str): Tên cần tìm
+            limit (int): Số kết quả tối đa
+            score_cutoff (int): Chỉ lấy kết quả có điểm LỚN HƠN ngưỡng này (0-100)
+
+        Returns:
+            list: Danh sách (đối tượng, điểm) theo điểm giảm dần
+        """
+        normalized = normalize_catalog_text(name)
+        if not normalized or not self.items:
+            return []
+
+        candidates = self._candidates(_trigrams(normalized))
+        if len(candidates) == 0:
+            return []
+
+        scores = process.cdist(
+            [normalized], [self.names[i] for i in candidates],
+            scorer=fuzz.ratio, dtype=np.uint8
+        )[0]
+
+        order = np.argsort(-scores, kind='stable')
+        results = []
+        for idx in order:
+            if scores[idx] <= score_cutoff:
+                break
+            results.append((self.items[candidates[idx]], int(scores[idx])))
+            if limit and len(results) >= limit:
+                break
+        return results
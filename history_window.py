@@ -0,0 +1,164 @@
+"""
+History Window - Giới hạn lịch sử hội thoại đưa vào prompt theo số lượt và ngân sách token
+Cải tiến độ trễ và chi phí LLM cho LMS-RAG-Chatbot: prompt không dài ra theo mỗi lượt hỏi
+
+Chỉ các lượt gần nhất (tối đa `max_turns` lượt, trong `token_budget` token) được gửi nguyên văn.
+Các tin nhắn cũ hơn được gộp vào một bản tóm tắt cuốn chiếu: bản tóm tắt được tạo trên thread
+nền (không nằm trên đường trả lời), lưu theo id tin nhắn cuối cùng đã được tóm tắt và được dùng
+lại ở các lượt sau.
+"""
+
+import math
+import threading
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+
+# Ước lượng thô cho tiếng Việt có dấu (không cần gọi API đếm token)
+CHARS_PER_TOKEN = 3
+
+# Các trường của chat_history cần cho cửa sổ lịch sử (đọc từ MongoDB)
+HISTORY_PROJECTION = {'user_id': 1, 'content': 1, 'is_user': 1, 'created_at': 1, 'session_number': 1}
+
+# Số lượt đọc thêm trước cửa sổ khi có tóm tắt: đủ để thấy tin nhắn mà bản tóm tắt của lượt trước
+# kết thúc ở đó, kể cả khi bản tóm tắt đó còn chậm một lượt
+SUMMARY_LOOKBACK_TURNS = 2
+
+
+def estimate_tokens(text):
+    """
+    Số token ước lượng của một đoạn văn bản
+    """
+    return math.ceil(len(text or '') / CHARS_PER_TOKEN)
+
+
+class HistoryWindow:
+    """
+    Chọn các tin nhắn gần nhất trong ngân sách token và tóm tắt cuốn chiếu phần còn lại
+
+    Args:
+        summarize: Hàm (bản tóm tắt trước hoặc None, danh sách tin nhắn) -> bản tóm tắt mới;
+            None để bỏ phần cũ mà không tóm tắt
+        max_turns (int): Số lượt hỏi đáp gần nhất tối đa được gửi nguyên văn
+        token_budget (int): Số token tối đa của các tin nhắn gửi nguyên văn
+        fetch_limit (int): Số tin nhắn gần nhất cần đọc từ MongoDB cho một lượt; None để tính theo
+            cửa sổ (`2 * max_turns`, cộng `SUMMARY_LOOKBACK_TURNS` lượt khi có tóm tắt)
+        max_summaries (int): Số bản tóm tắt tối đa được giữ trong bộ nhớ
+    """
+    def __init__(self, summarize=None, max_turns=3, token_budget=1200, fetch_limit=None, max_summaries=10000):
+        self.summarize = summarize
+        self.max_turns = max_turns
+        self.token_budget = token_budget
+        if fetch_limit is None:
+            fetch_limit = 2 * (max_turns + (SUMMARY_LOOKBACK_TURNS if summarize is not None else 0))
+        self.fetch_limit = fetch_limit
+        self.max_summaries = max_summaries
+
+        # id tin nhắn cuối đã tóm tắt -> bản tóm tắt hội thoại tính đến tin nhắn đó
+        self._summaries = OrderedDict()
+        self._pending = set()
+        self._lock = threading.Lock()
+        self.executor = ThreadPoolExecutor(max_workers=2, thread_name_prefix="history-summary")
+
+        self.requests = 0
+        self.tokens_before = 0
+        self.tokens_after = 0
+        self.summaries_built = 0
+
+    def _split(self, chat_history):
+        """
+        Tách lịch sử thành (phần cũ, các tin nhắn gần nhất nằm trong cửa sổ)
+        """
+        recent, tokens = [], 0
+        for message in reversed(chat_history):
+            message_tokens = estimate_tokens(message.content)
+            if len(recent) >= 2 * self.max_turns or (recent and tokens + message_tokens > self.token_budget):
+                break
+            recent.append(message)
+            tokens += message_tokens
+        recent.reverse()
+        return chat_history[:len(chat_history) - len(recent)], recent
+
+    def _latest_summary(self, older):
+        """
+        Bản tóm tắt mới nhất đã có, kết thúc tại một tin nhắn trong `older`
+
+        Lịch sử chỉ gồm `fetch_limit` tin nhắn gần nhất nên đầu danh sách trượt theo từng lượt;
+        bản tóm tắt được tra theo id tin nhắn cuối chứ không theo vị trí trong danh sách.
+
+        Returns:
+            tuple: (số tin nhắn đầu của `older` đã được tóm tắt, bản tóm tắt hoặc None)
+        """
+        with self._lock:
+            for index in range(len(older) - 1, -1, -1):
+                summary = self._summaries.get(str(older[index].id))
+                if summary is not None:
+                    self._summaries.move_to_end(str(older[index].id))
+                    return index + 1, summary
+        return 0, None
+
+    def _store_summary(self, key, summary):
+        with self._lock:
+            self._summaries[key] = summary
+            self._summaries.move_to_end(key)
+            while len(self._summaries) > self.max_summaries:
+                self._summaries.popitem(last=False)
+            self.summaries_built += 1
+
+    def _schedule_summary(self, older, summarized, previous_summary):
+        key = str(older[-1].id)
+        with self._lock:
+            if key in self._pending:
+                return
+            self._pending.add(key)
+
+        def summary_task():
+            try:
+                summary = self.summarize(previous_summary, older[summarized:])
+                if summary:
+                    self._store_summary(key, summary)
+            except Exception as e:
+                print(f"Lỗi khi tóm tắt lịch sử hội thoại: {e}")
+            finally:
+                with self._lock:
+                    self._pending.discard(key)
+
+        self.executor.submit(summary_task)
+
+    def build(self, chat_history):
+        """
+        Lịch sử đưa vào prompt cho một lượt hỏi
+
+        Nếu bản tóm tắt chưa bao phủ hết phần cũ, lượt này dùng bản tóm tắt gần nhất đã có và
+        bản tóm tắt mới được tạo trên thread nền cho các lượt sau.
+
+        Returns:
+            tuple: (bản tóm tắt phần cũ hoặc None, danh sách tin nhắn gần nhất)
+        """
+        chat_history = list(chat_history)
+        older, recent = self._split(chat_history)
+
+        summary = None
+        if older and self.summarize is not None:
+            summarized, summary = self._latest_summary(older)
+            if summarized < len(older):
+                self._schedule_summary(older, summarized, summary)
+
+        tokens_before = sum(estimate_tokens(message.content) for message in chat_history)
+        tokens_after = estimate_tokens(summary) + sum(estimate_tokens(message.content) for message in recent)
+        with self._lock:
+            self.requests += 1
+            self.tokens_before += tokens_before
+            self.tokens_after += tokens_after
+        print(f"Lịch sử hội thoại: {len(chat_history)} tin nhắn (~{tokens_before} token) -> "
+              f"{len(recent)} tin nhắn{' + tóm tắt' if summary else ''} (~{tokens_after} token)")
+        return summary, recent
+
+    def stats(self):
+        with self._lock:
+            return {
+                "requests": self.requests,
+                "avg_history_tokens_before": round(self.tokens_before / self.requests, 1) if self.requests else 0.0,
+                "avg_history_tokens_after": round(self.tokens_after / self.requests, 1) if self.requests else 0.0,
+                "summaries": len(self._summaries),
+                "summaries_built": self.summaries_built
+            }
@@ -0,0 +1,100 @@
+"""
+Hybrid Retriever - Chạy song song nhiều cách tìm kiếm (vector, từ khóa) và gộp kết quả bằng Reciprocal Rank Fusion
+Cải tiến độ phủ và độ trễ cho LMS-RAG-Chatbot: tìm kiếm trực tiếp không còn phải chờ RAG thất bại mới chạy
+"""
+
+import time
+from concurrent.futures import ThreadPoolExecutor, wait
+
+
+def reciprocal_rank_fusion(result_lists, key, k=60):
+    """
+    Gộp nhiều danh sách kết quả đã xếp hạng: điểm của mỗi item là tổng 1 / (k + thứ hạng) trên các danh sách
+
+    Mỗi key chỉ được tính thứ hạng tốt nhất trong một danh sách và giữ item xuất hiện đầu tiên,
+    nên kết quả không có hai item cùng key.
+
+    Args:
+        result_lists: Các danh sách kết quả, item đứng trước có thứ hạng cao hơn
+        key: Hàm item -> key dùng để loại trùng (ví dụ id khóa học)
+        k (int): Hằng số làm mượt của RRF
+
+    Returns:
+        list: Các item theo điểm giảm dần (cùng điểm thì giữ thứ tự xuất hiện)
+    """
+    scores, items = {}, {}
+    for results in result_lists:
+        seen = set()
+        for rank, item in enumerate(results, 1):
+            item_key = key(item)
+            if item_key in seen:
+                continue
+            seen.add(item_key)
+            scores[item_key] = scores.get(item_key, 0.0) + 1.0 / (k + rank)
+            items.setdefault(item_key, item)
+    return [items[item_key] for item_key in sorted(scores, key=scores.get, reverse=True)]
+
+
+class HybridRetriever:
+    """
+    Chạy các hàm tìm kiếm song song trên một thread pool rồi gộp kết quả bằng RRF
+
+    Hàm tìm kiếm đầu tiên chạy ngay trên thread gọi, các hàm còn lại chạy trên pool, nên độ trễ
+    của cả bước bằng hàm chậm nhất thay vì tổng các hàm. Hàm tìm kiếm bị lỗi được coi như không
+    có kết quả. Khi có `timeout` (thời hạn còn lại của request), mọi hàm chạy trên pool và hàm
+    chưa xong khi hết thời gian cũng được coi như không có kết quả.
+
+    Args:
+        searches (dict): Tên -> hàm (query) -> danh sách kết quả đã xếp hạng
+        key: Hàm item -> key dùng để loại trùng
+        max_workers (int): Số thread của pool
+        rrf_k (int): Hằng số làm mượt của RRF
+        max_results (int): Số kết quả tối đa sau khi gộp
+    """
+    def __init__(self, searches, key, max_workers=8, rrf_k=60, max_results=10):
+        self.searches = dict(searches)
+        self.key = key
+        self.rrf_k = rrf_k
+        self.max_results = max_results
+        self.executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="hybrid-search")
+
+    def _search(self, name, search, query):
+        start_time = time.perf_counter()
+        try:
+            results = list(search(query))
+        except Exception as e:
+            print(f"Lỗi khi tìm kiếm {name}: {e}")
+            results = []
+        print(f"Tìm kiếm {name}: {len(results)} kết quả trong {(time.perf_counter() - start_time) * 1000:.1f} ms")
+        return results
+
+    def retrieve(self, query, timeout=None):
+        """
+        Kết quả đã gộp và loại trùng của tất cả các hàm tìm kiếm
+
+        Args:
+            timeout (float): Thời gian chờ tối đa (giây); None nếu không giới hạn
+
+        Returns:
+            list: Tối đa `max_results` item
+        """
+        if timeout is not None:
+            return self._retrieve_with_timeout(query, timeout)
+
+        (first_name, first_search), *others = self.searches.items()
+        futures = [self.executor.submit(self._search, name, search, query) for name, search in others]
+        result_lists = [self._search(first_name, first_search, query)]
+        result_lists.extend(future.result() for future in futures)
+        return reciprocal_rank_fusion(result_lists, self.key, self.rrf_k)[:self.max_results]
+
+    def _retrieve_with_timeout(self, query, timeout):
+        futures = {
+            self.executor.submit(self._search, name, search, query): name
+            for name, search in self.searches.items()
+        }
+        done, not_done = wait(futures, timeout=timeout)
+        for future in not_done:
+            print(f"Tìm kiếm {futures[future]} chưa xong trước thời hạn, bỏ qua kết quả")
+        # Giữ thứ tự các hàm tìm kiếm để kết quả gộp ổn định
+        result_lists = [future.result() for future in futures if future in done]
+        return reciprocal_rank_fusion(result_lists, self.key, self.rrf_k)[:self.max_results]
@@ -0,0 +1,473 @@
+"""
+Incremental Indexer - Cập nhật FAISS vector store theo từng khóa học / giảng viên thay đổi
+Chi phí cập nhật tỉ lệ với số entity thay đổi thay vì kích thước toàn bộ catalog
+"""
+
+import hashlib
+import threading
+import time
+from collections import deque
+from contextlib import contextmanager
+
+from langchain_community.vectorstores import FAISS
+
+# Ánh xạ collection MongoDB -> loại entity dùng trong key của vector store
+COLLECTION_ENTITY_TYPES = {
+    "courses": "course",
+    "mentors": "mentor",
+    "users": "user",
+}
+
+# Điều kiện để document được tính là còn tồn tại trong catalog (dùng để phát hiện xóa)
+PRESENCE_FILTERS = {
+    "courses": {"status": "active"},
+    "mentors": {},
+}
+
+
+def entity_content_hash(text):
+    """
+    Hash nội dung văn bản của một entity
+    """
+    return hashlib.sha256(text.encode('utf-8')).hexdigest()
+
+
+class ReadWriteLock:
+    """
+    Khóa nhiều reader / một writer (ưu tiên writer)
+
+    Các truy vấn đọc vector store song song; lần cập nhật chờ các truy vấn đang chạy xong,
+    chặn truy vấn mới trong lúc sửa index rồi trả lại quyền đọc.
+    """
+    def __init__(self):
+        self._cond = threading.Condition()
+        self._readers = 0
+        self._writing = False
+        self._waiting_writers = 0
+
+    @contextmanager
+    def read(self):
+        with self._cond:
+            self._cond.wait_for(lambda: not self._writing and not self._waiting_writers)
+            self._readers += 1
+        try:
+            yield
+        finally:
+            with self._cond:
+                self._readers -= 1
+                if not self._readers:
+                    self._cond.notify_all()
+
+    @contextmanager
+    def write(self):
+        with self._cond:
+            self._waiting_writers += 1
+            self._cond.wait_for(lambda: not self._writing and not self._readers)
+            self._waiting_writers -= 1
+            self._writing = True
+        try:
+            yield
+        finally:
+            with self._cond:
+                self._writing = False
+                self._cond.notify_all()
+
+
+class SynchronizedFAISS(FAISS):
+    """
+    FAISS vector store được cập nhật tại chỗ trong khi các request khác đang truy vấn
+
+    Truy vấn giữ khóa đọc, thay đổi index / docstore giữ khóa ghi. Nhờ vậy cập nhật tăng dần
+    không phải sao chép toàn bộ index và docstore, chi phí tỉ lệ với số chunk thay đổi
+    (`remove_ids` của index flat vẫn dồn lại mảng vectors nhưng không cấp phát bản sao).
+    """
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.rw_lock = ReadWriteLock()
+
+    @classmethod
+    def wrap(cls, vector_store):
+        """
+        Dùng chung index, docstore của một FAISS vector store có sẵn (không sao chép)
+        """
+        if isinstance(vector_store, cls):
+            return vector_store
+        return cls(
+            embedding_function=vector_store.embedding_function,
+            index=vector_store.index,
+            docstore=vector_store.docstore,
+            index_to_docstore_id=vector_store.index_to_docstore_id,
+            normalize_L2=vector_store._normalize_L2,
+            distance_strategy=vector_store.distance_strategy
+        )
+
+    def similarity_search_with_score_by_vector(self, *args, **kwargs):
+        with self.rw_lock.read():
+            return super().similarity_search_with_score_by_vector(*args, **kwargs)
+
+    def max_marginal_relevance_search_with_score_by_vector(self, *args, **kwargs):
+        with self.rw_lock.read():
+            return super().max_marginal_relevance_search_with_score_by_vector(*args, **kwargs)
+
+    def save_local(self, *args, **kwargs):
+        with self.rw_lock.read():
+            return super().save_local(*args, **kwargs)
+
+    def delete(self, ids=None, **kwargs):
+        with self.rw_lock.write():
+            return super().delete(ids, **kwargs)
+
+    def add_embeddings(self, *args, **kwargs):
+        with self.rw_lock.write():
+            return super().add_embeddings(*args, **kwargs)
+
+    def add_texts(self, texts, metadatas=None, ids=None, **kwargs):
+        texts = list(texts)
+        # Tính embeddings ngoài khóa ghi: truy vấn chỉ bị chặn trong lúc sửa index
+        embeddings = self._embed_documents(texts)
+        return self.add_embeddings(list(zip(texts, embeddings)), metadatas=metadatas, ids=ids, **kwargs)
+
+    def replace(self, stale_ids, texts, metadatas, ids):
+        """
+        Xóa các chunk cũ và thêm chunk mới trong cùng một lần giữ khóa ghi, để truy vấn không
+        thấy trạng thái entity đã bị xóa nhưng chưa được thêm lại
+
+        Embeddings của chunk mới được tính trước, ngoài khóa ghi.
+        """
+        embeddings = self._embed_documents(texts) if texts else []
+        with self.rw_lock.write():
+            if stale_ids:
+                FAISS.delete(self, stale_ids)
+            if texts:
+                FAISS.add_embeddings(self, list(zip(texts, embeddings)), metadatas=metadatas, ids=ids)
+
+
+class ChangeBatch:
+    """
+    Tập các thay đổi đọc được từ change feed
+
+    changed: {loại entity: set(id)} các entity được thêm hoặc sửa
+    deleted: {loại entity: set(id)} các entity bị xóa
+    present: {loại entity: set(id)} toàn bộ id còn tồn tại (nếu feed biết), dùng để phát hiện xóa
+    """
+    def __init__(self):
+        self.changed = {entity_type: set() for entity_type in COLLECTION_ENTITY_TYPES.values()}
+        self.deleted = {entity_type: set() for entity_type in COLLECTION_ENTITY_TYPES.values()}
+        self.present = {}
+
+    def is_empty(self):
+        # `present` chỉ là thông tin đối chiếu, bản thân nó không phải thay đổi
+        return not any(self.changed.values()) and not any(self.deleted.values())
+
+    def __repr__(self):
+        changed = {k: len(v) for k, v in self.changed.items() if v}
+        deleted = {k: len(v) for k, v in self.deleted.items() if v}
+        return f"ChangeBatch(changed={changed}, deleted={deleted})"
+
+
+class PollingChangeFeed:
+    """
+    Change feed dựa trên watermark `updatedAt` (hoạt động với mọi MongoDB, kể cả mongomock)
+
+    Mỗi lần poll chỉ đọc _id của các document có `updatedAt` mới hơn watermark.
+    Document bị xóa hẳn được phát hiện bằng cách đếm: feed giữ tập _id đã biết (cập nhật theo
+    các thay đổi đọc được), và chỉ khi `count_documents` khác số _id đã biết mới đọc lại
+    toàn bộ danh sách _id còn tồn tại để so sánh.
+    """
+    def __init__(self, db, timestamp_field="updatedAt", detect_deletions=True):
+        self.db = db
+        self.timestamp_field = timestamp_field
+        self.detect_deletions = detect_deletions
+        # Watermark và các _id đã thấy tại đúng watermark (tránh bỏ sót khi trùng timestamp)
+        self._watermarks = {}
+        self._seen_at_watermark = {}
+        # _id (dạng str) của các document còn tồn tại theo PRESENCE_FILTERS
+        self._known_ids = {}
+        self.prime()
+
+    def prime(self):
+        """
+        Đặt watermark bằng thời điểm cập nhật mới nhất hiện có trong từng collection
+        """
+        for collection_name in COLLECTION_ENTITY_TYPES:
+            latest = list(
+                self.db[collection_name]
+                .find({self.timestamp_field: {"$exists": True}}, {self.timestamp_field: 1})
+                .sort(self.timestamp_field, -1)
+                .limit(1)
+            )
+            self._watermarks[collection_name] = latest[0][self.timestamp_field] if latest else None
+            self._seen_at_watermark[collection_name] = {latest[0]['_id']} if latest else set()
+
+        if self.detect_deletions:
+            for collection_name, presence_filter in PRESENCE_FILTERS.items():
+                self._known_ids[collection_name] = self._present_ids(collection_name, presence_filter)
+
+    def _present_ids(self, collection_name, presence_filter):
+        # Chỉ đọc _id: một round trip, không tải nội dung document
+        return {str(_id) for _id in self.db[collection_name].distinct('_id', presence_filter)}
+
+    def poll(self):
+        """
+        Đọc các thay đổi kể từ lần poll trước
+
+        Returns:
+            ChangeBatch
+        """
+        batch = ChangeBatch()
+
+        for collection_name, entity_type in COLLECTION_ENTITY_TYPES.items():
+            watermark = self._watermarks.get(collection_name)
+            if watermark is None:
+                query = {self.timestamp_field: {"$exists": True}}
+            else:
+                query = {self.timestamp_field: {"$gte": watermark}}
+
+            presence_filter = PRESENCE_FILTERS.get(collection_name, {})
+            projection = {self.timestamp_field: 1, **{field: 1 for field in presence_filter}}
+            known_ids = self._known_ids.get(collection_name)
+
+            seen = self._seen_at_watermark.get(collection_name, set())
+            # So với watermark của lần poll trước (watermark bên dưới tăng dần theo document đã đọc)
+            previous_watermark, previous_seen = watermark, set(seen)
+            for doc in self.db[collection_name].find(query, projection):
+                updated_at = doc.get(self.timestamp_field)
+                if updated_at == previous_watermark and doc['_id'] in previous_seen:
+                    continue
+
+                batch.changed[entity_type].add(str(doc['_id']))
+                if known_ids is not None:
+                    if all(doc.get(field) == value for field, value in presence_filter.items()):
+                        known_ids.add(str(doc['_id']))
+                    else:
+                        known_ids.discard(str(doc['_id']))
+
+                if watermark is None or updated_at > watermark:
+                    watermark = updated_at
+                    seen = {doc['_id']}
+                elif updated_at == watermark:
+                    seen.add(doc['_id'])
+
+            self._watermarks[collection_name] = watermark
+            self._seen_at_watermark[collection_name] = seen
+
+        if self.detect_deletions:
+            for collection_name, presence_filter in PRESENCE_FILTERS.items():
+                # Số document khớp với số _id đã biết: không có document nào bị xóa hẳn
+                if self.db[collection_name].count_documents(presence_filter) == len(self._known_ids[collection_name]):
+                    continue
+                present_ids = self._present_ids(collection_name, presence_filter)
+                batch.present[COLLECTION_ENTITY_TYPES[collection_name]] = present_ids
+                self._known_ids[collection_name] = present_ids
+
+        return batch
+
+
+class ChangeStreamFeed:
+    """
+    Change feed dựa trên MongoDB change streams (yêu cầu replica set)
+
+    Một thread nền đọc change stream và gom sự kiện; `poll()` trả về các sự kiện đã gom.
+    """
+    def __init__(self, db):
+        self.db = db
+        self._events = deque()
+        self._resume_token = None
+        self._thread = None
+        self._stop_event = threading.Event()
+
+    def start(self):
+        if self._thread is None or not self._thread.is_alive():
+            self._stop_event.clear()
+            self._thread = threading.Thread(target=self._run, daemon=True)
+            self._thread.start()
+            print("Đã khởi động thread đọc MongoDB change stream")
+
+    def stop(self):
+        self._stop_event.set()
+
+    def _run(self):
+        pipeline = [{"$match": {"ns.coll": {"$in": list(COLLECTION_ENTITY_TYPES)}}}]
+        while not self._stop_event.is_set():
+            try:
+                with self.db.watch(pipeline, resume_after=self._resume_token) as stream:
+                    while not self._stop_event.is_set():
+                        change = stream.try_next()
+                        if change is None:
+                            time.sleep(0.5)
+                            continue
+                        self._events.append(change)
+                        self._resume_token = stream.resume_token
+            except Exception as e:
+                print(f"Lỗi khi đọc MongoDB change stream: {e}")
+                time.sleep(5)
+
+    def poll(self):
+        """
+        Lấy các thay đổi đã gom từ change stream
+
+        Returns:
+            ChangeBatch
+        """
+        self.start()
+        batch = ChangeBatch()
+
+        while self._events:
+            change = self._events.popleft()
+            entity_type = COLLECTION_ENTITY_TYPES.get(change.get('ns', {}).get('coll'))
+            document_key = change.get('documentKey', {}).get('_id')
+            if entity_type is None or document_key is None:
+                continue
+
+            if change.get('operationType') == 'delete':
+                batch.deleted[entity_type].add(str(document_key))
+            else:
+                batch.changed[entity_type].add(str(document_key))
+
+        return batch
+
+
+class IncrementalIndexer:
+    """
+    Giữ vector store hiện tại cùng trạng thái từng entity (hash nội dung, id các chunk,
+    các entity liên quan) để chỉ xóa / thêm lại chunks của entity thay đổi
+
+    Args:
+        split_entity: Hàm nhận entity (dict) và trả về (chunks, metadatas, ids)
+    """
+    def __init__(self, split_entity):
+        self.split_entity = split_entity
+        self.vector_store = None
+        self.entity_state = {}
+        self._lock = threading.RLock()
+
+    def reset(self, vector_store, entity_state):
+        """
+        Dùng vector store và trạng thái entity đã có (ví dụ nạp từ snapshot)
+        """
+        with self._lock:
+            self.vector_store = SynchronizedFAISS.wrap(vector_store)
+            self.entity_state = dict(entity_state or {})
+
+    def entity_hashes(self):
+        with self._lock:
+            return {key: state['hash'] for key, state in self.entity_state.items()}
+
+    def related_keys(self, keys):
+        """
+        Lấy các entity liên quan (theo trạng thái hiện tại) của danh sách key
+        """
+        with self._lock:
+            related = set()
+            for key in keys:
+                related.update(self.entity_state.get(key, {}).get('related', []))
+            return related
+
+    def keys_of_type(self, entity_type):
+        with self._lock:
+            prefix = f"{entity_type}:"
+            return {key for key in self.entity_state if key.startswith(prefix)}
+
+    def _split_entities(self, entities):
+        texts, metadatas, ids = [], [], []
+        new_state = {}
+        for entity in entities:
+            chunks, chunk_metadatas, chunk_ids = self.split_entity(entity)
+            texts.extend(chunks)
+            metadatas.extend(chunk_metadatas)
+            ids.extend(chunk_ids)
+            new_state[entity['key']] = {
+                'hash': entity_content_hash(entity['text']),
+                'doc_ids': chunk_ids,
+                'related': sorted(entity.get('related', []))
+            }
+        return texts, metadatas, ids, new_state
+
+    def build_full(self, entities, embeddings):
+        """
+        Xây dựng vector store mới từ toàn bộ entity
+
+        Returns:
+            FAISS
+        """
+        with self._lock:
+            texts, metadatas, ids, new_state = self._split_entities(entities)
+            if not texts:
+                print("CẢNH BÁO: Không có chunks sau khi tách văn bản!")
+                return None
+
+            vector_store = SynchronizedFAISS.from_texts(texts, embeddings, metadatas=metadatas, ids=ids)
+            self.vector_store = vector_store
+            self.entity_state = new_state
+            return vector_store
+
+    def apply(self, entities, scope_keys=None):
+        """
+        Cập nhật vector store theo danh sách entity mới
+
+        Args:
+            entities: Danh sách entity hiện tại trong phạm vi cập nhật
+            scope_keys: Tập key được xem xét; key nằm trong phạm vi nhưng không có trong
+                `entities` bị coi là đã xóa. None nghĩa là toàn bộ catalog.
+
+        Returns:
+            tuple: (vector store đã cập nhật, thống kê cập nhật)
+        """
+        with self._lock:
+            start_time = time.perf_counter()
+            entities_by_key = {entity['key']: entity for entity in entities}
+
+            if scope_keys is None:
+                scope_keys = set(self.entity_state) | set(entities_by_key)
+            else:
+                scope_keys = set(scope_keys) | set(entities_by_key)
+
+            added, changed, removed, unchanged = [], [], [], 0
+            for key in scope_keys:
+                entity = entities_by_key.get(key)
+                old_state = self.entity_state.get(key)
+                if entity is None:
+                    if old_state is not None:
+                        removed.append(key)
+                elif old_state is None:
+                    added.append(entity)
+                elif old_state['hash'] != entity_content_hash(entity['text']):
+                    changed.append(entity)
+                else:
+                    # Nội dung không đổi nhưng quan hệ có thể thay đổi
+                    old_state['related'] = sorted(entity.get('related', []))
+                    unchanged += 1
+
+            stats = {
+                'added': len(added),
+                'changed': len(changed),
+                'removed': len(removed),
+                'unchanged': unchanged,
+                'chunks_embedded': 0,
+                'chunks_removed': 0
+            }
+
+            if not added and not changed and not removed:
+                stats['seconds'] = round(time.perf_counter() - start_time, 3)
+                return self.vector_store, stats
+
+            # Cập nhật tại chỗ (không sao chép index): chỉ chunks của entity thay đổi bị xóa / thêm,
+            # các truy vấn đang chạy được bảo vệ bằng khóa đọc / ghi của vector store
+            vector_store = self.vector_store
+            new_state = dict(self.entity_state)
+
+            stale_doc_ids = []
+            for key in removed + [entity['key'] for entity in changed]:
+                stale_doc_ids.extend(new_state.pop(key)['doc_ids'])
+
+            texts, metadatas, ids, entity_updates = self._split_entities(added + changed)
+            vector_store.replace(stale_doc_ids, texts, metadatas, ids)
+            stats['chunks_removed'] = len(stale_doc_ids)
+            stats['chunks_embedded'] = len(texts)
+            new_state.update(entity_updates)
+
+            self.entity_state = new_state
+
+            stats['seconds'] = round(time.perf_counter() - start_time, 3)
+            print(f"Cập nhật vector store tăng dần: {stats}")
+            return vector_store, stats
@@ -0,0 +1,275 @@
+"""
+Intent Classifier - Phân loại ý định câu hỏi bằng các pattern được biên dịch một lần
+Cải tiến độ trễ cho LMS-RAG-Chatbot: chấm điểm tất cả intent trong một lần quét câu hỏi
+"""
+
+import re
+from bisect import bisect_left
+
+from query_expander import build_trie_regex
+
+# Pattern cho từng intent (thứ tự intent cũng là thứ tự ưu tiên khi điểm bằng nhau)
+# Mỗi pattern là chuỗi các cụm từ cố định nối với nhau bằng `.*` (cụm sau nằm sau cụm trước)
+INTENT_PATTERNS = {
+    'course_search': [
+        r'khóa học', r'khoá học', r'course', r'các khóa',
+        r'liệt kê.*khóa', r'có khóa', r'tìm khóa',
+        r'khóa học về', r'học về', r'học online',
+        r'danh sách.*khóa', r'thông tin.*khóa'
+    ],
+    'course_detail': [
+        r'chi tiết.*khóa học', r'thông tin chi tiết.*khóa',
+        r'nội dung.*khóa', r'bài học.*khóa',
+        r'có những gì.*khóa', r'khóa học.*gồm',
+        r'\[(.*?)\]', r'"(.*?)"', r'\'(.*?)\'',  # Khóa học trong ngoặc
+        r'khóa học mã số'
+    ],
+    'mentor_search': [
+        r'giảng viên', r'giáo viên', r'mentor', r'teacher',
+        r'người dạy', r'ai dạy', r'người hướng dẫn'
+    ],
+    'mentor_by_name': [
+        r'giảng viên tên', r'giáo viên tên',
+        r'thông tin.*giảng viên', r'thông tin.*giáo viên',
+        r'giảng viên.*là ai', r'thầy', r'cô'
+    ],
+    'mentor_by_specialization': [
+        r'giảng viên.*chuyên', r'giáo viên.*chuyên',
+        r'giảng viên.*expert', r'chuyên gia về',
+        r'giảng viên.*về', r'ai.*chuyên.*về'
+    ],
+    'course_comparison': [
+        r'so sánh.*khóa', r'khóa nào tốt hơn',
+        r'khóa.*hay hơn', r'nên chọn khóa',
+        r'khác nhau.*khóa', r'đâu tốt hơn',
+        r'.*và.*khác gì nhau'
+    ],
+    'price_question': [
+        r'giá.*khóa', r'học phí', r'chi phí',
+        r'bao nhiêu tiền', r'mất bao nhiêu'
+    ],
+    'rating_question': [
+        r'đánh giá', r'rating', r'review',
+        r'feedback', r'nhận xét', r'tốt không'
+    ]
+}
+
+# Mỗi pattern khớp của intent được cộng thêm 2 điểm nếu một trong các pattern boost khớp
+INTENT_BOOSTS = {
+    'course_comparison': [r'so sánh.*khóa'],  # Boost cho so sánh rõ ràng
+    'mentor_by_name': [r'giảng viên tên'],  # Boost cho tìm giảng viên theo tên rõ ràng
+    'course_detail': [r'\[(.*?)\]', r'"(.*?)"', r'\'(.*?)\''],  # Boost cho chi tiết khóa học cụ thể
+}
+
+# Ưu tiên khi điểm hai intent hàng đầu chênh lệch không đáng kể
+PRIORITY_ORDER = [
+    'course_comparison',  # Ưu tiên cao nhất cho so sánh
+    'course_detail',       # Sau đó đến chi tiết khóa học
+    'mentor_by_name',      # Tiếp theo là tìm giảng viên theo tên
+    'mentor_by_specialization',
+    'price_question',
+    'rating_question',
+    'mentor_search',
+    'course_search'        # Ưu tiên thấp nhất
+]
+
+# Ngưỡng điểm tối thiểu để xác định intent
+MIN_INTENT_SCORE = 1
+
+DEFAULT_INTENT = 'course_search'
+
+# Các cách viết nhóm "bất kỳ ký tự nào" được chấp nhận giữa hai cụm từ cố định
+_GAP_TOKENS = ('(.*?)', '.*?', '.*')
+_ESCAPED_CHARS = {'\\[': '[', '\\]': ']', "\\'": "'", '\\"': '"', '\\.': '.', '\\?': '?'}
+_REGEX_META = set('.^$*+?{}[]\\|()')
+
+
+def literal_segments(pattern):
+    """
+    Tách pattern thành các cụm từ cố định phải xuất hiện theo thứ tự
+
+    Ví dụ: r'liệt kê.*khóa' -> ('liệt kê', 'khóa'), r'\\[(.*?)\\]' -> ('[', ']')
+
+    Raises:
+        ValueError: Nếu pattern dùng cú pháp regex khác ngoài `.*`
+    """
+    segments, current, i = [], [], 0
+    while i < len(pattern):
+        gap = next((token for token in _GAP_TOKENS if pattern.startswith(token, i)), None)
+        if gap:
+            segments.append(''.join(current))
+            current = []
+            i += len(gap)
+            continue
+        escaped = pattern[i:i + 2]
+        if escaped in _ESCAPED_CHARS:
+            current.append(_ESCAPED_CHARS[escaped])
+            i += 2
+            continue
+        if pattern[i] in _REGEX_META:
+            raise ValueError(f"Pattern intent không được hỗ trợ: {pattern!r}")
+        current.append(pattern[i])
+        i += 1
+    segments.append(''.join(current))
+    return tuple(segment for segment in segments if segment)
+
+
+class IntentClassifier:
+    """
+    Phân loại intent: toàn bộ pattern được biên dịch một lần thành một regex duy nhất
+
+    Regex là một lookahead chứa trie của mọi cụm từ cố định. Một lần `finditer` cho biết
+    cụm dài nhất bắt đầu tại mỗi vị trí; các cụm ngắn hơn bắt đầu cùng vị trí luôn là tiền tố
+    của cụm đó nên được suy ra từ bảng tiền tố dựng sẵn. Sau đó chỉ các pattern có cụm đầu
+    tiên xuất hiện mới được kiểm tra thứ tự vị trí các cụm.
+    """
+    def __init__(self, intent_patterns=None, boosts=None, priority_order=None,
+                 min_score=MIN_INTENT_SCORE, default_intent=DEFAULT_INTENT):
+        self.intent_patterns = intent_patterns or INTENT_PATTERNS
+        self.boosts = boosts if boosts is not None else INTENT_BOOSTS
+        self.priority_order = priority_order or PRIORITY_ORDER
+        self.min_score = min_score
+        self.default_intent = default_intent
+        self._compile()
+
+    def _compile(self):
+        # Pattern (dạng chuỗi cụm từ) -> id; pattern trùng nhau giữa các intent chỉ kiểm tra một lần
+        self._pattern_ids = {}
+        self._pattern_segments = []
+        for pattern in [p for patterns in self.intent_patterns.values() for p in patterns] + \
+                       [p for patterns in self.boosts.values() for p in patterns]:
+            segments = literal_segments(pattern)
+            if not segments:
+                raise ValueError(f"Pattern intent rỗng: {pattern!r}")
+            if segments not in self._pattern_ids:
+                self._pattern_ids[segments] = len(self._pattern_segments)
+                self._pattern_segments.append(segments)
+
+        self._intent_pattern_ids = {
+            intent: [self._pattern_ids[literal_segments(p)] for p in patterns]
+            for intent, patterns in self.intent_patterns.items()
+        }
+        self._boost_pattern_ids = {
+            intent: [self._pattern_ids[literal_segments(p)] for p in patterns]
+            for intent, patterns in self.boosts.items()
+        }
+
+        self._segments = sorted({s for segments in self._pattern_segments for s in segments})
+        self._scanner = re.compile(f"(?=({build_trie_regex(self._segments)}))")
+
+        # Cụm từ tại mỗi vị trí: cụm dài nhất khớp được cùng các tiền tố của nó (tính sẵn)
+        self._segments_at = {
+            segment: [segment] + [other for other in self._segments
+                                  if other != segment and segment.startswith(other)]
+            for segment in self._segments
+        }
+
+        # Pattern theo cụm từ đầu tiên: chỉ kiểm tra pattern có cụm đầu tiên xuất hiện
+        self._patterns_by_first_segment = {}
+        for pattern_id, segments in enumerate(self._pattern_segments):
+            self._patterns_by_first_segment.setdefault(segments[0], []).append(pattern_id)
+
+    def _scan(self, text):
+        """
+        Một lần quét: vị trí bắt đầu (tăng dần) của từng cụm từ trong text
+        """
+        positions = {}
+        for match in self._scanner.finditer(text):
+            start = match.start()
+            for segment in self._segments_at[match.group(1)]:
+                if segment in positions:
+                    positions[segment].append(start)
+                else:
+                    positions[segment] = [start]
+        return positions
+
+    @staticmethod
+    def _matches(segments, positions):
+        """
+        Các cụm từ có xuất hiện theo thứ tự, không chồng lấn nhau không
+        (chọn vị trí sớm nhất cho từng cụm là tối ưu)
+        """
+        end = 0
+        for segment in segments:
+            starts = positions.get(segment)
+            if not starts:
+                return False
+            idx = bisect_left(starts, end)
+            if idx == len(starts):
+                return False
+            end = starts[idx] + len(segment)
+        return True
+
+    def matched_patterns(self, query_lower):
+        """
+        Tập id các pattern khớp với câu hỏi (đã chuyển chữ thường)
+        """
+        matched = set()
+        # `.` trong regex không khớp ký tự xuống dòng: xét riêng từng dòng
+        for line in query_lower.split('\n'):
+            positions = self._scan(line)
+            for first_segment in positions:
+                for pattern_id in self._patterns_by_first_segment.get(first_segment, ()):
+                    if pattern_id not in matched and self._matches(self._pattern_segments[pattern_id], positions):
+                        matched.add(pattern_id)
+        return matched
+
+    def classify(self, query, verbose=True):
+        """
+        Phân loại ý định của câu hỏi
+
+        Returns:
+            dict: primary_intent, all_intents, secondary_intents, intent_scores, confidence
+        """
+        matched = self.matched_patterns(query.lower())
+
+        intent_scores = {}
+        for intent, pattern_ids in self._intent_pattern_ids.items():
+            hits = sum(1 for pattern_id in pattern_ids if pattern_id in matched)
+            boosted = any(pattern_id in matched for pattern_id in self._boost_pattern_ids.get(intent, []))
+            intent_scores[intent] = hits * (3 if boosted else 1)
+
+        # Xác định tất cả intent có điểm số > ngưỡng tối thiểu
+        matched_intents = [intent for intent, score in intent_scores.items() if score >= self.min_score]
+
+        # Sắp xếp intent theo điểm số
+        sorted_intents = sorted(intent_scores.items(), key=lambda x: x[1], reverse=True)
+
+        # Xác định intent chính (có điểm cao nhất và vượt ngưỡng)
+        primary_intent = sorted_intents[0][0] if sorted_intents and sorted_intents[0][1] >= self.min_score else None
+
+        # Xử lý các trường hợp xung đột: chênh lệch nhỏ giữa hai intent hàng đầu thì xét ưu tiên
+        if len(matched_intents) > 1 and sorted_intents[0][1] - sorted_intents[1][1] <= 1:
+            for intent in self.priority_order:
+                if intent in matched_intents:
+                    primary_intent = intent
+                    break
+
+        # Nếu không tìm thấy intent cụ thể, dùng intent mặc định
+        if not primary_intent:
+            primary_intent = self.default_intent
+
+        # Xác định các intent phụ (có điểm > ngưỡng và không phải intent chính)
+        secondary_intents = [intent for intent in matched_intents if intent != primary_intent]
+
+        # Độ tin cậy của intent chính (tỷ lệ phần trăm)
+        primary_confidence = 0
+        total_score = sum(intent_scores.values())
+        if primary_intent in intent_scores and total_score > 0:
+            primary_confidence = (intent_scores[primary_intent] / total_score) * 100
+
+        if verbose:
+            print(f"Điểm số intent: {intent_scores}")
+            print(f"Phân loại intent câu hỏi: {primary_intent} (độ tin cậy: {primary_confidence:.1f}%), Tất cả intent: {matched_intents}")
+
+        return {
+            'primary_intent': primary_intent,
+            'all_intents': matched_intents,
+            'secondary_intents': secondary_intents,
+            'intent_scores': intent_scores,
+            'confidence': primary_confidence
+        }
+
+
+# Instance mặc định
+intent_classifier = IntentClassifier()
@@ -0,0 +1,213 @@
+"""
+LLM Gateway - Giới hạn số lần gọi Gemini đồng thời, hàng đợi có giới hạn và từ chối sớm khi quá tải
+Cải tiến độ ổn định cho LMS-RAG-Chatbot khi lượng truy cập tăng đột biến
+
+Mọi lần gọi LLM của pipeline (`async_pipeline`) đi qua một gateway dùng chung cho cả server
+threaded lẫn async: tối đa `max_concurrency` lần gọi chạy cùng lúc, tối đa `max_queue` request chờ
+(theo thứ tự đến), mỗi request chờ tối đa `max_wait_seconds`. Request vượt quá được từ chối ngay
+bằng `LLMOverloadedError` thay vì dồn thêm tải lên Gemini.
+"""
+
+import asyncio
+import threading
+import time
+from collections import deque
+from contextlib import asynccontextmanager, contextmanager
+
+BUSY_MESSAGE = (
+    "Xin lỗi, hiện có quá nhiều người đang hỏi EduBot cùng lúc. "
+    "Bạn vui lòng thử lại sau ít phút nhé."
+)
+
+
+class LLMOverloadedError(Exception):
+    """
+    Request bị từ chối vì hàng đợi LLM đã đầy hoặc đã chờ quá lâu
+    """
+    def __init__(self, reason):
+        super().__init__(reason)
+        self.reason = reason
+
+
+class _Waiter:
+    def __init__(self, loop=None):
+        self.enqueued_at = time.perf_counter()
+        self.granted = False
+        if loop is None:
+            self.event = threading.Event()
+            self.loop = None
+        else:
+            self.future = loop.create_future()
+            self.loop = loop
+
+    def grant(self):
+        self.granted = True
+        if self.loop is None:
+            self.event.set()
+        else:
+            self.loop.call_soon_threadsafe(self._resolve)
+
+    def _resolve(self):
+        if not self.future.done():
+            self.future.set_result(True)
+
+
+class LLMGateway:
+    """
+    Semaphore có hàng đợi FIFO giới hạn, dùng được từ thread (`slot`) và từ event loop (`async_slot`)
+
+    Khi một lần gọi xong, slot được chuyển thẳng cho request chờ lâu nhất nên request mới
+    không chen được lên trước hàng đợi.
+
+    Args:
+        max_concurrency (int): Số lần gọi LLM tối đa cùng lúc
+        max_queue (int): Số request tối đa được chờ; vượt quá thì từ chối ngay
+        max_wait_seconds (float): Thời gian chờ tối đa của một request trong hàng đợi
+    """
+    def __init__(self, max_concurrency=8, max_queue=32, max_wait_seconds=10):
+        self.max_concurrency = max_concurrency
+        self.max_queue = max_queue
+        self.max_wait_seconds = max_wait_seconds
+
+        self._lock = threading.Lock()
+        self._active = 0
+        self._waiters = deque()
+
+        self.admitted = 0
+        self.rejected_queue_full = 0
+        self.rejected_timeout = 0
+        self._wait_seconds = 0.0
+        self._max_wait_seconds_seen = 0.0
+
+    def _try_admit(self, waiter_factory):
+        """
+        Lấy slot ngay nếu còn, nếu không thì xếp hàng (hoặc từ chối khi hàng đợi đầy)
+
+        Returns:
+            None nếu đã có slot, _Waiter nếu phải chờ
+        """
+        with self._lock:
+            if self._active < self.max_concurrency and not self._waiters:
+                self._active += 1
+                self.admitted += 1
+                return None
+            if len(self._waiters) >= self.max_queue:
+                self.rejected_queue_full += 1
+                raise LLMOverloadedError("queue_full")
+            waiter = waiter_factory()
+            self._waiters.append(waiter)
+            return waiter
+
+    def _finish_wait(self, waiter):
+        """
+        Kết thúc lượt chờ: ghi nhận thời gian chờ, hoặc từ chối nếu hết thời gian mà chưa có slot
+        """
+        with self._lock:
+            waited = time.perf_counter() - waiter.enqueued_at
+            if not waiter.granted:
+                self._waiters.remove(waiter)
+                self.rejected_timeout += 1
+                raise LLMOverloadedError("wait_timeout")
+            self.admitted += 1
+            self._wait_seconds += waited
+            self._max_wait_seconds_seen = max(self._max_wait_seconds_seen, waited)
+
+    def _wait_timeout(self, timeout):
+        if timeout is None:
+            return self.max_wait_seconds
+        return max(0.0, min(self.max_wait_seconds, timeout))
+
+    def acquire(self, timeout=None):
+        """
+        Lấy một slot gọi LLM (chặn thread hiện tại trong lúc chờ); phải gọi `release()` sau đó
+
+        Args:
+            timeout (float): Thời gian chờ tối đa nếu ngắn hơn `max_wait_seconds` (ví dụ thời hạn của request)
+
+        Raises:
+            LLMOverloadedError: Hàng đợi đầy hoặc chờ quá thời gian cho phép
+        """
+        waiter = self._try_admit(_Waiter)
+        if waiter is not None:
+            waiter.event.wait(self._wait_timeout(timeout))
+            self._finish_wait(waiter)
+
+    async def acquire_async(self, timeout=None):
+        """
+        Lấy một slot gọi LLM trên event loop (không chặn thread trong lúc chờ); phải gọi `release()` sau đó
+
+        Raises:
+            LLMOverloadedError: Hàng đợi đầy hoặc chờ quá thời gian cho phép
+        """
+        loop = asyncio.get_running_loop()
+        waiter = self._try_admit(lambda: _Waiter(loop))
+        if waiter is not None:
+            try:
+                await asyncio.wait_for(asyncio.shield(waiter.future), self._wait_timeout(timeout))
+            except asyncio.TimeoutError:
+                pass
+            except asyncio.CancelledError:
+                # Request bị hủy trong lúc chờ: trả lại slot nếu vừa được cấp
+                with self._lock:
+                    if not waiter.granted:
+                        self._waiters.remove(waiter)
+                        raise
+                self.release()
+                raise
+            self._finish_wait(waiter)
+
+    def release(self):
+        """
+        Trả slot: chuyển thẳng cho request chờ lâu nhất nếu có
+        """
+        with self._lock:
+            if self._waiters:
+                # _active giữ nguyên vì slot được chuyển cho request đang chờ
+                self._waiters.popleft().grant()
+            else:
+                self._active -= 1
+
+    @contextmanager
+    def slot(self, timeout=None):
+        """
+        Giữ một slot gọi LLM trên thread hiện tại
+
+        Raises:
+            LLMOverloadedError: Hàng đợi đầy hoặc chờ quá thời gian cho phép
+        """
+        self.acquire(timeout)
+        try:
+            yield
+        finally:
+            self.release()
+
+    @asynccontextmanager
+    async def async_slot(self, timeout=None):
+        """
+        Giữ một slot gọi LLM trên event loop
+
+        Raises:
+            LLMOverloadedError: Hàng đợi đầy hoặc chờ quá thời gian cho phép
+        """
+        await self.acquire_async(timeout)
+        try:
+            yield
+        finally:
+            self.release()
+
+    def stats(self):
+        """
+        Độ sâu hàng đợi, số lần gọi đang chạy, số request bị từ chối và thời gian chờ
+        """
+        with self._lock:
+            return {
+                "active": self._active,
+                "queue_depth": len(self._waiters),
+                "max_concurrency": self.max_concurrency,
+                "max_queue": self.max_queue,
+                "admitted": self.admitted,
+                "rejected_queue_full": self.rejected_queue_full,
+                "rejected_timeout": self.rejected_timeout,
+                "avg_wait_ms": round(self._wait_seconds * 1000 / self.admitted, 3) if self.admitted else 0.0,
+                "max_wait_ms": round(self._max_wait_seconds_seen * 1000, 3)
+            }
@@ -9,6 +9,8 @@ from langchain_core.prompts import MessagesPlaceholder
 from langchain.chains import create_retrieval_chain
 from langchain.chains.combine_documents import create_stuff_documents_chain
 from langchain_core.prompts import ChatPromptTemplate
+from langchain_core.output_parsers import StrOutputParser
+from langchain_core.documents import Document
 from dotenv import load_dotenv
 import os
 import json
@@ -19,7 +21,24 @@ import difflib
 from fuzzywuzzy import fuzz
 from thefuzz import process
 import unicodedata
+import time
+import queue
+import threading
 from response_cache import cache
+from vector_index import index_store, compute_catalog_fingerprint, compute_index_config_key
+from incremental_indexer import IncrementalIndexer, PollingChangeFeed, ChangeStreamFeed, entity_content_hash
+from embedding_cache import EmbeddingCache, CachedEmbeddings
+from semantic_cache import SemanticResponseCache
+from single_flight import SingleFlight, AsyncSingleFlight
+from async_pipeline import MIN_CALL_SECONDS, LLMCall, ChainCall, run_pipeline, AsyncPipelineRunner
+from llm_gateway import LLMGateway, LLMOverloadedError, BUSY_MESSAGE
+from deadline import Deadline
+from chain_registry import ChainRegistry, RAGChains
+from hybrid_retriever import HybridRetriever
+from history_window import HistoryWindow
+from catalog_snapshot import catalog
+from intent_classifier import intent_classifier
+from query_expander import query_expander
 
 # Load environment variables
 load_dotenv()
@@ -37,11 +56,51 @@ llm = ChatGoogleGenerativeAI(
     model="gemini-2.0-flash",
     temperature=0.2,
     max_tokens=1500,  # Tăng token limit cho 2.0
-    max_retries=3,    # Tăng số lần retry
-    timeout=60       # Tăng timeout
+    # Mỗi request còn bị giới hạn bởi REQUEST_DEADLINE_SECONDS (trả lời bằng dữ liệu đã truy xuất khi quá hạn)
+    max_retries=int(os.getenv('LLM_MAX_RETRIES', 1)),
+    timeout=float(os.getenv('LLM_TIMEOUT_SECONDS', 20))
     # Safety settings đã loại bỏ vì gây lỗi với LangChain
 )
 
+# Giới hạn số lần gọi Gemini đồng thời (retry của một lần gọi nằm trong cùng slot);
+# request vượt quá hàng đợi hoặc chờ quá lâu được từ chối ngay với BUSY_MESSAGE
+llm_gateway = LLMGateway(
+    max_concurrency=int(os.getenv('LLM_MAX_CONCURRENCY', 8)),
+    max_queue=int(os.getenv('LLM_MAX_QUEUE', 32)),
+    max_wait_seconds=float(os.getenv('LLM_MAX_WAIT_SECONDS', 10))
+)
+
+def summarize_history(previous_summary, messages):
+    """
+    Tóm tắt cuốn chiếu phần hội thoại cũ (chạy trên thread nền của `history_window`)
+
+    Args:
+        previous_summary: Bản tóm tắt các tin nhắn trước đó (None nếu chưa có)
+        messages: Các tin nhắn (ChatHistory) mới cần gộp vào bản tóm tắt
+    """
+    conversation = "\n".join(f"[{'user' if chat.is_user else 'bot'}] {chat.content}" for chat in messages)
+    prompt = f"""
+    Tóm tắt ngắn gọn (tối đa 120 từ, tiếng Việt) cuộc hội thoại giữa người dùng và chatbot tư vấn khóa học.
+    Giữ lại: nhu cầu của người dùng, tên và ID các khóa học / giảng viên đã được nhắc đến.
+
+    Tóm tắt trước đó: {previous_summary or "Chưa có"}
+
+    Hội thoại tiếp theo:
+    {conversation}
+    """
+    # Tóm tắt là việc nền: dùng chung giới hạn Gemini với các request
+    with llm_gateway.slot():
+        return llm.invoke(prompt).content
+
+# Chỉ các lượt gần nhất (trong ngân sách token) được gửi nguyên văn, phần cũ hơn được tóm tắt cuốn chiếu
+history_window = HistoryWindow(
+    summarize=summarize_history if os.getenv('HISTORY_SUMMARY_ENABLED', 'True').lower() == 'true' else None,
+    max_turns=int(os.getenv('HISTORY_MAX_TURNS', 3)),
+    token_budget=int(os.getenv('HISTORY_TOKEN_BUDGET', 1200)),
+    # Mặc định tính theo cửa sổ lịch sử (HISTORY_MAX_TURNS)
+    fetch_limit=int(os.getenv('HISTORY_FETCH_LIMIT')) if os.getenv('HISTORY_FETCH_LIMIT') else None
+)
+
 # Hàm tiền xử lý query tiếng Việt
 def normalize_text(text):
     """
@@ -76,27 +135,8 @@ def preprocess_vietnamese_query(query):
     # Chuẩn hóa dấu cách
     query = re.sub(r'\s+', ' ', query.strip())
     
-    # Thay thế một số từ viết tắt phổ biến
-    replacements = {
-        "k/h": "khóa học",
-        "kh": "khóa học",
-        "gv": "giảng viên",
-        "sv": "sinh viên",
-        "đhqg": "đại học quốc gia",
-        "đh": "đại học",
-        "cntt": "công nghệ thông tin",
-        "htn": "học trực tuyến",
-        "ml": "machine learning",
-        "ai": "artificial intelligence",
-        "ds": "data science",
-        "ba": "business analytics",
-        "ui/ux": "ui ux design",
-    }
-    
-    for abbr, full in replacements.items():
-        query = re.sub(r'\b' + re.escape(abbr) + r'\b', full, query, flags=re.IGNORECASE)
-    
-    return query
+    # Thay thế các từ viết tắt phổ biến (bảng trong config/abbreviations.json) trong một lần quét
+    return query_expander.expand(query)
 
 # Xử lý dữ liệu từ MongoDB
 class JSONEncoder(json.JSONEncoder):
@@ -105,82 +145,72 @@ class JSONEncoder(json.JSONEncoder):
             return str(obj)
         return super(JSONEncoder, self).default(obj)
 
-def preprocess_mongodb_data():
+def _to_object_ids(ids):
     """
-    Lấy dữ liệu từ MongoDB và chuyển đổi thành văn bản cho RAG
+    Chuyển danh sách id dạng string thành ObjectId (giữ nguyên nếu không chuyển được)
     """
-    print("Đang lấy dữ liệu từ MongoDB và tiền xử lý...")
-    
-    # Lấy tất cả dữ liệu khóa học và giảng viên không giới hạn số lượng
-    try:
-        # Lấy tất cả khóa học - không giới hạn
-        courses = mongodb.get_courses(limit=None)
-        
-        # Lấy tất cả giảng viên - không giới hạn
-        mentors = mongodb.get_mentors(limit=None)
+    object_ids = []
+    for entity_id in ids:
+        try:
+            object_ids.append(ObjectId(entity_id) if isinstance(entity_id, str) else entity_id)
+        except Exception:
+            object_ids.append(entity_id)
+    return object_ids
+
+def build_course_text(course):
+    """
+    Chuyển một khóa học (đã kèm mentorInfo / mentorUser) thành văn bản cho RAG
+    """
+    # Chuẩn bị thông tin giảng viên nếu có
+    mentor_info = ""
+    if 'mentorInfo' in course and course['mentorInfo']:
+        mentor = course['mentorInfo']
+        mentor_user = course.get('mentorUser', {})
+        mentor_name = mentor_user.get('name', 'Chưa có thông tin')
         
-        print(f"Đã tìm thấy {len(courses)} khóa học và {len(mentors)} giảng viên từ MongoDB")
+        specializations = ", ".join(mentor.get('specialization', []))
+        achievements = ", ".join(mentor.get('achievements', []))
         
-        if len(courses) == 0 and len(mentors) == 0:
-            print("CẢNH BÁO: Không tìm thấy dữ liệu trong MongoDB. Vui lòng kiểm tra lại kết nối và dữ liệu.")
-            return []
-    except Exception as e:
-        print(f"Lỗi khi lấy dữ liệu từ MongoDB: {e}")
-        return []
-    
-    # Chuẩn bị dữ liệu để chuyển thành văn bản
-    course_texts = []
-    for course in courses:
-        # Chuẩn bị thông tin giảng viên nếu có
-        mentor_info = ""
-        if 'mentorInfo' in course and course['mentorInfo']:
-            mentor = course['mentorInfo']
-            mentor_user = course.get('mentorUser', {})
-            mentor_name = mentor_user.get('name', 'Chưa có thông tin')
-            
-            specializations = ", ".join(mentor.get('specialization', []))
-            achievements = ", ".join(mentor.get('achievements', []))
-            
-            mentor_info = f"""
+        mentor_info = f"""
             Giảng viên: {mentor_name}
             Kinh nghiệm: {mentor.get('experience', 0)} năm
             Chuyên môn: {specializations}
             Thành tựu: {achievements}
             Đánh giá: {mentor.get('averageRating', 0)}/5
             """
-        
-        # Chuẩn bị thông tin lợi ích và yêu cầu
-        benefits = ", ".join([b.get('title', '') for b in course.get('benefits', [])])
-        prerequisites = ", ".join([p.get('title', '') for p in course.get('prerequisites', [])])
-        
-        # Chuẩn bị thông tin bài học
-        lessons = []
-        for lesson in course.get('courseData', []):
-            lesson_text = f"""
+    
+    # Chuẩn bị thông tin lợi ích và yêu cầu
+    benefits = ", ".join([b.get('title', '') for b in course.get('benefits', [])])
+    prerequisites = ", ".join([p.get('title', '') for p in course.get('prerequisites', [])])
+    
+    # Chuẩn bị thông tin bài học
+    lessons = []
+    for lesson in course.get('courseData', []):
+        lesson_text = f"""
             Bài học: {lesson.get('title', '')}
             Phần: {lesson.get('videoSection', '')}
             Mô tả: {lesson.get('description', '')}
             Thời lượng: {lesson.get('videoLength', 0)} phút
             """
-            lessons.append(lesson_text)
-        
-        lessons_text = "\n".join(lessons)
-        
-        # Xử lý categories nếu là mảng
-        categories = course.get('categories', '')
-        if isinstance(categories, list):
-            categories = ", ".join(categories)
-        
-        # Xử lý tags nếu là mảng
-        tags = course.get('tags', '')
-        if isinstance(tags, list):
-            tags = ", ".join(tags)
-        
-        # Chuyển đổi ObjectId thành string nếu cần
-        course_id = str(course.get('_id', '')) if isinstance(course.get('_id'), ObjectId) else course.get('_id', '')
-        
-        # Tạo văn bản đầy đủ cho khóa học
-        course_text = f"""
+        lessons.append(lesson_text)
+    
+    lessons_text = "\n".join(lessons)
+    
+    # Xử lý categories nếu là mảng
+    categories = course.get('categories', '')
+    if isinstance(categories, list):
+        categories = ", ".join(categories)
+    
+    # Xử lý tags nếu là mảng
+    tags = course.get('tags', '')
+    if isinstance(tags, list):
+        tags = ", ".join(tags)
+    
+    # Chuyển đổi ObjectId thành string nếu cần
+    course_id = str(course.get('_id', '')) if isinstance(course.get('_id'), ObjectId) else course.get('_id', '')
+    
+    # Tạo văn bản đầy đủ cho khóa học
+    return f"""
         ID KHÓA HỌC: {course_id}
         TÊN KHÓA HỌC: {course.get('name', '')}
         MÔ TẢ: {course.get('description', '')}
@@ -203,42 +233,38 @@ def preprocess_mongodb_data():
         NỘI DUNG KHÓA HỌC:
         {lessons_text}
         """
-        
-        course_texts.append(course_text)
+
+def build_mentor_text(mentor, mentor_courses):
+    """
+    Chuyển một giảng viên (đã kèm userInfo) và TẤT CẢ khóa học của họ thành văn bản cho RAG
+    """
+    # Lấy thông tin user của giảng viên
+    user_info = mentor.get('userInfo', {})
     
-    # Chuẩn bị dữ liệu giảng viên
-    mentor_texts = []
-    for mentor in mentors:
-        # Lấy thông tin user của giảng viên
-        user_info = mentor.get('userInfo', {})
-        
-        # Chuyển đổi ObjectId thành string nếu cần
-        mentor_id = str(mentor.get('_id', '')) if isinstance(mentor.get('_id'), ObjectId) else mentor.get('_id', '')
-        
-        # Lấy TẤT CẢ các khóa học của giảng viên
-        mentor_courses = mongodb.get_courses_by_mentor(mentor.get('_id'), limit=None)
-        courses_text = ""
-        
-        if mentor_courses:
-            courses_text = "DANH SÁCH TẤT CẢ CÁC KHÓA HỌC:\n"
-            for idx, course in enumerate(mentor_courses, 1):
-                course_id = str(course.get('_id', '')) if isinstance(course.get('_id'), ObjectId) else course.get('_id', '')
-                price = course.get('price', 0)
-                level = course.get('level', 'Chưa xác định')
-                rating = course.get('ratings', 0)
-                
-                courses_text += f"""
+    # Chuyển đổi ObjectId thành string nếu cần
+    mentor_id = str(mentor.get('_id', '')) if isinstance(mentor.get('_id'), ObjectId) else mentor.get('_id', '')
+    
+    courses_text = ""
+    if mentor_courses:
+        courses_text = "DANH SÁCH TẤT CẢ CÁC KHÓA HỌC:\n"
+        for idx, course in enumerate(mentor_courses, 1):
+            course_id = str(course.get('_id', '')) if isinstance(course.get('_id'), ObjectId) else course.get('_id', '')
+            price = course.get('price', 0)
+            level = course.get('level', 'Chưa xác định')
+            rating = course.get('ratings', 0)
+            
+            courses_text += f"""
                 {idx}. ID: {course_id}
                    Tên: [{course.get('name', '')}]
                    Trình độ: {level}
                    Giá: {price} VND
                    Đánh giá: {rating}/5 sao
                 """
-        else:
-            courses_text = "DANH SÁCH KHÓA HỌC: Hiện chưa có khóa học nào."
-        
-        # Tạo văn bản đầy đủ cho giảng viên
-        mentor_text = f"""
+    else:
+        courses_text = "DANH SÁCH KHÓA HỌC: Hiện chưa có khóa học nào."
+    
+    # Tạo văn bản đầy đủ cho giảng viên
+    return f"""
         ID GIẢNG VIÊN: {mentor_id}
         TÊN GIẢNG VIÊN: {user_info.get('name', '')}
         EMAIL: {user_info.get('email', '')}
@@ -250,141 +276,308 @@ def preprocess_mongodb_data():
         
         {courses_text}
         """
+
+def load_catalog_entities(course_ids=None, mentor_ids=None):
+    """
+    Lấy dữ liệu từ MongoDB và chuyển đổi thành các entity (khóa học / giảng viên) cho RAG
+
+    Mỗi entity có key ổn định ("course:<id>" hoặc "mentor:<id>"), văn bản và danh sách
+    key các entity liên quan (văn bản khóa học chứa thông tin giảng viên và ngược lại).
+
+    Args:
+        course_ids: Danh sách id khóa học cần lấy, None để lấy tất cả
+        mentor_ids: Danh sách id giảng viên cần lấy, None để lấy tất cả
+
+    Returns:
+        list: Danh sách entity dạng dict
+    """
+    print("Đang lấy dữ liệu từ MongoDB và tiền xử lý...")
+    
+    try:
+        # Lấy khóa học - không giới hạn
+        if course_ids is None:
+            courses = mongodb.get_courses(limit=None)
+        elif course_ids:
+            courses = mongodb.get_courses({"_id": {"$in": _to_object_ids(course_ids)}}, limit=None)
+        else:
+            courses = []
+        
+        # Lấy giảng viên - không giới hạn
+        if mentor_ids is None:
+            mentors = mongodb.get_mentors(limit=None)
+        elif mentor_ids:
+            mentors = mongodb.get_mentors({"_id": {"$in": _to_object_ids(mentor_ids)}}, limit=None)
+        else:
+            mentors = []
+        
+        print(f"Đã tìm thấy {len(courses)} khóa học và {len(mentors)} giảng viên từ MongoDB")
         
-        mentor_texts.append(mentor_text)
+        if len(courses) == 0 and len(mentors) == 0 and course_ids is None and mentor_ids is None:
+            print("CẢNH BÁO: Không tìm thấy dữ liệu trong MongoDB. Vui lòng kiểm tra lại kết nối và dữ liệu.")
+            return []
+    except Exception as e:
+        print(f"Lỗi khi lấy dữ liệu từ MongoDB: {e}")
+        return []
+    
+    # Gom khóa học theo giảng viên một lần, thay vì một truy vấn cho mỗi giảng viên
+    courses_by_mentor = {}
+    if mentors:
+        if course_ids is None:
+            # Đã có toàn bộ khóa học active trong bộ nhớ
+            for course in courses:
+                if course.get('mentor'):
+                    courses_by_mentor.setdefault(str(course['mentor']), []).append(course)
+        else:
+            try:
+                courses_by_mentor = mongodb.get_courses_grouped_by_mentor(
+                    [mentor.get('_id') for mentor in mentors]
+                )
+            except Exception as e:
+                print(f"Lỗi khi lấy khóa học theo giảng viên từ MongoDB: {e}")
+                return []
     
-    # Kết hợp tất cả văn bản
-    all_texts = course_texts + mentor_texts
+    entities = []
+    for course in courses:
+        course_id = str(course.get('_id', ''))
+        related = [f"mentor:{course['mentor']}"] if course.get('mentor') else []
+        entities.append({
+            "key": f"course:{course_id}",
+            "id": course_id,
+            "type": "course",
+            "name": course.get('name') or "Không có tên",
+            "text": build_course_text(course),
+            "related": related
+        })
+    
+    for mentor in mentors:
+        mentor_id = str(mentor.get('_id', ''))
+        
+        # TẤT CẢ các khóa học của giảng viên
+        mentor_courses = courses_by_mentor.get(mentor_id, [])
+        
+        entities.append({
+            "key": f"mentor:{mentor_id}",
+            "id": mentor_id,
+            "type": "mentor",
+            "name": mentor.get('userInfo', {}).get('name') or "Không có tên",
+            "text": build_mentor_text(mentor, mentor_courses),
+            "related": [f"course:{course.get('_id')}" for course in mentor_courses]
+        })
     
-    return all_texts
+    return entities
+
+def preprocess_mongodb_data():
+    """
+    Lấy dữ liệu từ MongoDB và chuyển đổi thành văn bản cho RAG
+    """
+    # Kết hợp tất cả văn bản (khóa học trước, giảng viên sau)
+    return [entity["text"] for entity in load_catalog_entities()]
+
+# Mô hình embedding đa ngôn ngữ tốt cho tiếng Việt
+EMBEDDING_MODEL_NAME = "sentence-transformers/paraphrase-multilingual-MiniLM-L12-v2"
+
+# CHIẾN LƯỢC CẢI TIẾN: Tạo các chunks chồng lấn với nhiều kích thước khác nhau
+# (cấu hình này cũng là một phần của fingerprint snapshot vector store)
+TEXT_SPLITTER_CONFIGS = {
+    # 1. Chunks nhỏ để tìm kiếm chính xác
+    "small": {"separators": ["\n\n", "\n", ".", " "], "chunk_size": 800, "chunk_overlap": 200},
+    # 2. Chunks trung bình để cân bằng
+    "medium": {"separators": ["\n\n\n", "\n\n", "\n", ".", " "], "chunk_size": 1500, "chunk_overlap": 300},
+    # 3. Chunks lớn để giữ context
+    "large": {"separators": ["\n\n\n", "\n\n", "\n", ".", " "], "chunk_size": 2500, "chunk_overlap": 400},
+}
+
+INDEX_CONFIG_KEY = compute_index_config_key(EMBEDDING_MODEL_NAME, TEXT_SPLITTER_CONFIGS)
+
+text_splitters = {
+    size: RecursiveCharacterTextSplitter(is_separator_regex=False, **config)
+    for size, config in TEXT_SPLITTER_CONFIGS.items()
+}
+
+def split_entity_document(entity):
+    """
+    Tách văn bản của một entity thành chunks nhỏ, trung bình và lớn
+
+    Id của chunk được sinh từ key entity nên có thể xóa đúng các chunks cũ khi entity thay đổi.
+
+    Returns:
+        tuple: (danh sách chunk, danh sách metadata, danh sách id)
+    """
+    chunks, metadatas, ids = [], [], []
+    for size, text_splitter in text_splitters.items():
+        for idx, chunk in enumerate(text_splitter.split_text(entity["text"])):
+            chunks.append(chunk)
+            # Thêm metadata vào từng chunk để truy xuất dễ dàng hơn
+            metadatas.append({
+                "id": entity["id"],
+                "type": entity["type"],
+                "name": entity["name"],
+                "size": size
+            })
+            ids.append(f"{entity['key']}:{size}:{idx}")
+    return chunks, metadatas, ids
+
+# Cache embeddings theo nội dung: chunk đã từng tính embeddings không đi qua mô hình nữa
+embedding_cache = EmbeddingCache(
+    cache_dir=os.getenv(
+        'EMBEDDING_CACHE_DIR',
+        os.path.join(os.path.dirname(os.path.abspath(__file__)), "embedding_cache")
+    ),
+    model_name=EMBEDDING_MODEL_NAME,
+    dtype=os.getenv('EMBEDDING_CACHE_DTYPE', 'float16')
+)
+
+_embeddings = None
+
+def get_embeddings():
+    """
+    Lấy đối tượng embeddings dùng chung (chỉ nạp mô hình một lần cho mỗi tiến trình)
+
+    Embeddings khi xây dựng vector store đi qua embedding cache trên đĩa, embeddings câu hỏi
+    khi truy vấn đi qua LRU trong bộ nhớ.
+    """
+    global _embeddings
+    if _embeddings is None:
+        _embeddings = CachedEmbeddings(
+            HuggingFaceEmbeddings(model_name=EMBEDDING_MODEL_NAME),
+            embedding_cache,
+            query_cache_size=int(os.getenv('EMBEDDING_QUERY_CACHE_SIZE', 4096))
+        )
+    return _embeddings
+
+# Cache câu trả lời theo nghĩa câu hỏi (tra cứu sau cache khớp chính xác, theo từng intent)
+SEMANTIC_CACHE_ENABLED = os.getenv('SEMANTIC_CACHE_ENABLED', 'True').lower() == 'true'
+semantic_cache = SemanticResponseCache(
+    lambda text: get_embeddings().embed_query(text),
+    threshold=float(os.getenv('SEMANTIC_CACHE_THRESHOLD', 0.9)),
+    max_entries_per_intent=int(os.getenv('SEMANTIC_CACHE_MAX_ENTRIES', 2000)),
+    max_age_hours=float(os.getenv('SEMANTIC_CACHE_MAX_AGE_HOURS', 24)),
+    # Câu hỏi về một khóa học / giảng viên cụ thể: câu gần nghĩa có thể hỏi về entity khác
+    excluded_intents=('course_detail', 'mentor_by_name', 'course_comparison')
+)
+
+# Giữ trạng thái từng entity trong vector store để cập nhật tăng dần
+indexer = IncrementalIndexer(split_entity_document)
+
+# Thống kê lần khởi tạo vector store gần nhất (nạp snapshot, cập nhật tăng dần hay xây dựng lại)
+vector_store_stats = {}
+
+def _save_vector_store_snapshot(vector_store, fingerprint, text_count):
+    index_store.save(
+        vector_store, fingerprint, INDEX_CONFIG_KEY, indexer.entity_state,
+        metadata={"model_name": EMBEDDING_MODEL_NAME, "text_count": text_count}
+    )
+    # Bỏ embeddings của các chunk không còn trong vector store khỏi cache trên đĩa
+    embedding_cache.compact(
+        [doc.page_content for doc in vector_store.docstore._dict.values()],
+        min_stale_ratio=float(os.getenv('EMBEDDING_CACHE_COMPACT_RATIO', 0.5))
+    )
+
+def _changed_entity_keys(old_hashes, new_hashes):
+    """
+    Key các entity đã thêm / sửa / xóa giữa hai trạng thái {key: hash nội dung}
+    """
+    changed_keys = {key for key in set(old_hashes) | set(new_hashes) if old_hashes.get(key) != new_hashes.get(key)}
+    # Khóa học mới làm thay đổi danh sách khóa học của giảng viên
+    changed_keys |= indexer.related_keys(set(new_hashes) - set(old_hashes))
+    return changed_keys
+
+def invalidate_cached_answers(changed_keys, previous_version, new_version):
+    """
+    Xóa các câu trả lời đã cache bị ảnh hưởng khi catalog chuyển sang phiên bản mới
+
+    Args:
+        changed_keys: Tập key entity thay đổi, None nếu không biết (chỉ giữ câu trả lời của `new_version`)
+    """
+    cache.apply_catalog_change(changed_keys, previous_version, new_version)
+    semantic_cache.apply_catalog_change(changed_keys, new_version)
+    # Cache JSON của phiên bản cũ (nếu còn) được nhập vào SQLite với phiên bản catalog hiện tại
+    cache.migrate_json_files(new_version)
+
+def _record_vector_store_stats(source, fingerprint, vector_store, start_time):
+    elapsed = time.perf_counter() - start_time
+    vector_store_stats.update({
+        "source": source,
+        "fingerprint": fingerprint,
+        "chunk_count": vector_store.index.ntotal,
+        "seconds": round(elapsed, 3),
+        "embedding_cache": embedding_cache.stats()
+    })
+    print(f"Khởi tạo vector store ({source}) mất {elapsed:.2f}s")
+    print(f"Embedding cache: {vector_store_stats['embedding_cache']}")
 
 # Tạo FAISS vector database
-def build_vector_store():
+def build_vector_store(force_rebuild=False):
     """
     Xây dựng FAISS vector store từ dữ liệu MongoDB
+
+    Nếu fingerprint dữ liệu không đổi so với snapshot trên đĩa thì nạp snapshot;
+    nếu chỉ một số entity thay đổi thì cập nhật tăng dần từ snapshot thay vì
+    tạo lại embeddings cho toàn bộ chunks.
+
+    Args:
+        force_rebuild (bool): Bỏ qua snapshot và luôn xây dựng lại
     """
+    start_time = time.perf_counter()
+    # Thống kê embedding cache chỉ tính cho lần xây dựng này
+    embedding_cache.reset_stats()
+
     # Lấy dữ liệu từ MongoDB
     print("Bắt đầu lấy dữ liệu từ MongoDB...")
-    texts = preprocess_mongodb_data()
+    entities = load_catalog_entities()
     
     # Kiểm tra xem có dữ liệu không
-    if not texts:
+    if not entities:
         print("CẢNH BÁO: Không có dữ liệu để xây dựng vector store!")
         print("Vui lòng kiểm tra kết nối MongoDB và đảm bảo dữ liệu đã được import.")
         # Trả về vector store trống nếu không có dữ liệu
-        embeddings = HuggingFaceEmbeddings(model_name="sentence-transformers/paraphrase-multilingual-MiniLM-L12-v2")
-        return FAISS.from_texts(["Không có dữ liệu"], embeddings)
-    
-    print(f"Đã lấy được {len(texts)} văn bản để xây dựng vector store")
+        return FAISS.from_texts(["Không có dữ liệu"], get_embeddings())
     
-    # In ra một vài mẫu dữ liệu để kiểm tra
-    if len(texts) > 0:
-        print("\nMẫu dữ liệu đầu tiên:")
-        print(texts[0][:500] + "...\n")  # Chỉ hiển thị 500 ký tự đầu tiên
-    
-    # CHIẾN LƯỢC CẢI TIẾN: Tạo các chunks chồng lấn với nhiều kích thước khác nhau
-    
-    # 1. Chunks nhỏ để tìm kiếm chính xác
-    text_splitter_small = RecursiveCharacterTextSplitter(
-        separators=["\n\n", "\n", ".", " "],
-        chunk_size=800,
-        chunk_overlap=200,
-        is_separator_regex=False,
-    )
-    
-    # 2. Chunks trung bình để cân bằng
-    text_splitter_medium = RecursiveCharacterTextSplitter(
-        separators=["\n\n\n", "\n\n", "\n", ".", " "],
-        chunk_size=1500,
-        chunk_overlap=300,
-        is_separator_regex=False,
-    )
-    
-    # 3. Chunks lớn để giữ context
-    text_splitter_large = RecursiveCharacterTextSplitter(
-        separators=["\n\n\n", "\n\n", "\n", ".", " "],
-        chunk_size=2500,
-        chunk_overlap=400,
-        is_separator_regex=False,
-    )
-    
-    # Tạo chunks với cả ba chiến lược
-    text_chunks = []
-    metadata_chunks = []
+    print(f"Đã lấy được {len(entities)} văn bản để xây dựng vector store")
+
+    entity_hashes = {entity["key"]: entity_content_hash(entity["text"]) for entity in entities}
+    fingerprint = compute_catalog_fingerprint(entity_hashes, EMBEDDING_MODEL_NAME, TEXT_SPLITTER_CONFIGS)
     
     try:
-        for text in texts:
-            # Thêm metadata vào từng chunk để truy xuất dễ dàng hơn
-            # Trích xuất ID khóa học hoặc giảng viên từ văn bản
-            id_match = re.search(r'ID (KHÓA HỌC|GIẢNG VIÊN): ([^\n]+)', text)
-            entity_id = id_match.group(2) if id_match else "unknown"
-            
-            # Xác định loại entity (khóa học hoặc giảng viên)
-            entity_type = "course" if "ID KHÓA HỌC" in text else "mentor"
-            
-            # Trích xuất tên
-            name_match = re.search(r'TÊN (KHÓA HỌC|GIẢNG VIÊN): ([^\n]+)', text)
-            entity_name = name_match.group(2) if name_match else "Không có tên"
-            
-            # Chunks nhỏ
-            chunks_small = text_splitter_small.split_text(text)
-            for chunk in chunks_small:
-                text_chunks.append(chunk)
-                metadata_chunks.append({
-                    "id": entity_id,
-                    "type": entity_type,
-                    "name": entity_name,
-                    "size": "small"
-                })
-            
-            # Chunks trung bình
-            chunks_medium = text_splitter_medium.split_text(text)
-            for chunk in chunks_medium:
-                text_chunks.append(chunk)
-                metadata_chunks.append({
-                    "id": entity_id,
-                    "type": entity_type,
-                    "name": entity_name,
-                    "size": "medium"
-                })
-            
-            # Chunks lớn
-            chunks_large = text_splitter_large.split_text(text)
-            for chunk in chunks_large:
-                text_chunks.append(chunk)
-                metadata_chunks.append({
-                    "id": entity_id,
-                    "type": entity_type, 
-                    "name": entity_name,
-                    "size": "large"
-                })
+        # Thử nạp snapshot trước khi tạo lại embeddings
+        if not force_rebuild:
+            snapshot_store, manifest, entity_state = index_store.load(get_embeddings(), INDEX_CONFIG_KEY)
+            if snapshot_store is not None:
+                indexer.reset(snapshot_store, entity_state)
+                if manifest.get("fingerprint") == fingerprint:
+                    source = "snapshot"
+                    invalidate_cached_answers(set(), fingerprint, fingerprint)
+                else:
+                    # Chỉ tạo lại embeddings cho entity đã thêm / sửa, xóa chunks của entity đã xóa
+                    print("Dữ liệu đã thay đổi so với snapshot, cập nhật tăng dần...")
+                    old_hashes = indexer.entity_hashes()
+                    indexer.apply(entities)
+                    _save_vector_store_snapshot(indexer.vector_store, fingerprint, len(entities))
+                    invalidate_cached_answers(
+                        _changed_entity_keys(old_hashes, indexer.entity_hashes()),
+                        manifest.get("fingerprint"), fingerprint
+                    )
+                    source = "incremental"
+                _record_vector_store_stats(source, fingerprint, indexer.vector_store, start_time)
+                return indexer.vector_store
         
-        print(f"Đã tạo {len(text_chunks)} đoạn văn bản từ dữ liệu MongoDB")
+        # In ra một vài mẫu dữ liệu để kiểm tra
+        print("\nMẫu dữ liệu đầu tiên:")
+        print(entities[0]["text"][:500] + "...\n")  # Chỉ hiển thị 500 ký tự đầu tiên
         
-        if len(text_chunks) == 0:
-            print("CẢNH BÁO: Không có chunks sau khi tách văn bản!")
+        print("Bắt đầu tạo embeddings và xây dựng FAISS vector store...")
+        vector_store = indexer.build_full(entities, get_embeddings())
+        if vector_store is None:
             return None
         
-        # In ra một vài mẫu chunks để kiểm tra
-        if len(text_chunks) > 0:
-            print("\nMẫu chunk đầu tiên:")
-            print(text_chunks[0][:300] + "...\n")  # Chỉ hiển thị 300 ký tự đầu tiên
-        
-        # Sử dụng mô hình embedding đa ngôn ngữ tốt cho tiếng Việt
-        print("Bắt đầu tạo embeddings...")
-        embeddings = HuggingFaceEmbeddings(model_name="sentence-transformers/paraphrase-multilingual-MiniLM-L12-v2")
-        
-        print("Bắt đầu xây dựng FAISS vector store...")
-        
-        # Tạo vector store với metadata
-        vector_store = FAISS.from_texts(
-            text_chunks, 
-            embeddings, 
-            metadatas=metadata_chunks
-        )
-        
         # Kiểm tra vector store đã được tạo thành công chưa
-        print(f"Vector store đã được tạo với {len(text_chunks)} chunks")
+        print(f"Vector store đã được tạo với {vector_store.index.ntotal} chunks")
+
+        # Lưu snapshot để lần khởi động sau không phải tạo lại embeddings
+        _save_vector_store_snapshot(vector_store, fingerprint, len(entities))
+        # Không có trạng thái trước để so sánh: chỉ giữ câu trả lời đã tạo với đúng dữ liệu này
+        invalidate_cached_answers(None, None, fingerprint)
+        _record_vector_store_stats("rebuild", fingerprint, vector_store, start_time)
         
         return vector_store
     except Exception as e:
@@ -417,46 +610,52 @@ def load_prompt_template(file_path='prompt_templates/lms_prompt.txt'):
         Tài liệu: {context}
         """
 
-# Khởi tạo vector store một lần
+# Khởi tạo vector store một lần (nạp từ snapshot nếu dữ liệu không đổi)
 print("Đang khởi tạo vector store từ dữ liệu MongoDB...")
-vector_store = build_vector_store()
+vector_store = build_vector_store(
+    force_rebuild=os.getenv('VECTOR_INDEX_FORCE_REBUILD', 'False').lower() == 'true'
+)
 
 # Kiểm tra vector store đã được tạo thành công chưa
 if vector_store is None:
     print("CẢNH BÁO: Không thể tạo vector store! Chatbot sẽ không hoạt động đúng.")
     # Tạo một vector store đơn giản với một văn bản rỗng để tránh lỗi
-    embeddings = HuggingFaceEmbeddings(model_name="sentence-transformers/paraphrase-multilingual-MiniLM-L12-v2")
-    vector_store = FAISS.from_texts(["Không có dữ liệu khóa học hoặc giảng viên."], embeddings)
+    vector_store = FAISS.from_texts(["Không có dữ liệu khóa học hoặc giảng viên."], get_embeddings())
 
-# CẢI TIẾN: Cấu hình retriever với chiến lược kết hợp và filter dynamic
-def get_retriever(query=None):
+# Filter metadata của retriever theo loại truy vấn (mỗi loại có một bộ chain dựng sẵn)
+RETRIEVER_FILTERS = {
+    None: None,
+    "course": {"type": "course"},
+    "mentor": {"type": "mentor"},
+}
+
+def retriever_filter_type(query):
     """
-    Tạo retriever với filter tùy chỉnh dựa trên query
+    Xác định loại filter retriever dựa trên query
     """
-    filter_metadata = None
-    
-    # Xác định filter dựa trên loại truy vấn
     if query:
         query_lower = query.lower()
         if "khóa học" in query_lower:
-            filter_metadata = {"type": "course"}
+            return "course"
         elif "giảng viên" in query_lower or "giáo viên" in query_lower or "giáo sư" in query_lower:
-            filter_metadata = {"type": "mentor"}
-    
-    # Cấu hình retriever với filter tương ứng
-    return vector_store.as_retriever(
+            return "mentor"
+    return None
+
+# CẢI TIẾN: Cấu hình retriever với chiến lược kết hợp và filter dynamic
+def build_retriever(store, filter_type=None):
+    """
+    Tạo retriever trên vector store với filter tương ứng loại truy vấn
+    """
+    return store.as_retriever(
         search_type="similarity",
         search_kwargs={
             'k': 20,                    # Lấy 20 kết quả tốt nhất
             'score_threshold': 0.25,    # Giảm ngưỡng để bao gồm nhiều kết quả hơn
-            'filter': filter_metadata,   # Áp dụng filter nếu có
+            'filter': RETRIEVER_FILTERS[filter_type],   # Áp dụng filter nếu có
             'fetch_k': 50               # Tìm kiếm sơ bộ 50 documents trước khi lọc
         }
     )
 
-# Sử dụng retriever mặc định ban đầu (sẽ được thay thế trong các hàm call)
-retriever = get_retriever()
-
 # Load prompt template
 prompt_template = load_prompt_template()
 
@@ -504,14 +703,236 @@ qa_prompt = ChatPromptTemplate.from_messages(
     ]
 )
 
-# Initialize the RAG chain
-history_aware_retriever = create_history_aware_retriever(
-    llm, retriever, contextualize_q_prompt
+# Question answering chain không phụ thuộc vector store nên dùng chung cho mọi filter
+question_answer_chain = create_stuff_documents_chain(llm, qa_prompt)
+
+# Viết lại câu hỏi tiếp nối thành câu hỏi độc lập (bước đầu của history-aware retriever)
+contextualize_q_chain = contextualize_q_prompt | llm | StrOutputParser()
+
+def build_rag_chains(store, filter_type):
+    """
+    Dựng retriever, history-aware retriever và RAG chain cho một loại filter
+    """
+    retriever = build_retriever(store, filter_type)
+    history_aware_retriever = create_history_aware_retriever(
+        llm, retriever, contextualize_q_prompt
+    )
+    return RAGChains(
+        retriever,
+        history_aware_retriever,
+        create_retrieval_chain(history_aware_retriever, question_answer_chain)
+    )
+
+# Initialize the RAG chains (một bộ cho mỗi filter, dùng chung giữa các request)
+chain_registry = ChainRegistry(build_rag_chains, RETRIEVER_FILTERS)
+chain_registry.rebuild(vector_store)
+
+def get_retriever(query=None):
+    """
+    Retriever dựng sẵn với filter phù hợp query
+    """
+    return chain_registry.get(retriever_filter_type(query)).retriever
+
+# Ngữ cảnh của tìm kiếm kết hợp: số chunk tốt nhất giữ lại cho mỗi khóa học / giảng viên
+# và độ dài tối đa (ký tự) của toàn bộ ngữ cảnh đưa vào prompt
+HYBRID_CHUNKS_PER_ENTITY = int(os.getenv('HYBRID_CHUNKS_PER_ENTITY', 2))
+HYBRID_MAX_CONTEXT_CHARS = int(os.getenv('HYBRID_MAX_CONTEXT_CHARS', 6000))
+
+def course_summary_document(course):
+    """
+    Document tóm tắt ngắn gọn một khóa học (không kèm nội dung từng bài học)
+    """
+    snapshot = catalog.get()
+    mentor_user = course.get('mentorUser') or snapshot.mentor_user(snapshot.get_mentor(course.get('mentor')))
+    mentor_name = mentor_user.get('name', 'Không xác định') if mentor_user else 'Không xác định'
+    categories = course.get('categories', '')
+    if isinstance(categories, list):
+        categories = ", ".join(categories)
+    description = course.get('description') or ''
+    if len(description) > 300:
+        description = description[:300] + "..."
+
+    return Document(
+        page_content=f"""
+        ID KHÓA HỌC: {course.get('_id', '')}
+        TÊN KHÓA HỌC: {course.get('name', '')}
+        MÔ TẢ: {description}
+        DANH MỤC: {categories}
+        GIÁ: {course.get('price', 0)} VND
+        TRÌNH ĐỘ: {course.get('level', '')}
+        ĐÁNH GIÁ: {course.get('ratings', 0)}/5
+        GIẢNG VIÊN: {mentor_name}
+        """,
+        metadata={"id": str(course['_id']), "type": "course", "name": course.get('name', '')}
+    )
+
+def vector_entity_documents(query):
+    """
+    Tìm kiếm vector với filter phù hợp query, mỗi khóa học / giảng viên một Document gồm các chunk
+    khớp nhất của nó (theo thứ tự chunk tốt nhất)
+    """
+    grouped = {}
+    for doc in get_retriever(query).invoke(query):
+        key = (doc.metadata.get("type"), str(doc.metadata.get("id")))
+        chunks = grouped.setdefault(key, [])
+        if len(chunks) < HYBRID_CHUNKS_PER_ENTITY and all(doc.page_content != chunk.page_content for chunk in chunks):
+            chunks.append(doc)
+
+    labels = {"course": "KHÓA HỌC", "mentor": "GIẢNG VIÊN"}
+    documents = []
+    for (entity_type, entity_id), chunks in grouped.items():
+        contents = [chunk.page_content for chunk in chunks]
+        if entity_type in labels:
+            contents.insert(0, f"{labels[entity_type]}: {chunks[0].metadata.get('name', '')} (ID: {entity_id})")
+        documents.append(Document(page_content="\n".join(contents), metadata=dict(chunks[0].metadata)))
+    return documents
+
+def keyword_course_documents(query):
+    """
+    Tìm kiếm khóa học theo từ khóa trên catalog snapshot (bản tóm tắt của từng khóa học)
+    """
+    return [course_summary_document(course) for course in search_courses_by_terms(query)]
+
+def limit_context(documents, max_chars=HYBRID_MAX_CONTEXT_CHARS):
+    """
+    Giữ các tài liệu (theo thứ tự đã gộp) trong giới hạn độ dài ngữ cảnh; tài liệu cuối có thể bị cắt bớt
+    """
+    limited, total = [], 0
+    for doc in documents:
+        remaining = max_chars - total
+        if remaining <= 0:
+            break
+        if len(doc.page_content) > remaining:
+            if limited and remaining < 200:
+                break
+            doc = Document(page_content=doc.page_content[:remaining], metadata=doc.metadata)
+        limited.append(doc)
+        total += len(doc.page_content)
+    return limited
+
+# Tìm kiếm vector và tìm kiếm từ khóa chạy song song, gộp bằng RRF và loại trùng theo id khóa học / giảng viên
+course_retriever = HybridRetriever(
+    {"vector": vector_entity_documents, "keyword": keyword_course_documents},
+    key=lambda doc: (doc.metadata.get("type"), str(doc.metadata.get("id"))),
+    max_workers=int(os.getenv('HYBRID_SEARCH_WORKERS', 8)),
+    max_results=int(os.getenv('HYBRID_MAX_RESULTS', 10))
 )
 
-question_answer_chain = create_stuff_documents_chain(llm, qa_prompt)
+def set_vector_store(new_vector_store):
+    """
+    Thay thế vector store đang dùng và dựng lại toàn bộ RAG chain (thay thế nguyên tử)
+    """
+    global vector_store
+
+    chain_registry.rebuild(new_vector_store)
+    vector_store = new_vector_store
+
+def _load_entities_for_keys(keys):
+    """
+    Lấy lại các entity theo danh sách key ("course:<id>" / "mentor:<id>")
+    """
+    course_ids = {key.split(":", 1)[1] for key in keys if key.startswith("course:")}
+    mentor_ids = {key.split(":", 1)[1] for key in keys if key.startswith("mentor:")}
+    return load_catalog_entities(course_ids=course_ids, mentor_ids=mentor_ids)
+
+def update_vector_store_incrementally(batch):
+    """
+    Cập nhật vector store theo các thay đổi đọc từ change feed
 
-rag_chain = create_retrieval_chain(history_aware_retriever, question_answer_chain)
+    Chỉ các entity thay đổi và các entity liên quan trực tiếp (giảng viên của khóa học,
+    khóa học của giảng viên) được tạo lại embeddings.
+
+    Args:
+        batch (ChangeBatch): Thay đổi từ PollingChangeFeed hoặc ChangeStreamFeed
+
+    Returns:
+        dict: Thống kê cập nhật, None nếu không có gì thay đổi
+    """
+    if indexer.vector_store is None:
+        print("CẢNH BÁO: Vector store chưa được khởi tạo từ indexer, bỏ qua cập nhật tăng dần")
+        return None
+
+    # Phát hiện entity bị xóa hẳn bằng danh sách id còn tồn tại
+    for entity_type, present_ids in batch.present.items():
+        for key in indexer.keys_of_type(entity_type):
+            entity_id = key.split(":", 1)[1]
+            if entity_id not in present_ids:
+                batch.deleted[entity_type].add(entity_id)
+
+    if batch.is_empty():
+        return None
+
+    print(f"Phát hiện thay đổi dữ liệu: {batch}")
+
+    scope_keys = set()
+    for entity_type in ("course", "mentor"):
+        for entity_id in batch.changed[entity_type] | batch.deleted[entity_type]:
+            scope_keys.add(f"{entity_type}:{entity_id}")
+
+    # Đổi tên user của giảng viên làm thay đổi văn bản giảng viên và các khóa học của họ
+    if batch.changed["user"]:
+        mentors_collection = mongodb.get_collection('mentors')
+        changed_mentors = mentors_collection.find(
+            {"user": {"$in": _to_object_ids(batch.changed["user"])}}, {"_id": 1}
+        )
+        scope_keys.update(f"mentor:{mentor['_id']}" for mentor in changed_mentors)
+
+    # Văn bản khóa học chứa thông tin giảng viên và văn bản giảng viên chứa danh sách khóa học
+    scope_keys |= indexer.related_keys(scope_keys)
+    entities = _load_entities_for_keys(scope_keys)
+
+    # Quan hệ mới (ví dụ khóa học được chuyển sang giảng viên khác)
+    new_related_keys = {key for entity in entities for key in entity["related"]} - scope_keys
+    if new_related_keys:
+        entities.extend(_load_entities_for_keys(new_related_keys))
+        scope_keys |= new_related_keys
+
+    # Catalog snapshot dùng cho các xử lý theo intent cũng phải thấy thay đổi này: chỉ đọc lại
+    # các khóa học / giảng viên trong phạm vi (document khóa học chứa sẵn thông tin giảng viên)
+    catalog.apply_changes(
+        {key.split(":", 1)[1] for key in scope_keys if key.startswith("course:")},
+        {key.split(":", 1)[1] for key in scope_keys if key.startswith("mentor:")}
+    )
+
+    old_hashes = indexer.entity_hashes()
+    new_vector_store, stats = indexer.apply(entities, scope_keys=scope_keys)
+    if stats["added"] or stats["changed"] or stats["removed"]:
+        set_vector_store(new_vector_store)
+        new_hashes = indexer.entity_hashes()
+        fingerprint = compute_catalog_fingerprint(new_hashes, EMBEDDING_MODEL_NAME, TEXT_SPLITTER_CONFIGS)
+        _save_vector_store_snapshot(new_vector_store, fingerprint, len(indexer.entity_state))
+        # Chỉ xóa các câu trả lời nhắc đến khóa học / giảng viên đã thay đổi
+        previous_fingerprint = vector_store_stats.get("fingerprint")
+        vector_store_stats["fingerprint"] = fingerprint
+        invalidate_cached_answers(_changed_entity_keys(old_hashes, new_hashes), previous_fingerprint, fingerprint)
+    return stats
+
+def start_incremental_indexing(interval_seconds=60, use_change_streams=False):
+    """
+    Khởi động thread nền đọc change feed và cập nhật vector store tăng dần
+
+    Args:
+        interval_seconds (int): Khoảng thời gian giữa các lần đọc thay đổi
+        use_change_streams (bool): Dùng MongoDB change streams (cần replica set)
+            thay vì polling theo `updatedAt`
+    """
+    db = mongodb.connect()
+    feed = ChangeStreamFeed(db) if use_change_streams else PollingChangeFeed(db)
+
+    def indexing_task():
+        while True:
+            time.sleep(interval_seconds)
+            try:
+                update_vector_store_incrementally(feed.poll())
+            except Exception as e:
+                print(f"Lỗi trong thread cập nhật vector store: {e}")
+
+    # Tạo và khởi động thread với daemon=True để tránh chặn chương trình khi tắt
+    indexing_thread = threading.Thread(target=indexing_task, daemon=True)
+    indexing_thread.start()
+    print(f"Đã khởi động thread cập nhật vector store tăng dần (chạy mỗi {interval_seconds} giây, "
+          f"{'change streams' if use_change_streams else 'polling updatedAt'})")
+    return feed
 
 # Add this after the rag_chain initialization
 def safe_mongo_query(collection, query=None, limit=None, sort=None, sort_field=None, sort_order=1):
@@ -622,40 +1043,38 @@ def extract_mentor_name(query):
         # Nếu vẫn không tìm thấy, thử một cách tiếp cận khác với fuzzy matching
         if not mentor_name:
             # Lấy tối đa 10 giảng viên để so sánh
-            mentors_collection = mongodb.get_collection('mentors')
-            if mentors_collection:
-                try:
-                    mentors = safe_mongo_query(mentors_collection, {}, limit=10)
-                    
-                    # Thử tìm tên giảng viên trong câu hỏi dựa trên fuzzy matching
-                    max_ratio = 0
-                    best_match = None
-                    
-                    for mentor in mentors:
-                        if 'full_name' in mentor and mentor['full_name']:
-                            mentor_fullname = mentor['full_name'].lower()
-                            mentor_normalized = normalize_text(mentor_fullname)
-                            
-                            # Thử so khớp tên đầy đủ
-                            ratio = fuzz.partial_ratio(mentor_normalized, query_normalized)
-                            if ratio > max_ratio and ratio > 70:  # Ngưỡng 70% match
-                                max_ratio = ratio
-                                best_match = mentor_fullname
-                            
-                            # Thử so khớp với từng phần của tên (họ, tên đệm, tên)
-                            name_parts = mentor_fullname.split()
-                            for part in name_parts:
-                                if len(part) > 2:  # Chỉ so sánh với các phần có ít nhất 3 ký tự
-                                    part_normalized = normalize_text(part)
-                                    ratio = fuzz.partial_ratio(part_normalized, query_normalized)
-                                    if ratio > max_ratio and ratio > 80:  # Ngưỡng cao hơn cho phần tên
-                                        max_ratio = ratio
-                                        best_match = mentor_fullname
-                    
-                    if best_match:
-                        mentor_name = best_match
-                except Exception as e:
-                    print(f"Lỗi khi tìm kiếm fuzzy matching cho tên giảng viên: {e}")
+            try:
+                mentors = catalog.get().mentors(limit=10)
+                
+                # Thử tìm tên giảng viên trong câu hỏi dựa trên fuzzy matching
+                max_ratio = 0
+                best_match = None
+                
+                for mentor in mentors:
+                    if 'full_name' in mentor and mentor['full_name']:
+                        mentor_fullname = mentor['full_name'].lower()
+                        mentor_normalized = normalize_text(mentor_fullname)
+                        
+                        # Thử so khớp tên đầy đủ
+                        ratio = fuzz.partial_ratio(mentor_normalized, query_normalized)
+                        if ratio > max_ratio and ratio > 70:  # Ngưỡng 70% match
+                            max_ratio = ratio
+                            best_match = mentor_fullname
+                        
+                        # Thử so khớp với từng phần của tên (họ, tên đệm, tên)
+                        name_parts = mentor_fullname.split()
+                        for part in name_parts:
+                            if len(part) > 2:  # Chỉ so sánh với các phần có ít nhất 3 ký tự
+                                part_normalized = normalize_text(part)
+                                ratio = fuzz.partial_ratio(part_normalized, query_normalized)
+                                if ratio > max_ratio and ratio > 80:  # Ngưỡng cao hơn cho phần tên
+                                    max_ratio = ratio
+                                    best_match = mentor_fullname
+                
+                if best_match:
+                    mentor_name = best_match
+            except Exception as e:
+                print(f"Lỗi khi tìm kiếm fuzzy matching cho tên giảng viên: {e}")
         
         if mentor_name:
             print(f"Tìm thấy tên giảng viên: {mentor_name}")
@@ -671,137 +1090,134 @@ def extract_mentor_name(query):
 def classify_query_intent(query):
     """
     Phân loại ý định của câu hỏi để xử lý tốt hơn
+
+    Các pattern được biên dịch một lần trong `intent_classifier` và chấm điểm trong một lần quét câu hỏi.
     """
-    query_lower = query.lower()
-    
-    # Định nghĩa các pattern cho từng loại intent
-    intent_patterns = {
-        'course_search': [
-            r'khóa học', r'khoá học', r'course', r'các khóa', 
-            r'liệt kê.*khóa', r'có khóa', r'tìm khóa',
-            r'khóa học về', r'học về', r'học online',
-            r'danh sách.*khóa', r'thông tin.*khóa'
-        ],
-        'course_detail': [
-            r'chi tiết.*khóa học', r'thông tin chi tiết.*khóa', 
-            r'nội dung.*khóa', r'bài học.*khóa',
-            r'có những gì.*khóa', r'khóa học.*gồm',
-            r'\[(.*?)\]', r'"(.*?)"', r'\'(.*?)\'',  # Khóa học trong ngoặc
-            r'khóa học mã số'
-        ],
-        'mentor_search': [
-            r'giảng viên', r'giáo viên', r'mentor', r'teacher',
-            r'người dạy', r'ai dạy', r'người hướng dẫn'
-        ],
-        'mentor_by_name': [
-            r'giảng viên tên', r'giáo viên tên',
-            r'thông tin.*giảng viên', r'thông tin.*giáo viên',
-            r'giảng viên.*là ai', r'thầy', r'cô'
-        ],
-        'mentor_by_specialization': [
-            r'giảng viên.*chuyên', r'giáo viên.*chuyên',
-            r'giảng viên.*expert', r'chuyên gia về',
-            r'giảng viên.*về', r'ai.*chuyên.*về'
-        ],
-        'course_comparison': [
-            r'so sánh.*khóa', r'khóa nào tốt hơn',
-            r'khóa.*hay hơn', r'nên chọn khóa',
-            r'khác nhau.*khóa', r'đâu tốt hơn',
-            r'.*và.*khác gì nhau'
-        ],
-        'price_question': [
-            r'giá.*khóa', r'học phí', r'chi phí', 
-            r'bao nhiêu tiền', r'mất bao nhiêu'
-        ],
-        'rating_question': [
-            r'đánh giá', r'rating', r'review',
-            r'feedback', r'nhận xét', r'tốt không'
-        ]
-    }
-    
-    # Ngưỡng điểm tối thiểu để xác định intent
-    MIN_INTENT_SCORE = 1
-    
-    # Điểm số cho mỗi intent (để xác định độ tin cậy)
-    intent_scores = {intent: 0 for intent in intent_patterns}
-    
-    # Tính điểm cho mỗi intent dựa trên số lượng pattern khớp
-    for intent, patterns in intent_patterns.items():
-        for pattern in patterns:
-            if re.search(pattern, query_lower):
-                # Tăng điểm cho intent này
-                intent_scores[intent] += 1
-                
-                # Bonus points cho một số điều kiện đặc biệt
-                if intent == 'course_comparison' and re.search(r'so sánh.*khóa', query_lower):
-                    intent_scores[intent] += 2  # Boost cho so sánh rõ ràng
-                
-                if intent == 'mentor_by_name' and re.search(r'giảng viên tên', query_lower):
-                    intent_scores[intent] += 2  # Boost cho tìm giảng viên theo tên rõ ràng
-                    
-                if intent == 'course_detail' and any(re.search(pattern, query_lower) for pattern in [r'\[(.*?)\]', r'"(.*?)"', r'\'(.*?)\'']):
-                    intent_scores[intent] += 2  # Boost cho chi tiết khóa học cụ thể
-    
-    # Xác định tất cả intent có điểm số > ngưỡng tối thiểu
-    matched_intents = [intent for intent, score in intent_scores.items() if score >= MIN_INTENT_SCORE]
-    
-    # Sắp xếp intent theo điểm số
-    sorted_intents = sorted(intent_scores.items(), key=lambda x: x[1], reverse=True)
-    
-    # Xác định intent chính (có điểm cao nhất và vượt ngưỡng)
-    primary_intent = sorted_intents[0][0] if sorted_intents and sorted_intents[0][1] >= MIN_INTENT_SCORE else None
-    
-    # Xử lý các trường hợp xung đột
-    if len(matched_intents) > 1:
-        # Nếu có sự chênh lệch không đáng kể giữa hai intent hàng đầu, xem xét ưu tiên
-        top_score = sorted_intents[0][1]
-        second_score = sorted_intents[1][1]
-        
-        if top_score - second_score <= 1:  # Điểm chênh lệch nhỏ
-            # Ưu tiên theo thứ tự
-            priority_order = [
-                'course_comparison',  # Ưu tiên cao nhất cho so sánh
-                'course_detail',       # Sau đó đến chi tiết khóa học
-                'mentor_by_name',      # Tiếp theo là tìm giảng viên theo tên
-                'mentor_by_specialization', 
-                'price_question', 
-                'rating_question',
-                'mentor_search',
-                'course_search'        # Ưu tiên thấp nhất
-            ]
-            
-            # Tìm intent có ưu tiên cao nhất trong các intent matched
-            for intent in priority_order:
-                if intent in matched_intents:
-                    primary_intent = intent
-                    break
-    
-    # Nếu không tìm thấy intent cụ thể, mặc định là course_search
-    if not primary_intent:
-        primary_intent = 'course_search'  # Default intent
-    
-    # Xác định các intent phụ (có điểm > ngưỡng và không phải intent chính)
-    secondary_intents = [intent for intent in matched_intents if intent != primary_intent]
-    
-    # Độ tin cậy của intent chính (tỷ lệ phần trăm)
-    primary_confidence = 0
-    if primary_intent in intent_scores and sum(intent_scores.values()) > 0:
-        primary_confidence = (intent_scores[primary_intent] / sum(intent_scores.values())) * 100
-    
-    print(f"Điểm số intent: {intent_scores}")
-    print(f"Phân loại intent câu hỏi: {primary_intent} (độ tin cậy: {primary_confidence:.1f}%), Tất cả intent: {matched_intents}")
-    
-    return {
-        'primary_intent': primary_intent,
-        'all_intents': matched_intents,
-        'secondary_intents': secondary_intents,
-        'intent_scores': intent_scores,
-        'confidence': primary_confidence
-    }
+    return intent_classifier.classify(query)
+
+# Hàm nhận từng đoạn câu trả lời của request đang stream (theo thread xử lý request)
+_stream_state = threading.local()
+
+# Thời hạn trả lời của mỗi request (0 = không giới hạn)
+REQUEST_DEADLINE_SECONDS = float(os.getenv('REQUEST_DEADLINE_SECONDS', 20))
+DEGRADED_ANSWER_MAX_ITEMS = 5
+
+def new_request_deadline():
+    """
+    Thời hạn cho một request của người dùng (None nếu không giới hạn)
+    """
+    return Deadline(REQUEST_DEADLINE_SECONDS) if REQUEST_DEADLINE_SECONDS > 0 else None
+
+def build_degraded_answer(courses=None, mentors=None):
+    """
+    Câu trả lời dựng sẵn (không cần LLM) từ các khóa học / giảng viên đã truy xuất,
+    dùng khi LLM không trả lời kịp thời hạn của request
+
+    Returns:
+        str: Danh sách tên, giá, trình độ, đánh giá, giảng viên của từng khóa học
+            và chuyên môn, kinh nghiệm, đánh giá của từng giảng viên
+    """
+    courses = list(courses or [])[:DEGRADED_ANSWER_MAX_ITEMS]
+    mentors = list(mentors or [])[:DEGRADED_ANSWER_MAX_ITEMS]
+    if not courses and not mentors:
+        return "Xin lỗi, hệ thống đang phản hồi chậm. Bạn vui lòng thử lại sau ít phút nhé."
+
+    snapshot = catalog.get()
+    answer = ("Xin lỗi, hệ thống đang phản hồi chậm nên tôi chưa thể soạn câu trả lời chi tiết. "
+              "Dưới đây là các thông tin liên quan tôi tìm được:\n")
+
+    if courses:
+        answer += "\nKhóa học:\n"
+        for i, course in enumerate(courses, 1):
+            mentor_user = course.get('mentorUser') or snapshot.mentor_user(snapshot.get_mentor(course.get('mentor')))
+            mentor_name = mentor_user.get('name', 'Không xác định') if mentor_user else 'Không xác định'
+            answer += (f"{i}. [{course.get('name', 'Không có tên')}] - Giá: {course.get('price', 0)} VND"
+                       f" - Trình độ: {course.get('level', 'Không xác định')}"
+                       f" - Đánh giá: {course.get('ratings', 0)}/5 - Giảng viên: {mentor_name}\n")
+
+    if mentors:
+        answer += "\nGiảng viên:\n"
+        for i, mentor in enumerate(mentors, 1):
+            user = snapshot.mentor_user(mentor)
+            user_name = user.get('name', 'Không xác định') if user else 'Không xác định'
+            specializations = mentor.get('specialization') or []
+            if isinstance(specializations, str):
+                specializations = [specializations]
+            specializations = ", ".join(specializations) or 'Không xác định'
+            answer += (f"{i}. {user_name} - Chuyên môn: {specializations}"
+                       f" - Kinh nghiệm: {mentor.get('experience', 0)} năm"
+                       f" - Đánh giá: {mentor.get('averageRating', 0)}/5\n")
+
+    return answer
+
+def retrieval_degraded_answer(filter_type, query):
+    """
+    Câu trả lời dựng sẵn từ kết quả tìm kiếm vector (retriever không cần LLM) khi RAG chain không kịp thời hạn
+    """
+    try:
+        documents = chain_registry.get(filter_type).retriever.invoke(query)
+    except Exception as e:
+        print(f"Lỗi khi truy xuất cho câu trả lời dự phòng: {e}")
+        documents = []
+    return documents_degraded_answer(documents)
+
+def documents_degraded_answer(documents):
+    """
+    Câu trả lời dựng sẵn từ các khóa học / giảng viên mà các tài liệu đã truy xuất trỏ tới
+    """
+    snapshot = catalog.get()
+    courses, mentors, seen = [], [], set()
+    for doc in documents:
+        entity_type, entity_id = doc.metadata.get("type"), str(doc.metadata.get("id"))
+        if (entity_type, entity_id) in seen:
+            continue
+        seen.add((entity_type, entity_id))
+        if entity_type == "course" and snapshot.get_course(entity_id):
+            courses.append(snapshot.get_course(entity_id))
+        elif entity_type == "mentor" and snapshot.get_mentor(entity_id):
+            mentors.append(snapshot.get_mentor(entity_id))
+    return build_degraded_answer(courses, mentors)
+
+# Gộp các câu hỏi giống hệt nhau đang được xử lý đồng thời (một lần gọi LLM cho mỗi câu hỏi)
+request_coalescer = SingleFlight()
+
+def answer_dependencies(result):
+    """
+    Key các khóa học / giảng viên được nhắc đến trong câu trả lời (dùng để xóa cache khi chúng thay đổi)
+    """
+    try:
+        return catalog.get().mentioned_entity_keys(result)
+    except Exception as e:
+        print(f"Lỗi khi xác định khóa học / giảng viên trong câu trả lời: {e}")
+        return set()
+
+def cache_answer(query, processed_query, intent, result, catalog_version, compute_seconds=None):
+    """
+    Lưu câu trả lời vào cache khớp chính xác (query gốc và processed_query) và semantic cache,
+    gắn phiên bản catalog và các khóa học / giảng viên mà câu trả lời nhắc đến
+
+    Args:
+        catalog_version (str): Phiên bản catalog lúc bắt đầu xử lý câu hỏi; nếu catalog đã được
+            cập nhật trong lúc tạo câu trả lời thì câu trả lời không được cache
+        compute_seconds (float): Thời gian tạo câu trả lời (dùng để làm mới sớm câu hỏi nóng)
+    """
+    if catalog_version != vector_store_stats.get("fingerprint"):
+        print("Catalog đã thay đổi trong lúc tạo câu trả lời, không lưu vào cache")
+        return
+    dependencies = answer_dependencies(result)
+    cache.set(query, result, catalog_version, dependencies, compute_seconds)  # Cache với query gốc
+    if query != processed_query:  # Nếu query đã được xử lý khác với query gốc
+        cache.set(processed_query, result, catalog_version, dependencies, compute_seconds)  # Cache với processed_query
+    if SEMANTIC_CACHE_ENABLED:
+        semantic_cache.set(processed_query, intent, result, dependencies)
 
 def send_continue_chat(chat_history, query):
     """
     Xử lý tin nhắn và trả về kết quả từ LLM
+
+    Các câu hỏi giống hệt nhau (cùng key của response cache) đến đồng thời chỉ được xử lý
+    một lần; các request còn lại chờ và dùng chung câu trả lời. Khi LLM quá tải, câu hỏi
+    được từ chối ngay với thông báo thân thiện (không lưu cache).
     
     Args:
         chat_history: Mảng các đối tượng ChatHistory
@@ -810,14 +1226,150 @@ def send_continue_chat(chat_history, query):
     Returns:
         Chuỗi câu trả lời từ LLM
     """
+    try:
+        return request_coalescer.do(
+            cache.cache_key(query or ""),
+            lambda: _answer_query(chat_history, query)
+        )
+    except LLMOverloadedError as e:
+        print(f"LLM quá tải ({e.reason}), từ chối câu hỏi: '{(query or '')[:30]}...'")
+        return BUSY_MESSAGE
+
+def stream_continue_chat(chat_history, query):
+    """
+    Chế độ stream của `send_continue_chat`: trả về từng đoạn câu trả lời ngay khi LLM sinh ra
+
+    Câu trả lời từ cache (hoặc từ request giống hệt đang chạy) được trả về thành một đoạn.
+
+    Yields:
+        dict: {"type": "chunk", "content": ...} cho từng đoạn, cuối cùng là
+            {"type": "done", "content": toàn bộ câu trả lời, "ttft_ms": ..., "total_ms": ...}.
+            Nội dung của "done" là câu trả lời chính thức (khác các đoạn đã gửi nếu LLM lỗi giữa chừng).
+    """
+    start_time = time.perf_counter()
+    chunks = queue.Queue()
+    outcome = {}
+
+    def run():
+        _stream_state.sink = lambda text: chunks.put(("chunk", text))
+        try:
+            outcome["answer"] = send_continue_chat(chat_history, query)
+        except Exception as e:
+            print(f"Lỗi khi stream câu trả lời: {e}")
+            outcome["answer"] = "Xin lỗi, tôi đang gặp sự cố khi xử lý câu hỏi của bạn. Vui lòng thử lại sau."
+        finally:
+            _stream_state.sink = None
+            chunks.put(("done", None))
+
+    threading.Thread(target=run, daemon=True).start()
+
+    first_chunk_time = None
+    streamed = False
+    while True:
+        kind, text = chunks.get()
+        if kind == "done":
+            break
+        if first_chunk_time is None:
+            first_chunk_time = time.perf_counter()
+        streamed = True
+        yield {"type": "chunk", "content": text}
+
+    answer = outcome.get("answer", "")
+    if not streamed and answer:
+        first_chunk_time = time.perf_counter()
+        yield {"type": "chunk", "content": answer}
+
+    total_ms = (time.perf_counter() - start_time) * 1000
+    ttft_ms = (first_chunk_time - start_time) * 1000 if first_chunk_time else total_ms
+    print(f"Stream câu trả lời: time-to-first-token {ttft_ms:.0f} ms, tổng {total_ms:.0f} ms")
+    yield {"type": "done", "content": answer, "ttft_ms": round(ttft_ms, 1), "total_ms": round(total_ms, 1)}
+
+# Chế độ server bất đồng bộ: phần xử lý đồng bộ của pipeline chạy trên executor có giới hạn,
+# thời gian chờ Gemini không giữ thread nào
+pipeline_runner = AsyncPipelineRunner(
+    llm, max_workers=int(os.getenv('PIPELINE_EXECUTOR_WORKERS', 8)), gateway=llm_gateway
+)
+async_request_coalescer = AsyncSingleFlight()
+
+async def async_send_continue_chat(chat_history, query, on_chunk=None):
+    """
+    Phiên bản bất đồng bộ của `send_continue_chat` (dùng trong `async_app.py`)
+
+    Args:
+        chat_history: Mảng các đối tượng ChatHistory
+        query: Chuỗi câu hỏi từ người dùng
+        on_chunk: Hàm / coroutine function nhận từng đoạn câu trả lời khi stream (None nếu không stream).
+            Câu trả lời từ cache hoặc từ request giống hệt đang chạy không đi qua on_chunk.
+
+    Returns:
+        Chuỗi câu trả lời từ LLM
+    """
+    try:
+        return await async_request_coalescer.do(
+            cache.cache_key(query or ""),
+            lambda: _run_async_pipeline(chat_history, query, on_chunk)
+        )
+    except LLMOverloadedError as e:
+        print(f"LLM quá tải ({e.reason}), từ chối câu hỏi: '{(query or '')[:30]}...'")
+        return BUSY_MESSAGE
+    except Exception as e:
+        print(f"Lỗi khi xử lý tin nhắn (async): {e}")
+        return "Xin lỗi, tôi đang gặp sự cố khi xử lý câu hỏi của bạn. Vui lòng thử lại sau."
+
+async def _run_async_pipeline(chat_history, query, on_chunk):
+    deadline = new_request_deadline()
+    return await pipeline_runner.run(_answer_steps(chat_history, query, deadline=deadline), on_chunk, deadline)
+
+def _answer_query(chat_history, query, bypass_cache=False):
+    """
+    Xử lý một câu hỏi trên thread hiện tại (stream ra sink của thread nếu có)
+
+    Args:
+        bypass_cache (bool): Bỏ qua cache khi đọc (dùng khi tạo lại câu trả lời đã hết hạn trong nền)
+    """
+    # Câu trả lời tạo lại trong nền không có người chờ nên không cần thời hạn
+    deadline = None if bypass_cache else new_request_deadline()
+    return run_pipeline(
+        _answer_steps(chat_history, query, bypass_cache, deadline), llm,
+        sink=getattr(_stream_state, "sink", None), gateway=llm_gateway, deadline=deadline
+    )
+
+def build_prompt_history(chat_history):
+    """
+    Lịch sử hội thoại đưa vào prompt: bản tóm tắt phần cũ + các lượt gần nhất trong ngân sách token
+    """
     history = []
+    summary, recent_history = history_window.build(chat_history)
+    if summary:
+        history.append(HumanMessage(content=f"[Tóm tắt phần hội thoại trước] {summary}"))
 
-    for chat in chat_history:
-        chat_query = chat.content
+    for chat in recent_history:
         if chat.is_user:
-            history.append(HumanMessage(content=chat_query))
+            history.append(HumanMessage(content=chat.content))
         else:
-            history.append(AIMessage(content=chat_query))
+            history.append(AIMessage(content=chat.content))
+    return history
+
+def _deadline_passed(deadline):
+    """
+    Thời hạn của request không còn đủ cho bước xử lý tiếp theo
+    """
+    return deadline is not None and deadline.remaining() < MIN_CALL_SECONDS
+
+def _answer_steps(chat_history, query, bypass_cache=False, deadline=None):
+    """
+    Pipeline xử lý một câu hỏi (kiểm tra cache, phân loại intent, truy xuất và gọi LLM)
+
+    Generator theo `async_pipeline`: mỗi lần gọi LLM được `yield` ra dưới dạng `LLMCall` /
+    `ChainCall`, để cùng một pipeline chạy được cả đồng bộ lẫn trên event loop.
+
+    Args:
+        deadline: `Deadline` của request; các bước không gọi LLM (truy xuất, tra cứu catalog)
+            cũng kiểm tra thời hạn và dùng câu trả lời dựng sẵn khi đã hết hạn
+    """
+    request_start = time.perf_counter()
+    # Phiên bản catalog mà câu trả lời được tạo ra từ đó (lấy trước khi truy xuất dữ liệu)
+    catalog_version = vector_store_stats.get("fingerprint")
 
     try:
         print(f"Xử lý câu hỏi gốc: '{query}'")
@@ -826,8 +1378,11 @@ def send_continue_chat(chat_history, query):
         if not query or len(query.strip()) == 0:
             return "Xin chào, tôi là EduBot, trợ lý chatbot của hệ thống quản lý học tập. Bạn có thể hỏi tôi về các khóa học hoặc giảng viên."
         
-        # Kiểm tra cache trước khi xử lý query
-        cached_response = cache.get(query)
+        # Kiểm tra cache trước khi xử lý query; câu trả lời vừa hết hạn vẫn được dùng
+        # trong khi một worker nền tạo lại nó (stale-while-revalidate)
+        cached_response = None if bypass_cache else cache.get(
+            query, refresh=lambda: _answer_query([], query, bypass_cache=True)
+        )
         if cached_response:
             print("Sử dụng kết quả từ cache")
             return cached_response
@@ -846,6 +1401,22 @@ def send_continue_chat(chat_history, query):
         # Xử lý dựa trên intent chính
         primary_intent = intent_info['primary_intent']
 
+        # Câu hỏi cùng nghĩa (cùng intent) đã được trả lời với phiên bản catalog hiện tại
+        if SEMANTIC_CACHE_ENABLED and not bypass_cache:
+            cached_response = semantic_cache.get(processed_query, primary_intent)
+            if cached_response:
+                print("Sử dụng kết quả từ semantic cache")
+                if catalog_version == vector_store_stats.get("fingerprint"):
+                    cache.set(query, cached_response, catalog_version, answer_dependencies(cached_response))
+                return cached_response
+
+        # Không trúng cache: lịch sử hội thoại chỉ được cắt / tóm tắt khi thực sự cần dựng prompt
+        history = build_prompt_history(chat_history)
+
+        if _deadline_passed(deadline):
+            print("Hết thời hạn request trước khi truy xuất, trả lời bằng câu trả lời dựng sẵn")
+            return build_degraded_answer()
+
         # Xử lý so sánh khóa học
         if primary_intent == 'course_comparison':
             print("Phát hiện yêu cầu so sánh khóa học")
@@ -889,8 +1460,7 @@ def send_continue_chat(chat_history, query):
                 Trả về dưới dạng danh sách các tên khóa học, mỗi tên trên một dòng.
                 """
                 try:
-                    extract_response = llm.invoke(extract_prompt)
-                    extracted_text = extract_response.content
+                    extracted_text = yield LLMCall(extract_prompt, stream=False)
                     # Tách các dòng và loại bỏ dấu gạch đầu dòng nếu có
                     extracted_lines = [line.strip().lstrip('- ') for line in extracted_text.split('\n') if line.strip()]
                     # Lọc các dòng có nội dung
@@ -911,14 +1481,13 @@ def send_continue_chat(chat_history, query):
             if course_names and len(course_names) >= 2:
                 print(f"So sánh các khóa học: {course_names}")
                 
-                # Lấy thông tin từ MongoDB
-                courses_collection = mongodb.get_collection('courses')
+                # Lấy thông tin từ catalog snapshot (không truy vấn MongoDB)
+                snapshot = catalog.get()
                 compared_courses = []
                 
                 for course_name in course_names:
                     # Tìm kiếm khóa học dựa trên tên
-                    course_query = {"name": {"$regex": course_name, "$options": "i"}, "status": "active"}
-                    courses = safe_mongo_query(courses_collection, course_query, limit=2)
+                    courses = snapshot.find_courses_by_name(course_name, limit=2)
                     
                     if courses:
                         compared_courses.extend(courses)
@@ -926,30 +1495,18 @@ def send_continue_chat(chat_history, query):
                         # Thử tìm kiếm với các từ khóa từ tên khóa học
                         keywords = course_name.split()
                         if len(keywords) > 1:  # Nếu có nhiều từ khóa
-                            broader_query = {"$and": [{"name": {"$regex": keyword, "$options": "i"}} for keyword in keywords if len(keyword) > 2]}
-                            broader_courses = safe_mongo_query(courses_collection, broader_query, limit=2)
+                            broader_courses = snapshot.find_courses_by_name_keywords(
+                                [keyword for keyword in keywords if len(keyword) > 2], limit=2
+                            )
                             if broader_courses:
                                 compared_courses.extend(broader_courses)
                 
                 # Xử lý trường hợp không có đủ khóa học để so sánh
                 if len(compared_courses) < 2:
-                    # Tìm kiếm thêm với fuzzy matching
-                    all_courses = safe_mongo_query(courses_collection, {"status": "active"}, limit=20)
-                    
+                    # Tìm kiếm thêm với fuzzy matching (index tên dựng sẵn, không duyệt toàn bộ khóa học)
                     for course_name in course_names:
-                        # Chuẩn hóa tên khóa học cần tìm
-                        normalized_name = normalize_text(course_name.lower())
-                        
-                        # Tìm các khóa học tương tự
-                        potential_matches = []
-                        for course in all_courses:
-                            if course.get('name'):
-                                similarity = fuzz.ratio(normalized_name, normalize_text(course['name'].lower()))
-                                if similarity > 60:  # Ngưỡng tương đồng 60%
-                                    potential_matches.append((course, similarity))
-                        
-                        # Sắp xếp và lấy khóa học tốt nhất
-                        potential_matches.sort(key=lambda x: x[1], reverse=True)
+                        # Tìm khóa học tương tự nhất, ngưỡng tương đồng 60%
+                        potential_matches = snapshot.fuzzy_find_courses(course_name, limit=1, score_cutoff=60)
                         if potential_matches and potential_matches[0][0] not in compared_courses:
                             compared_courses.append(potential_matches[0][0])
                 
@@ -965,11 +1522,9 @@ def send_continue_chat(chat_history, query):
                         mentor_rating = 0
                         
                         if mentor_id:
-                            mentors_collection = mongodb.get_collection('mentors')
-                            mentor = mentors_collection.find_one({"_id": mentor_id})
+                            mentor = snapshot.get_mentor(mentor_id)
                             if mentor:
-                                users_collection = mongodb.get_collection('users')
-                                user = users_collection.find_one({"_id": mentor.get('user')})
+                                user = snapshot.mentor_user(mentor)
                                 if user:
                                     mentor_name = user.get('name', 'Không xác định')
                                     mentor_experience = mentor.get('experience', 0)
@@ -1036,12 +1591,9 @@ def send_continue_chat(chat_history, query):
                     """
                     
                     try:
-                        response = llm.invoke(prompt)
-                        result = response.content
-                        # Lưu kết quả vào cache - sử dụng query gốc và processed_query
-                        cache.set(query, result)  # Cache với query gốc
-                        if query != processed_query:  # Nếu query đã được xử lý khác với query gốc
-                            cache.set(processed_query, result)  # Cache với processed_query
+                        result = yield LLMCall(prompt, fallback=lambda: build_degraded_answer(courses=compared_courses))
+                        # Lưu kết quả vào cache - query gốc, processed_query và semantic cache theo intent
+                        cache_answer(query, processed_query, primary_intent, result, catalog_version, time.perf_counter() - request_start)
                         return result
                     except Exception as e:
                         print(f"Lỗi khi gọi LLM để so sánh khóa học: {e}")
@@ -1066,12 +1618,9 @@ def send_continue_chat(chat_history, query):
                     Hãy trả lời một cách lịch sự, giải thích rằng không thể tìm thấy đầy đủ thông tin để so sánh các khóa học được yêu cầu.
                     Gợi ý người dùng thử tìm kiếm với tên khóa học chính xác hơn hoặc xem danh sách các khóa học hiện có.
                     """
-                    response = llm.invoke(not_found_prompt)
-                    result = response.content
-                    # Lưu kết quả vào cache - sử dụng query gốc và processed_query
-                    cache.set(query, result)  # Cache với query gốc
-                    if query != processed_query:  # Nếu query đã được xử lý khác với query gốc
-                        cache.set(processed_query, result)  # Cache với processed_query
+                    result = yield LLMCall(not_found_prompt, fallback=lambda: build_degraded_answer(courses=compared_courses))
+                    # Lưu kết quả vào cache - query gốc, processed_query và semantic cache theo intent
+                    cache_answer(query, processed_query, primary_intent, result, catalog_version, time.perf_counter() - request_start)
                     return result
 
         # CASE 1: Tìm kiếm khóa học cụ thể theo tên
@@ -1097,22 +1646,14 @@ def send_continue_chat(chat_history, query):
             if course_name:
                 print(f"Tìm kiếm khóa học với tên: '{course_name}'")
                 
-                # Tìm kiếm trong MongoDB theo tên khóa học
-                query_obj = {
-                    "name": {"$regex": course_name, "$options": "i"},
-                    "status": "active"
-                }
-                
-                courses_collection = mongodb.get_collection('courses')
-                if not courses_collection:
-                    print("Lỗi: Không thể lấy collection courses từ MongoDB")
+                # Tìm kiếm trong catalog snapshot theo tên khóa học
+                try:
+                    snapshot = catalog.get()
+                    specific_course = snapshot.find_courses_by_name(course_name)
+                except Exception as e:
+                    print(f"Lỗi khi đọc catalog snapshot: {e}")
+                    snapshot = None
                     specific_course = []
-                else:
-                    try:
-                        specific_course = list(courses_collection.find(query_obj))
-                    except Exception as e:
-                        print(f"Lỗi khi truy vấn MongoDB: {e}")
-                        specific_course = []
                 
                 if specific_course:
                     print(f"Tìm thấy {len(specific_course)} khóa học có tên phù hợp")
@@ -1125,11 +1666,9 @@ def send_continue_chat(chat_history, query):
                         mentor_id = course.get('mentor')
                         mentor_info = None
                         if mentor_id:
-                            mentors_collection = mongodb.get_collection('mentors')
-                            mentor = mentors_collection.find_one({"_id": mentor_id})
+                            mentor = snapshot.get_mentor(mentor_id)
                             if mentor:
-                                users_collection = mongodb.get_collection('users')
-                                user = users_collection.find_one({"_id": mentor.get('user')})
+                                user = snapshot.mentor_user(mentor)
                                 if user:
                                     mentor_info = {
                                         "name": user.get('name', 'Không xác định'),
@@ -1179,16 +1718,13 @@ def send_continue_chat(chat_history, query):
                     Sử dụng các thông tin chi tiết và tạo câu trả lời tự nhiên, thân thiện.
                     """
                     
-                    response = llm.invoke(prompt)
-                    result = response.content
-                    # Lưu kết quả vào cache - sử dụng query gốc và processed_query
-                    cache.set(query, result)  # Cache với query gốc
-                    if query != processed_query:  # Nếu query đã được xử lý khác với query gốc
-                        cache.set(processed_query, result)  # Cache với processed_query
+                    result = yield LLMCall(prompt, fallback=lambda: build_degraded_answer(courses=specific_course))
+                    # Lưu kết quả vào cache - query gốc, processed_query và semantic cache theo intent
+                    cache_answer(query, processed_query, primary_intent, result, catalog_version, time.perf_counter() - request_start)
                     return result
                 else:
                     # Không tìm thấy khóa học cụ thể, thử tìm kiếm tương tự
-                    similar_courses = mongodb.search_courses(course_name, limit=5)
+                    similar_courses = snapshot.search_courses(course_name, limit=5) if snapshot else []
                     if similar_courses:
                         courses_text = f"Không tìm thấy khóa học có tên chính xác '{course_name}', nhưng có các khóa học tương tự:\n\n"
                         
@@ -1214,12 +1750,9 @@ def send_continue_chat(chat_history, query):
                         nhưng giới thiệu các khóa học tương tự. Đề xuất họ có thể tìm kiếm với từ khóa khác hoặc xem danh sách tất cả các khóa học.
                         """
                         
-                        response = llm.invoke(prompt)
-                        result = response.content
-                        # Lưu kết quả vào cache - sử dụng query gốc và processed_query
-                        cache.set(query, result)  # Cache với query gốc
-                        if query != processed_query:  # Nếu query đã được xử lý khác với query gốc
-                            cache.set(processed_query, result)  # Cache với processed_query
+                        result = yield LLMCall(prompt, fallback=lambda: build_degraded_answer(courses=similar_courses))
+                        # Lưu kết quả vào cache - query gốc, processed_query và semantic cache theo intent
+                        cache_answer(query, processed_query, primary_intent, result, catalog_version, time.perf_counter() - request_start)
                         return result
         
         # CASE 1.5: Tìm kiếm giảng viên theo tên
@@ -1237,47 +1770,28 @@ def send_continue_chat(chat_history, query):
             if mentor_name:
                 print(f"Tìm kiếm giảng viên với tên: '{mentor_name}'")
                 
-                # Tìm kiếm trong MongoDB
-                mentors_collection = mongodb.get_collection('mentors')
-                users_collection = mongodb.get_collection('users')
+                # Tìm kiếm trong catalog snapshot
+                snapshot = catalog.get()
                 
                 # Tìm người dùng với tên phù hợp
-                users = list(users_collection.find({"name": {"$regex": mentor_name, "$options": "i"}}))
+                users = snapshot.find_users_by_name(mentor_name)
                 user_ids = [user['_id'] for user in users]
                 
                 # Tìm giảng viên có user_id thuộc danh sách trên
                 mentors = []
                 if user_ids:
-                    mentors = list(mentors_collection.find({"user": {"$in": user_ids}}))
+                    mentors = snapshot.mentors_for_users(user_ids)
                 
                 # Nếu không tìm thấy kết quả chính xác, thử tìm kiếm fuzzy
                 if not mentors:
                     print("Không tìm thấy kết quả chính xác, thử tìm kiếm với fuzzy matching")
-                    all_users = list(users_collection.find({}))
-                    potential_matches = []
-                    
-                    for user in all_users:
-                        user_name = user.get('name', '')
-                        if user_name:
-                            # Chuẩn hóa tên người dùng và tên tìm kiếm
-                            normalized_user_name = normalize_text(user_name.lower())
-                            normalized_mentor_name = normalize_text(mentor_name.lower())
-                            
-                            # Tính độ tương đồng
-                            similarity_ratio = fuzz.ratio(normalized_user_name, normalized_mentor_name)
-                            if similarity_ratio > 60:  # Ngưỡng tương đồng 60%
-                                potential_matches.append((user, similarity_ratio))
-                    
-                    # Sắp xếp theo độ tương đồng giảm dần
-                    potential_matches.sort(key=lambda x: x[1], reverse=True)
-                    
-                    # Lấy 5 kết quả tốt nhất
-                    top_matches = potential_matches[:5]
+                    # Lấy 5 kết quả tốt nhất từ index tên dựng sẵn (ngưỡng tương đồng 60%)
+                    top_matches = snapshot.fuzzy_find_users(mentor_name, limit=5, score_cutoff=60)
                     
                     if top_matches:
                         print(f"Tìm thấy {len(top_matches)} kết quả fuzzy matching")
                         user_ids = [match[0]['_id'] for match in top_matches]
-                        mentors = list(mentors_collection.find({"user": {"$in": user_ids}}))
+                        mentors = snapshot.mentors_for_users(user_ids)
                 
                 if mentors:
                     print(f"Tìm thấy {len(mentors)} giảng viên có tên phù hợp")
@@ -1287,8 +1801,7 @@ def send_continue_chat(chat_history, query):
                     
                     for i, mentor in enumerate(mentors, 1):
                         # Lấy thông tin user
-                        user_id = mentor.get('user')
-                        user = users_collection.find_one({"_id": user_id}) if user_id else None
+                        user = snapshot.mentor_user(mentor)
                         user_name = user.get('name', 'Không xác định') if user else 'Không xác định'
                         
                         # Định dạng thông tin chuyên môn và thành tựu
@@ -1296,7 +1809,7 @@ def send_continue_chat(chat_history, query):
                         achievements = ", ".join(mentor.get('achievements', []))
                         
                         # Lấy TẤT CẢ các khóa học của giảng viên
-                        mentor_courses = mongodb.get_courses_by_mentor(mentor.get('_id'), limit=None)
+                        mentor_courses = snapshot.courses_of_mentor(mentor.get('_id'))
                         courses_text = ""
                         
                         if mentor_courses:
@@ -1328,24 +1841,20 @@ def send_continue_chat(chat_history, query):
                     Đối với danh sách khóa học, hãy đảm bảo liệt kê đầy đủ tên khóa học với đúng ID và thông tin quan trọng.
                     """
                     
-                    response = llm.invoke(prompt)
-                    result = response.content
-                    # Lưu kết quả vào cache - sử dụng query gốc và processed_query
-                    cache.set(query, result)  # Cache với query gốc
-                    if query != processed_query:  # Nếu query đã được xử lý khác với query gốc
-                        cache.set(processed_query, result)  # Cache với processed_query
+                    result = yield LLMCall(prompt, fallback=lambda: build_degraded_answer(mentors=mentors))
+                    # Lưu kết quả vào cache - query gốc, processed_query và semantic cache theo intent
+                    cache_answer(query, processed_query, primary_intent, result, catalog_version, time.perf_counter() - request_start)
                     return result
                 else:
                     # Không tìm thấy giảng viên, thử gợi ý các giảng viên khác
-                    random_mentors = list(mentors_collection.find().limit(5))
+                    random_mentors = snapshot.mentors(limit=5)
                     
                     if random_mentors:
                         mentors_text = f"Không tìm thấy giảng viên có tên '{mentor_name}'. Dưới đây là một số giảng viên khác trong hệ thống:\n\n"
                         
                         for i, mentor in enumerate(random_mentors, 1):
                             # Lấy thông tin người dùng
-                            user_id = mentor.get('user')
-                            user = users_collection.find_one({"_id": user_id}) if user_id else None
+                            user = snapshot.mentor_user(mentor)
                             user_name = user.get('name', 'Không xác định') if user else 'Không xác định'
                             
                             mentors_text += f"{i}. Tên giảng viên: {user_name}\n"
@@ -1362,12 +1871,9 @@ def send_continue_chat(chat_history, query):
                         nhưng giới thiệu một số giảng viên khác. Đề xuất họ có thể tìm kiếm với từ khóa khác hoặc xem danh sách tất cả các giảng viên.
                         """
                         
-                        response = llm.invoke(prompt)
-                        result = response.content
-                        # Lưu kết quả vào cache - sử dụng query gốc và processed_query
-                        cache.set(query, result)  # Cache với query gốc
-                        if query != processed_query:  # Nếu query đã được xử lý khác với query gốc
-                            cache.set(processed_query, result)  # Cache với processed_query
+                        result = yield LLMCall(prompt, fallback=lambda: build_degraded_answer(mentors=random_mentors))
+                        # Lưu kết quả vào cache - query gốc, processed_query và semantic cache theo intent
+                        cache_answer(query, processed_query, primary_intent, result, catalog_version, time.perf_counter() - request_start)
                         return result
         
         # CASE 2: Tìm kiếm giảng viên theo chuyên môn hoặc kinh nghiệm
@@ -1389,20 +1895,9 @@ def send_continue_chat(chat_history, query):
                 experience = int(experience_match.group(1))
                 print(f"Tìm kiếm giảng viên có kinh nghiệm: {experience} năm")
             
-            # Tìm kiếm trong MongoDB
-            mentors_collection = mongodb.get_collection('mentors')
-            users_collection = mongodb.get_collection('users')
-            
-            query = {}
-            
-            if specialization:
-                query["specialization"] = {"$regex": specialization, "$options": "i"}
-            
-            if experience:
-                query["experience"] = {"$gte": experience}
-            
-            # Thực hiện tìm kiếm
-            mentors = list(mentors_collection.find(query))
+            # Tìm kiếm trong catalog snapshot
+            snapshot = catalog.get()
+            mentors = snapshot.find_mentors(specialization=specialization, min_experience=experience)
             
             if mentors:
                 print(f"Tìm thấy {len(mentors)} giảng viên phù hợp")
@@ -1412,8 +1907,7 @@ def send_continue_chat(chat_history, query):
                 
                 for i, mentor in enumerate(mentors, 1):
                     # Lấy thông tin người dùng
-                    user_id = mentor.get('user')
-                    user = users_collection.find_one({"_id": user_id}) if user_id else None
+                    user = snapshot.mentor_user(mentor)
                     user_name = user.get('name', 'Không xác định') if user else 'Không xác định'
                     
                     mentors_text += f"{i}. Tên giảng viên: {user_name}\n"
@@ -1423,7 +1917,7 @@ def send_continue_chat(chat_history, query):
                     mentors_text += f"   Đánh giá: {mentor.get('averageRating', 0)}/5\n"
                     
                     # Lấy thông tin khóa học
-                    mentor_courses = mongodb.get_courses_by_mentor(mentor.get('_id'), limit=None)
+                    mentor_courses = snapshot.courses_of_mentor(mentor.get('_id'))
                     if mentor_courses:
                         mentors_text += f"   Danh sách khóa học ({len(mentor_courses)}):\n"
                         for j, course in enumerate(mentor_courses[:3], 1):
@@ -1447,24 +1941,20 @@ def send_continue_chat(chat_history, query):
                 Nếu người dùng hỏi về kinh nghiệm {experience if experience else ''} năm, hãy nhấn mạnh vào phần kinh nghiệm.
                 """
                 
-                response = llm.invoke(prompt)
-                result = response.content
-                # Lưu kết quả vào cache - sử dụng query gốc và processed_query
-                cache.set(query, result)  # Cache với query gốc
-                if query != processed_query:  # Nếu query đã được xử lý khác với query gốc
-                    cache.set(processed_query, result)  # Cache với processed_query
+                result = yield LLMCall(prompt, fallback=lambda: build_degraded_answer(mentors=mentors))
+                # Lưu kết quả vào cache - query gốc, processed_query và semantic cache theo intent
+                cache_answer(query, processed_query, primary_intent, result, catalog_version, time.perf_counter() - request_start)
                 return result
             else:
                 # Không tìm thấy giảng viên phù hợp
-                all_mentors = list(mentors_collection.find().limit(5))
+                all_mentors = snapshot.mentors(limit=5)
                 
                 if all_mentors:
                     mentors_text = f"Không tìm thấy giảng viên phù hợp với yêu cầu của bạn, nhưng đây là một số giảng viên khác:\n\n"
                     
                     for i, mentor in enumerate(all_mentors, 1):
                         # Lấy thông tin người dùng
-                        user_id = mentor.get('user')
-                        user = users_collection.find_one({"_id": user_id}) if user_id else None
+                        user = snapshot.mentor_user(mentor)
                         user_name = user.get('name', 'Không xác định') if user else 'Không xác định'
                         
                         mentors_text += f"{i}. Tên giảng viên: {user_name}\n"
@@ -1483,12 +1973,9 @@ def send_continue_chat(chat_history, query):
                     nhưng giới thiệu các giảng viên khác. Đề xuất họ có thể tìm kiếm với tiêu chí khác.
                     """
                     
-                    response = llm.invoke(prompt)
-                    result = response.content
-                    # Lưu kết quả vào cache - sử dụng query gốc và processed_query
-                    cache.set(query, result)  # Cache với query gốc
-                    if query != processed_query:  # Nếu query đã được xử lý khác với query gốc
-                        cache.set(processed_query, result)  # Cache với processed_query
+                    result = yield LLMCall(prompt, fallback=lambda: build_degraded_answer(mentors=all_mentors))
+                    # Lưu kết quả vào cache - query gốc, processed_query và semantic cache theo intent
+                    cache_answer(query, processed_query, primary_intent, result, catalog_version, time.perf_counter() - request_start)
                     return result
         
         # Tiếp tục với các trường hợp khác từ code hiện tại
@@ -1496,154 +1983,48 @@ def send_continue_chat(chat_history, query):
         if "khóa học" in processed_query.lower():
             print("Phát hiện truy vấn về khóa học - thực hiện tìm kiếm kết hợp")
             
-            # Tạo context-aware retriever với retriever đã lọc
-            context_retriever = create_history_aware_retriever(
-                llm, get_retriever(processed_query), contextualize_q_prompt
-            )
-            
-            # Tạo question answering chain với retriever đã lọc
-            qa_chain = create_stuff_documents_chain(llm, qa_prompt)
-            context_aware_rag_chain = create_retrieval_chain(context_retriever, qa_chain)
-            
-            # Chiến lược 1: Thử sử dụng RAG trước
-            response = context_aware_rag_chain.invoke({"input": processed_query, "chat_history": history})
-            documents = response.get('documents', [])
-            print(f"RAG search: Đã tìm thấy {len(documents)} tài liệu liên quan")
-            
-            # Nếu RAG không tìm thấy đủ tài liệu, sử dụng tìm kiếm trực tiếp MongoDB
-            if len(documents) < 2:
-                print("Không đủ kết quả từ RAG, thực hiện tìm kiếm MongoDB trực tiếp")
-                
-                # Trích xuất từ khóa chính để tìm kiếm
-                search_terms = extract_search_terms(processed_query)
-                
-                all_courses = []
-                for term in search_terms:
-                    # Tìm kiếm trực tiếp trong MongoDB
-                    print(f"Tìm kiếm khóa học với từ khóa: '{term}'")
-                    courses = mongodb.search_courses(term, limit=None)
-                    
-                    # Thêm các khóa học mới vào danh sách
-                    for course in courses:
-                        course_id = str(course.get('_id', ''))
-                        # Kiểm tra xem khóa học đã tồn tại trong danh sách chưa
-                        if not any(str(c.get('_id', '')) == course_id for c in all_courses):
-                            all_courses.append(course)
-                
-                print(f"Tìm kiếm MongoDB: Đã tìm thấy {len(all_courses)} khóa học")
-                
-                if all_courses:
-                    # Tạo văn bản mô tả các khóa học
-                    courses_text = "Dưới đây là các khóa học có liên quan trong hệ thống:\n\n"
-                    
-                    for i, course in enumerate(all_courses, 1):
-                        mentor_name = "Không xác định"
-                        if 'mentorUser' in course and course['mentorUser']:
-                            mentor_name = course['mentorUser'].get('name', 'Không xác định')
-                        
-                        courses_text += f"{i}. Tên khóa học: [{course.get('name', 'Không có tên')}]\n"
-                        courses_text += f"   ID: {course.get('_id')}\n"
-                        courses_text += f"   Mô tả: {course.get('description', 'Không có mô tả')[:150]}...\n"
-                        courses_text += f"   Giá: {course.get('price', 0)} VND\n"
-                        courses_text += f"   Giảng viên: {mentor_name}\n"
-                        courses_text += f"   Trình độ: {course.get('level', 'Không xác định')}\n"
-                        courses_text += f"   Đánh giá: {course.get('ratings', 0)}/5\n\n"
-                    
-                    # Kết hợp kết quả từ RAG (nếu có) với kết quả từ MongoDB
-                    combined_context = ""
-                    if documents:
-                        combined_context = "Thông tin từ vector search:\n"
-                        combined_context += "\n".join([doc.page_content for doc in documents[:3]])
-                        combined_context += "\n\nThông tin từ tìm kiếm trực tiếp:\n"
-                    
-                    combined_context += courses_text
-                    
-                    # Chuyển trực tiếp dữ liệu cho LLM để trả lời
-                    prompt = f"""
-                    Hãy trả lời câu hỏi của người dùng: "{processed_query}" dựa trên thông tin sau:
-                    
-                    {combined_context}
-                    
-                    Trả lời đầy đủ, rõ ràng và cung cấp thông tin chi tiết về từng khóa học.
-                    Đảm bảo liệt kê đầy đủ tất cả các khóa học có trong dữ liệu.
-                    """
-                    
-                    direct_response = llm.invoke(prompt)
-                    result = direct_response.content
-                    # Lưu kết quả vào cache - sử dụng query gốc và processed_query
-                    cache.set(query, result)  # Cache với query gốc
-                    if query != processed_query:  # Nếu query đã được xử lý khác với query gốc
-                        cache.set(processed_query, result)  # Cache với processed_query
-                    return result
+            # Tìm kiếm vector và tìm kiếm trực tiếp trên catalog chạy song song, gộp bằng RRF
+            # (chỉ chờ đến thời hạn của request)
+            documents = limit_context(course_retriever.retrieve(
+                processed_query, timeout=None if deadline is None else deadline.remaining()
+            ))
 
-            answer = response["answer"]
-            
-            # Xử lý trường hợp không tìm thấy thông tin
-            if "xin lỗi" in answer.lower() and ("không tìm thấy" in answer.lower() or "chưa có dữ liệu" in answer.lower()):
-                print("Phát hiện câu trả lời 'không tìm thấy', thử tìm kiếm lại...")
-                
-                # Trích xuất từ khóa chính để tìm kiếm
-                search_terms = extract_search_terms(processed_query)
-                
-                # Tìm kiếm trực tiếp trong MongoDB
-                all_courses = []
-                for term in search_terms:
-                    print(f"Tìm kiếm trực tiếp với từ khóa: '{term}'")
-                    courses = mongodb.search_courses(term, limit=None)
-                    
-                    # Thêm các khóa học mới vào danh sách
-                    for course in courses:
-                        course_id = str(course.get('_id', ''))
-                        if not any(str(c.get('_id', '')) == course_id for c in all_courses):
-                            all_courses.append(course)
-                
-                if all_courses:
-                    print(f"Tìm thấy {len(all_courses)} khóa học từ MongoDB")
-                    
-                    # Tạo văn bản mô tả các khóa học
-                    courses_text = "Dưới đây là các khóa học có liên quan trong hệ thống:\n\n"
-                    
-                    for i, course in enumerate(all_courses, 1):
-                        mentor_name = "Không xác định"
-                        if 'mentorUser' in course and course['mentorUser']:
-                            mentor_name = course['mentorUser'].get('name', 'Không xác định')
-                        
-                        courses_text += f"{i}. Tên khóa học: [{course.get('name', 'Không có tên')}]\n"
-                        courses_text += f"   ID: {course.get('_id')}\n"
-                        courses_text += f"   Mô tả: {course.get('description', 'Không có mô tả')[:150]}...\n"
-                        courses_text += f"   Giá: {course.get('price', 0)} VND\n"
-                        courses_text += f"   Giảng viên: {mentor_name}\n"
-                        courses_text += f"   Trình độ: {course.get('level', 'Không xác định')}\n"
-                        courses_text += f"   Đánh giá: {course.get('ratings', 0)}/5\n\n"
-                    
-                    # Chuyển trực tiếp dữ liệu cho LLM để trả lời
-                    prompt = f"""
-                    Hãy trả lời câu hỏi của người dùng: "{processed_query}" dựa trên thông tin sau:
-                    
-                    {courses_text}
-                    
-                    Trả lời đầy đủ, rõ ràng và cung cấp thông tin chi tiết về từng khóa học.
-                    Đảm bảo liệt kê đầy đủ tất cả các khóa học có trong dữ liệu.
-                    """
-                    
-                    direct_response = llm.invoke(prompt)
-                    result = direct_response.content
-                    # Lưu kết quả vào cache - sử dụng query gốc và processed_query
-                    cache.set(query, result)  # Cache với query gốc
-                    if query != processed_query:  # Nếu query đã được xử lý khác với query gốc
-                        cache.set(processed_query, result)  # Cache với processed_query
-                    return result
-            
+            if history:
+                # Câu hỏi tiếp nối cần được viết lại thành câu hỏi độc lập; nếu hết thời hạn,
+                # trả lời bằng các khóa học đã truy xuất theo câu hỏi gốc (không truy xuất lại)
+                initial_documents = documents
+                search_query = yield ChainCall(
+                    contextualize_q_chain, {"input": processed_query, "chat_history": history}, stream=False,
+                    fallback=lambda: documents_degraded_answer(initial_documents)
+                )
+                if search_query.strip() != processed_query.strip():
+                    if _deadline_passed(deadline):
+                        return documents_degraded_answer(initial_documents)
+                    documents = limit_context(course_retriever.retrieve(
+                        search_query, timeout=None if deadline is None else deadline.remaining()
+                    ))
+            print(f"Tìm kiếm kết hợp: {len(documents)} khóa học / giảng viên liên quan, "
+                  f"ngữ cảnh {sum(len(doc.page_content) for doc in documents)} ký tự")
+
+            # Một lần gọi LLM trên ngữ cảnh đã gộp (stream từng đoạn câu trả lời khi request stream)
+            answer = yield ChainCall(
+                question_answer_chain,
+                {"context": documents, "input": processed_query, "chat_history": history},
+                fallback=lambda: documents_degraded_answer(documents)
+            )
+            # Lưu kết quả vào cache - query gốc, processed_query và semantic cache theo intent
+            cache_answer(query, processed_query, primary_intent, answer, catalog_version, time.perf_counter() - request_start)
             return answer
         else:
             # Thử truy vấn với RAG bình thường cho các câu hỏi không liên quan đến khóa học
             try:
-                response = rag_chain.invoke({"input": processed_query, "chat_history": history})
+                response = yield ChainCall(
+                    chain_registry.get(None).rag_chain, {"input": processed_query, "chat_history": history},
+                    fallback=lambda: retrieval_degraded_answer(None, processed_query)
+                )
                 result = response.get("answer", "")
-                # Lưu kết quả vào cache - sử dụng query gốc và processed_query
-                cache.set(query, result)  # Cache với query gốc
-                if query != processed_query:  # Nếu query đã được xử lý khác với query gốc
-                    cache.set(processed_query, result)  # Cache với processed_query
+                # Lưu kết quả vào cache - query gốc, processed_query và semantic cache theo intent
+                cache_answer(query, processed_query, primary_intent, result, catalog_version, time.perf_counter() - request_start)
                 return result
             except Exception as e:
                 print(f"Lỗi khi gọi LLM trong RAG: {e}")
@@ -1695,6 +2076,21 @@ def extract_search_terms(query):
     print(f"Các từ khóa tìm kiếm: {terms}")
     return terms
 
+def search_courses_by_terms(query):
+    """
+    Tìm khóa học trực tiếp trong catalog theo các từ khóa của câu truy vấn (không trùng lặp)
+    """
+    snapshot = catalog.get()
+    all_courses, seen_ids = [], set()
+    for term in extract_search_terms(query):
+        print(f"Tìm kiếm khóa học với từ khóa: '{term}'")
+        for course in snapshot.search_courses(term):
+            course_id = str(course.get('_id', ''))
+            if course_id not in seen_ids:
+                seen_ids.add(course_id)
+                all_courses.append(course)
+    return all_courses
+
 # Test function
 if __name__ == "__main__":
     # Kiểm tra tình trạng của cache
@@ -0,0 +1,149 @@
+"""
+Query Expander - Mở rộng từ viết tắt trong câu hỏi tiếng Việt bằng một lần quét
+Bảng viết tắt được đọc từ file cấu hình và tự nạp lại khi file thay đổi
+"""
+
+import os
+import re
+import json
+import threading
+import time
+
+# Bảng mặc định khi chưa có file cấu hình (hoặc file bị lỗi)
+DEFAULT_ABBREVIATIONS = {
+    "k/h": "khóa học",
+    "kh": "khóa học",
+    "gv": "giảng viên",
+    "sv": "sinh viên",
+    "đhqg": "đại học quốc gia",
+    "đh": "đại học",
+    "cntt": "công nghệ thông tin",
+    "htn": "học trực tuyến",
+    "ml": "machine learning",
+    "ai": "artificial intelligence",
+    "ds": "data science",
+    "ba": "business analytics",
+    "ui/ux": "ui ux design",
+}
+
+
+def build_trie_regex(words):
+    """
+    Tạo regex dạng trie từ danh sách cụm từ cố định
+
+    Các cụm chung tiền tố được gộp nhánh nên chi phí khớp tại mỗi vị trí phụ thuộc độ dài
+    cụm từ chứ không phụ thuộc số lượng cụm; nhánh dài hơn được thử trước nên luôn khớp
+    cụm dài nhất có thể.
+    """
+    trie = {}
+    for word in words:
+        node = trie
+        for ch in word:
+            node = node.setdefault(ch, {})
+        node[''] = True
+
+    def build(node):
+        is_end = '' in node
+        branches = [re.escape(ch) + build(child) for ch, child in sorted(node.items()) if ch != '']
+        if not branches:
+            return ''
+        if len(branches) == 1 and not is_end:
+            return branches[0]
+        body = '(?:' + '|'.join(branches) + ')'
+        return body + '?' if is_end else body
+
+    return build(trie)
+
+
+class QueryExpander:
+    """
+    Thay thế các từ viết tắt (nguyên từ, không phân biệt hoa thường) bằng dạng đầy đủ
+
+    Toàn bộ bảng được biên dịch thành một regex `\\b(?:trie)\\b` duy nhất; câu hỏi được
+    viết lại trong một lần `sub`, mỗi từ khớp tra bảng một lần.
+
+    Args:
+        config_path: File JSON {"viết tắt": "dạng đầy đủ"}; None để chỉ dùng bảng mặc định
+        reload_interval_seconds: Khoảng thời gian tối thiểu giữa hai lần kiểm tra file thay đổi
+    """
+    def __init__(self, config_path=None, reload_interval_seconds=5, defaults=None):
+        self.config_path = config_path
+        self.reload_interval_seconds = reload_interval_seconds
+        self.defaults = dict(defaults if defaults is not None else DEFAULT_ABBREVIATIONS)
+        self._lock = threading.Lock()
+        self._config_mtime = None
+        self._last_check = 0.0
+        self._compile(self.defaults)
+        self._maybe_reload(force=True)
+
+    def _compile(self, abbreviations):
+        table = {abbr.lower(): full for abbr, full in abbreviations.items() if abbr and full is not None}
+        pattern = re.compile(r'\b(?:' + build_trie_regex(sorted(table)) + r')\b', re.IGNORECASE) if table else None
+        # Gán một lần để request đang chạy luôn thấy cặp (bảng, regex) nhất quán
+        self._state = (table, pattern)
+
+    def _maybe_reload(self, force=False):
+        """
+        Nạp lại bảng viết tắt nếu file cấu hình đã thay đổi kể từ lần nạp trước
+        """
+        if not self.config_path:
+            return
+        now = time.monotonic()
+        if not force and now - self._last_check < self.reload_interval_seconds:
+            return
+
+        with self._lock:
+            self._last_check = now
+            try:
+                mtime = os.path.getmtime(self.config_path)
+            except OSError:
+                if self._config_mtime is not None:
+                    print(f"Không tìm thấy file viết tắt {self.config_path}, dùng bảng mặc định")
+                    self._config_mtime = None
+                    self._compile(self.defaults)
+                return
+
+            if mtime == self._config_mtime:
+                return
+
+            try:
+                with open(self.config_path, 'r', encoding='utf-8') as f:
+                    abbreviations = json.load(f)
+                if not isinstance(abbreviations, dict):
+                    raise ValueError("file phải chứa một object JSON")
+                self._compile(abbreviations)
+                self._config_mtime = mtime
+                print(f"Đã nạp {len(abbreviations)} từ viết tắt từ {self.config_path}")
+            except (OSError, ValueError) as e:
+                # Giữ bảng đang dùng; thử lại khi file được sửa
+                self._config_mtime = mtime
+                print(f"Lỗi khi đọc file viết tắt {self.config_path}: {e}")
+
+    def abbreviations(self):
+        return dict(self._state[0])
+
+    def expand(self, query):
+        """
+        Mở rộng các từ viết tắt trong câu hỏi
+
+        Args:
+            query (str): Câu hỏi
+
+        Returns:
+            str: Câu hỏi đã thay thế từ viết tắt
+        """
+        self._maybe_reload()
+        table, pattern = self._state
+        if not query or pattern is None:
+            return query
+        return pattern.sub(lambda match: table.get(match.group(0).lower(), match.group(0)), query)
+
+
+# Instance mặc định
+query_expander = QueryExpander(
+    config_path=os.getenv(
+        'ABBREVIATIONS_FILE',
+        os.path.join(os.path.dirname(os.path.abspath(__file__)), "config", "abbreviations.json")
+    ),
+    reload_interval_seconds=int(os.getenv('ABBREVIATIONS_RELOAD_SECONDS', 5))
+)
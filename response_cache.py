@@ -1,33 +1,235 @@
 """
 Response Cache Utility - Lưu trữ và truy xuất cache cho câu trả lời
 Cải tiến hiệu suất cho LMS-RAG-Chatbot
+
+Cache hai tầng: LRU trong bộ nhớ (giới hạn số mục và dung lượng) phía trước một file
+SQLite duy nhất (WAL mode) có index theo thời điểm hết hạn.
+
+Mỗi câu trả lời được gắn phiên bản catalog đã tạo ra nó và danh sách khóa học / giảng viên
+mà nó nhắc đến, nên khi catalog thay đổi chỉ các câu trả lời bị ảnh hưởng mới bị xóa.
+
+Stale-while-revalidate: câu trả lời vừa hết hạn (trong khoảng `stale_hours`) vẫn được trả về
+ngay trong khi một worker nền tạo lại nó; câu hỏi nóng được làm mới sớm theo xác suất
+(XFetch) trước khi hết hạn, nên độ trễ không tăng vọt tại thời điểm hết hạn.
 """
 
 import os
 import json
+import math
+import random
 import hashlib
+import sqlite3
 import threading
 import time
-from datetime import datetime, timedelta
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime
+
+CACHE_DB_FILENAME = "responses.sqlite3"
+
+
+class LRUMemoryCache:
+    """
+    LRU trong bộ nhớ, giới hạn theo số mục và tổng dung lượng câu trả lời (bytes UTF-8)
+
+    Mục hết hạn được giữ thêm `stale_seconds` để phục vụ stale-while-revalidate.
+    """
+    def __init__(self, max_entries=1000, max_bytes=32 * 1024 * 1024, stale_seconds=0):
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self.stale_seconds = stale_seconds
+        self._entries = OrderedDict()  # key -> (response, expires_at, size, compute_seconds)
+        self._bytes = 0
+        self._lock = threading.Lock()
+
+    def get(self, key, now):
+        """
+        Returns:
+            tuple (response, expires_at, compute_seconds) hoặc None
+        """
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                return None
+            if entry[1] + self.stale_seconds <= now:
+                self._pop(key)
+                return None
+            self._entries.move_to_end(key)
+            return entry[0], entry[1], entry[3]
+
+    def set(self, key, response, expires_at, compute_seconds=0.0):
+        size = len(response.encode('utf-8'))
+        if size > self.max_bytes:
+            return
+        with self._lock:
+            if key in self._entries:
+                self._pop(key)
+            self._entries[key] = (response, expires_at, size, compute_seconds)
+            self._bytes += size
+            while len(self._entries) > self.max_entries or self._bytes > self.max_bytes:
+                self._pop(next(iter(self._entries)))
+
+    def delete(self, key):
+        with self._lock:
+            if key in self._entries:
+                self._pop(key)
+
+    def _pop(self, key):
+        _, _, size, _ = self._entries.pop(key)
+        self._bytes -= size
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self._bytes = 0
+
+    def stats(self):
+        with self._lock:
+            return {"entries": len(self._entries), "bytes": self._bytes}
+
 
 class ResponseCache:
     """
     Cache lưu trữ các câu trả lời để tối ưu hiệu suất cho các truy vấn phổ biến
+
+    Args:
+        stale_hours (float): Thời gian mục đã hết hạn vẫn được trả về khi `get()` có hàm `refresh`
+            (0 = tắt stale-while-revalidate)
+        early_refresh_beta (float): Hệ số làm mới sớm theo xác suất (0 = tắt); càng lớn càng làm mới sớm
+        refresh_workers (int): Số worker nền tạo lại câu trả lời
     """
-    def __init__(self, cache_dir="response_cache", max_age_hours=24, cleanup_interval_minutes=30):
+    def __init__(self, cache_dir="response_cache", max_age_hours=24, cleanup_interval_minutes=30,
+                 memory_max_entries=1000, memory_max_bytes=32 * 1024 * 1024,
+                 stale_hours=0, early_refresh_beta=1.0, refresh_workers=2):
         self.cache_dir = cache_dir
         self.max_age_hours = max_age_hours
         self.cleanup_interval_minutes = cleanup_interval_minutes
-        
+        self.stale_seconds = stale_hours * 3600
+        self.early_refresh_beta = early_refresh_beta
+        self.db_path = os.path.join(cache_dir, CACHE_DB_FILENAME)
+        self.memory = LRUMemoryCache(max_entries=memory_max_entries, max_bytes=memory_max_bytes,
+                                     stale_seconds=self.stale_seconds)
+
+        # Mỗi key chỉ có một worker tạo lại tại một thời điểm
+        self._refresh_executor = ThreadPoolExecutor(max_workers=refresh_workers, thread_name_prefix="cache-refresh")
+        self._refreshing = set()
+
+        # Mỗi thread dùng một kết nối SQLite riêng (WAL cho phép đọc song song với ghi)
+        self._local = threading.local()
+
+        # Thống kê tra cứu khớp chính xác (semantic cache có thống kê riêng)
+        self._stats_lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.stale_hits = 0
+        self.refreshes = 0
+        self._lookup_seconds = 0.0
+
         # Tạo thư mục cache nếu chưa tồn tại
         if not os.path.exists(cache_dir):
             os.makedirs(cache_dir)
-            
+
+        self._init_db()
         self.cleanup_old_entries()
-        
+
         # Khởi động thread dọn dẹp tự động
         self._start_cleanup_thread()
-    
+
+    def _connect(self):
+        """
+        Lấy kết nối SQLite của thread hiện tại
+        """
+        conn = getattr(self._local, 'conn', None)
+        if conn is None:
+            conn = sqlite3.connect(self.db_path, timeout=10)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL")
+            self._local.conn = conn
+        return conn
+
+    def _init_db(self):
+        conn = self._connect()
+        with conn:
+            conn.execute("""
+                CREATE TABLE IF NOT EXISTS responses (
+                    key TEXT PRIMARY KEY,
+                    query TEXT NOT NULL,
+                    response TEXT NOT NULL,
+                    created_time REAL NOT NULL,
+                    expires_at REAL NOT NULL,
+                    catalog_version TEXT,
+                    compute_seconds REAL
+                )
+            """)
+            # Cơ sở dữ liệu tạo bởi phiên bản cũ chưa có các cột mới
+            columns = {row[1] for row in conn.execute("PRAGMA table_info(responses)")}
+            for column, column_type in (("catalog_version", "TEXT"), ("compute_seconds", "REAL")):
+                if column not in columns:
+                    conn.execute(f"ALTER TABLE responses ADD COLUMN {column} {column_type}")
+            # Index theo thời điểm hết hạn: dọn dẹp chỉ đọc các mục đã hết hạn
+            conn.execute("CREATE INDEX IF NOT EXISTS idx_responses_expires_at ON responses (expires_at)")
+
+            # Khóa học / giảng viên ("course:<id>" / "mentor:<id>") mà mỗi câu trả lời phụ thuộc
+            conn.execute("""
+                CREATE TABLE IF NOT EXISTS response_deps (
+                    key TEXT NOT NULL,
+                    entity_key TEXT NOT NULL,
+                    PRIMARY KEY (key, entity_key)
+                )
+            """)
+            conn.execute("CREATE INDEX IF NOT EXISTS idx_response_deps_entity ON response_deps (entity_key)")
+
+    def migrate_json_files(self, catalog_version):
+        """
+        Chuyển các file cache JSON cũ (mỗi query một file) vào SQLite rồi chuyển file vào thư mục `migrated_json/`
+
+        Được gọi sau khi biết phiên bản catalog hiện tại: các câu trả lời được gắn phiên bản này,
+        nếu không sẽ bị coi là không rõ nguồn gốc và bị xóa ở lần đối chiếu catalog tiếp theo.
+
+        Args:
+            catalog_version (str): Phiên bản catalog (fingerprint) hiện tại
+        """
+        try:
+            filenames = [name for name in os.listdir(self.cache_dir) if name.endswith('.json')]
+        except OSError:
+            return
+        if not filenames:
+            return
+
+        migrated_dir = os.path.join(self.cache_dir, "migrated_json")
+        os.makedirs(migrated_dir, exist_ok=True)
+        migrated = 0
+        now = time.time()
+        max_age_seconds = self.max_age_hours * 3600
+        conn = self._connect()
+        for filename in filenames:
+            file_path = os.path.join(self.cache_dir, filename)
+            try:
+                with open(file_path, 'r', encoding='utf-8') as f:
+                    cache_data = json.load(f)
+                created_time = datetime.fromisoformat(cache_data.get('created_time', '2000-01-01')).timestamp()
+                if cache_data.get('query') and cache_data.get('response') and now - created_time <= max_age_seconds:
+                    with conn:
+                        conn.execute(
+                            "INSERT OR REPLACE INTO responses "
+                            "(key, query, response, created_time, expires_at, catalog_version) "
+                            "VALUES (?, ?, ?, ?, ?, ?)",
+                            (self._get_cache_key(cache_data['query']), cache_data['query'],
+                             cache_data['response'], created_time, created_time + max_age_seconds,
+                             catalog_version)
+                        )
+                    migrated += 1
+            except Exception as e:
+                print(f"Bỏ qua file cache cũ {filename}: {e}")
+            # Giữ lại file gốc thay vì xóa, để có thể khôi phục nếu cần
+            try:
+                os.replace(file_path, os.path.join(migrated_dir, filename))
+            except OSError as e:
+                print(f"Không thể chuyển file cache cũ {filename}: {e}")
+
+        print(f"Đã chuyển {migrated}/{len(filenames)} file cache JSON cũ sang SQLite "
+              f"(file gốc nằm trong {migrated_dir})")
+
     def _start_cleanup_thread(self):
         """
         Khởi động thread dọn dẹp cache định kỳ
@@ -40,12 +242,12 @@ class ResponseCache:
                     self.cleanup_old_entries()
                 except Exception as e:
                     print(f"Lỗi trong thread dọn dẹp cache: {e}")
-        
+
         # Tạo và khởi động thread với daemon=True để tránh chặn chương trình khi tắt
         cleanup_thread = threading.Thread(target=cleanup_task, daemon=True)
         cleanup_thread.start()
         print(f"Đã khởi động thread dọn dẹp cache tự động (chạy mỗi {self.cleanup_interval_minutes} phút)")
-    
+
     def _get_cache_key(self, query):
         """
         Tạo key cache từ query
@@ -54,175 +256,266 @@ class ResponseCache:
         normalized_query = query.lower().strip()
         # Tạo hash từ query
         return hashlib.md5(normalized_query.encode('utf-8')).hexdigest()
-    
-    def _get_cache_file_path(self, cache_key):
+
+    def cache_key(self, query):
         """
-        Tạo đường dẫn file cache từ cache key
+        Key chuẩn hóa của query (dùng chung cho các cơ chế gộp request giống hệt nhau)
         """
-        return os.path.join(self.cache_dir, f"{cache_key}.json")
-    
-    def get(self, query):
+        return self._get_cache_key(query)
+
+    def get(self, query, refresh=None):
         """
         Lấy kết quả từ cache cho một query
-        
+
+        Args:
+            refresh: Hàm () tạo lại và lưu câu trả lời cho query. Khi có hàm này, mục đã hết hạn
+                (trong khoảng `stale_hours`) vẫn được trả về và được tạo lại trong worker nền;
+                mục sắp hết hạn của câu hỏi nóng có thể được tạo lại sớm.
+
         Returns:
             None nếu không có cache hoặc cache đã hết hạn
             str nếu có kết quả cache hợp lệ
         """
         if not query:
             return None
-            
+
+        start_time = time.perf_counter()
+        cache_key = self._get_cache_key(query)
+        entry = self._lookup(cache_key, query)
+        response, stale = None, False
+        if entry is not None:
+            response, expires_at, compute_seconds = entry
+            now = time.time()
+            if expires_at <= now:
+                # Hết hạn mềm: chỉ dùng khi có thể tạo lại trong nền
+                stale = True
+                if refresh is None:
+                    response = None
+                else:
+                    self._schedule_refresh(cache_key, query, refresh)
+            elif refresh is not None and self._should_refresh_early(expires_at, compute_seconds, now):
+                self._schedule_refresh(cache_key, query, refresh)
+        self._record_lookup(response is not None, time.perf_counter() - start_time, stale=stale)
+        return response
+
+    def _lookup(self, cache_key, query):
+        """
+        Returns:
+            tuple (response, expires_at, compute_seconds) của mục chưa quá hạn stale, hoặc None
+        """
         try:
-            cache_key = self._get_cache_key(query)
-            cache_file = self._get_cache_file_path(cache_key)
-            
-            if not os.path.exists(cache_file):
-                return None
-            
-            try:
-                with open(cache_file, 'r', encoding='utf-8') as f:
-                    cache_data = json.load(f)
-            except (json.JSONDecodeError, UnicodeDecodeError) as e:
-                print(f"Lỗi định dạng file cache: {e}")
-                try:
-                    # Xóa file cache lỗi
-                    os.remove(cache_file)
-                except Exception:
-                    pass
-                return None
-            
-            # Kiểm tra thời gian tạo cache
-            try:
-                created_time = datetime.fromisoformat(cache_data.get('created_time', '2000-01-01'))
-            except (ValueError, TypeError) as e:
-                print(f"Lỗi khi parse thời gian: {e}")
-                return None
-            
-            if datetime.now() - created_time > timedelta(hours=self.max_age_hours):
-                # Cache đã hết hạn
-                try:
-                    os.remove(cache_file)  # Xóa luôn file hết hạn
-                except:
-                    pass
+            now = time.time()
+
+            # Tầng 1: LRU trong bộ nhớ
+            entry = self.memory.get(cache_key, now)
+            if entry is not None:
+                print(f"Đã tìm thấy kết quả cache (bộ nhớ) cho query: '{query[:30]}...'")
+                return entry
+
+            # Tầng 2: SQLite (mục quá hạn stale được xóa bởi cleanup_old_entries)
+            row = self._connect().execute(
+                "SELECT response, expires_at, compute_seconds FROM responses WHERE key = ? AND expires_at > ?",
+                (cache_key, now - self.stale_seconds)
+            ).fetchone()
+            if row is None:
                 return None
-            
+
+            compute_seconds = row[2] or 0.0
+            self.memory.set(cache_key, row[0], row[1], compute_seconds)
             print(f"Đã tìm thấy kết quả cache cho query: '{query[:30]}...'")
-            return cache_data.get('response')
-            
+            return row[0], row[1], compute_seconds
+
         except Exception as e:
             print(f"Lỗi khi đọc cache: {e}")
             return None
-    
-    def set(self, query, response):
+
+    def _should_refresh_early(self, expires_at, compute_seconds, now):
+        """
+        XFetch: xác suất làm mới tăng dần khi gần hết hạn, theo thời gian tạo câu trả lời
+        """
+        if self.early_refresh_beta <= 0 or not compute_seconds:
+            return False
+        return now - compute_seconds * self.early_refresh_beta * math.log(1.0 - random.random()) >= expires_at
+
+    def _schedule_refresh(self, cache_key, query, refresh):
+        """
+        Tạo lại câu trả lời trong worker nền (bỏ qua nếu key đang được tạo lại)
+        """
+        with self._stats_lock:
+            if cache_key in self._refreshing:
+                return
+            self._refreshing.add(cache_key)
+            self.refreshes += 1
+
+        def refresh_task():
+            try:
+                print(f"Đang tạo lại câu trả lời cache trong nền cho query: '{query[:30]}...'")
+                refresh()
+            except Exception as e:
+                print(f"Lỗi khi tạo lại câu trả lời cache: {e}")
+            finally:
+                with self._stats_lock:
+                    self._refreshing.discard(cache_key)
+
+        try:
+            self._refresh_executor.submit(refresh_task)
+        except RuntimeError as e:
+            with self._stats_lock:
+                self._refreshing.discard(cache_key)
+            print(f"Không thể tạo lại câu trả lời cache: {e}")
+
+    def _record_lookup(self, hit, seconds, stale=False):
+        with self._stats_lock:
+            if hit:
+                self.hits += 1
+                if stale:
+                    self.stale_hits += 1
+            else:
+                self.misses += 1
+            self._lookup_seconds += seconds
+
+    def lookup_stats(self):
+        """
+        Tỷ lệ trúng cache khớp chính xác và độ trễ tra cứu trung bình
+        """
+        with self._stats_lock:
+            total = self.hits + self.misses
+            return {
+                "hits": self.hits,
+                "misses": self.misses,
+                "hit_rate": round(self.hits / total, 4) if total else 0.0,
+                "stale_hits": self.stale_hits,
+                "refreshes": self.refreshes,
+                "refreshing": len(self._refreshing),
+                "avg_lookup_ms": round(self._lookup_seconds * 1000 / total, 3) if total else 0.0
+            }
+
+    def set(self, query, response, catalog_version=None, dependencies=None, compute_seconds=None):
         """
         Lưu kết quả vào cache
+
+        Args:
+            compute_seconds (float): Thời gian tạo câu trả lời (dùng cho làm mới sớm theo xác suất)
+            catalog_version (str): Phiên bản catalog (fingerprint) đã dùng để tạo câu trả lời
+            dependencies: Key các khóa học / giảng viên mà câu trả lời nhắc đến; câu trả lời
+                không có dependency bị coi là phụ thuộc toàn bộ catalog
         """
         if not query or not response:
             return
-            
+
         try:
             cache_key = self._get_cache_key(query)
-            cache_file = self._get_cache_file_path(cache_key)
-            
-            # Đảm bảo thư mục cache tồn tại
-            if not os.path.exists(self.cache_dir):
-                os.makedirs(self.cache_dir, exist_ok=True)
-            
-            cache_data = {
-                'query': query,
-                'response': response,
-                'created_time': datetime.now().isoformat()
-            }
-            
-            # Sử dụng atomic write để tránh file corruption
-            temp_file = cache_file + '.tmp'
-            try:
-                with open(temp_file, 'w', encoding='utf-8') as f:
-                    json.dump(cache_data, f, ensure_ascii=False, indent=2)
-                # Atomic rename để đảm bảo file integrity
-                if os.path.exists(cache_file):
-                    os.remove(cache_file)
-                os.rename(temp_file, cache_file)
-                print(f"Đã lưu kết quả vào cache cho query: '{query[:30]}...'")
-            except Exception as e:
-                print(f"Lỗi khi lưu cache tạm thời: {e}")
-                # Dọn dẹp file tạm nếu có lỗi
-                if os.path.exists(temp_file):
-                    try:
-                        os.remove(temp_file)
-                    except:
-                        pass
+            created_time = time.time()
+            expires_at = created_time + self.max_age_hours * 3600
+
+            conn = self._connect()
+            with conn:
+                conn.execute(
+                    "INSERT OR REPLACE INTO responses "
+                    "(key, query, response, created_time, expires_at, catalog_version, compute_seconds) "
+                    "VALUES (?, ?, ?, ?, ?, ?, ?)",
+                    (cache_key, query, response, created_time, expires_at, catalog_version, compute_seconds)
+                )
+                conn.execute("DELETE FROM response_deps WHERE key = ?", (cache_key,))
+                conn.executemany(
+                    "INSERT OR IGNORE INTO response_deps (key, entity_key) VALUES (?, ?)",
+                    [(cache_key, entity_key) for entity_key in (dependencies or ())]
+                )
+            self.memory.set(cache_key, response, expires_at, compute_seconds or 0.0)
+            print(f"Đã lưu kết quả vào cache cho query: '{query[:30]}...'")
         except Exception as e:
             print(f"Lỗi khi lưu cache: {e}")
-    
+
+    def apply_catalog_change(self, changed_keys, previous_version, new_version):
+        """
+        Xóa các câu trả lời không còn đúng sau khi catalog chuyển từ `previous_version` sang `new_version`
+
+        Bị xóa: câu trả lời nhắc đến entity trong `changed_keys`, câu trả lời không có dependency
+        (khi có entity thay đổi) và câu trả lời của phiên bản không rõ nguồn gốc. Các câu trả lời
+        còn lại của `previous_version` được gắn phiên bản mới.
+
+        Args:
+            changed_keys: Tập key entity đã thêm / sửa / xóa, None nếu không biết (xóa mọi câu trả lời
+                không thuộc `new_version`)
+            previous_version (str): Phiên bản catalog trước khi thay đổi
+            new_version (str): Phiên bản catalog hiện tại
+        """
+        try:
+            conn = self._connect()
+            known_versions = [new_version] if changed_keys is None else [previous_version, new_version]
+            known_versions = [version for version in known_versions if version is not None]
+
+            placeholders = ", ".join("?" for _ in known_versions)
+            stale_keys = {row[0] for row in conn.execute(
+                f"SELECT key FROM responses WHERE catalog_version IS NULL OR catalog_version NOT IN ({placeholders})",
+                known_versions
+            )} if known_versions else {row[0] for row in conn.execute("SELECT key FROM responses")}
+
+            if changed_keys:
+                with conn:
+                    conn.execute("CREATE TEMP TABLE IF NOT EXISTS changed_entities (entity_key TEXT PRIMARY KEY)")
+                    conn.execute("DELETE FROM changed_entities")
+                    conn.executemany("INSERT OR IGNORE INTO changed_entities (entity_key) VALUES (?)",
+                                     [(key,) for key in changed_keys])
+                stale_keys.update(row[0] for row in conn.execute(
+                    "SELECT DISTINCT key FROM response_deps WHERE entity_key IN (SELECT entity_key FROM changed_entities)"
+                ))
+                # Câu trả lời không gắn với entity nào (ví dụ "không tìm thấy khóa học") có thể sai khi catalog đổi
+                stale_keys.update(row[0] for row in conn.execute(
+                    "SELECT key FROM responses WHERE key NOT IN (SELECT key FROM response_deps)"
+                ))
+
+            with conn:
+                conn.executemany("DELETE FROM responses WHERE key = ?", [(key,) for key in stale_keys])
+                conn.executemany("DELETE FROM response_deps WHERE key = ?", [(key,) for key in stale_keys])
+                if previous_version is not None and previous_version != new_version:
+                    conn.execute("UPDATE responses SET catalog_version = ? WHERE catalog_version = ?",
+                                 (new_version, previous_version))
+            for key in stale_keys:
+                self.memory.delete(key)
+
+            if stale_keys:
+                print(f"Catalog thay đổi ({len(changed_keys) if changed_keys is not None else 'không rõ'} entity), "
+                      f"đã xóa {len(stale_keys)} cache entries bị ảnh hưởng")
+            return len(stale_keys)
+        except Exception as e:
+            print(f"Lỗi khi xóa cache theo thay đổi catalog: {e}")
+            return 0
+
     def cleanup_old_entries(self):
         """
-        Xóa các cache entries đã hết hạn
+        Xóa các cache entries đã quá hạn stale (chỉ duyệt các mục hết hạn nhờ index expires_at)
         """
         try:
-            now = datetime.now()
-            files_removed = 0
-            clean_errors = 0
-            
-            # Đảm bảo thư mục cache tồn tại
-            if not os.path.exists(self.cache_dir):
-                os.makedirs(self.cache_dir, exist_ok=True)
-                return
-            
-            for filename in os.listdir(self.cache_dir):
-                if filename.endswith('.json'):
-                    file_path = os.path.join(self.cache_dir, filename)
-                    
-                    try:
-                        with open(file_path, 'r', encoding='utf-8') as f:
-                            try:
-                                cache_data = json.load(f)
-                                
-                                try:
-                                    created_time = datetime.fromisoformat(cache_data.get('created_time', '2000-01-01'))
-                                    if now - created_time > timedelta(hours=self.max_age_hours):
-                                        os.remove(file_path)
-                                        files_removed += 1
-                                except (ValueError, TypeError):
-                                    # Thời gian không hợp lệ, xóa file
-                                    os.remove(file_path)
-                                    files_removed += 1
-                            except json.JSONDecodeError:
-                                # File JSON không hợp lệ, xóa
-                                os.remove(file_path)
-                                files_removed += 1
-                    except Exception as e:
-                        # Lỗi khi đọc hoặc xóa file
-                        clean_errors += 1
-                        print(f"Lỗi khi dọn dẹp file cache {filename}: {e}")
-            
-            if files_removed > 0:
-                print(f"Đã xóa {files_removed} cache entries hết hạn")
-            if clean_errors > 0:
-                print(f"Có {clean_errors} lỗi khi dọn dẹp cache")
-                
+            conn = self._connect()
+            with conn:
+                cursor = conn.execute("DELETE FROM responses WHERE expires_at <= ?",
+                                      (time.time() - self.stale_seconds,))
+                if cursor.rowcount > 0:
+                    conn.execute("DELETE FROM response_deps WHERE key NOT IN (SELECT key FROM responses)")
+            if cursor.rowcount > 0:
+                print(f"Đã xóa {cursor.rowcount} cache entries hết hạn")
         except Exception as e:
             print(f"Lỗi khi dọn dẹp cache: {e}")
-    
+
     def clear_all(self):
         """
         Xóa tất cả các mục cache
         """
         try:
-            files_removed = 0
-            for filename in os.listdir(self.cache_dir):
-                if filename.endswith('.json'):
-                    os.remove(os.path.join(self.cache_dir, filename))
-                    files_removed += 1
-            
-            print(f"Đã xóa tất cả {files_removed} cache entries")
+            conn = self._connect()
+            with conn:
+                cursor = conn.execute("DELETE FROM responses")
+                conn.execute("DELETE FROM response_deps")
+            self.memory.clear()
+            print(f"Đã xóa tất cả {cursor.rowcount} cache entries")
         except Exception as e:
             print(f"Lỗi khi xóa toàn bộ cache: {e}")
 
     def check_cache_health(self):
         """
-        Kiểm tra tình trạng của thư mục cache và sửa chữa nếu cần
-        
+        Kiểm tra tình trạng của cache và sửa chữa nếu cần
+
         Returns:
             dict: Thông tin về tình trạng cache
         """
@@ -230,39 +523,25 @@ class ResponseCache:
             # Đảm bảo thư mục cache tồn tại
             if not os.path.exists(self.cache_dir):
                 os.makedirs(self.cache_dir, exist_ok=True)
+                self._local = threading.local()
+                self._init_db()
                 print(f"Đã tạo mới thư mục cache: {self.cache_dir}")
                 return {"status": "created", "entries": 0}
-            
-            entries = 0
-            valid_entries = 0
-            invalid_entries = 0
-            
-            for filename in os.listdir(self.cache_dir):
-                if filename.endswith('.json'):
-                    entries += 1
-                    file_path = os.path.join(self.cache_dir, filename)
-                    
-                    try:
-                        with open(file_path, 'r', encoding='utf-8') as f:
-                            try:
-                                json.load(f)
-                                valid_entries += 1
-                            except json.JSONDecodeError:
-                                invalid_entries += 1
-                                # Xóa các file không hợp lệ
-                                os.remove(file_path)
-                    except Exception:
-                        invalid_entries += 1
-                        try:
-                            os.remove(file_path)
-                        except:
-                            pass
-                        
+
+            conn = self._connect()
+            total_entries = conn.execute("SELECT COUNT(*) FROM responses").fetchone()[0]
+            valid_entries = conn.execute(
+                "SELECT COUNT(*) FROM responses WHERE expires_at > ?", (time.time(),)
+            ).fetchone()[0]
+            integrity = conn.execute("PRAGMA quick_check").fetchone()[0]
+
             return {
-                "status": "healthy" if invalid_entries == 0 else "repaired",
-                "total_entries": entries,
+                "status": "healthy" if integrity == "ok" else "corrupted",
+                "total_entries": total_entries,
                 "valid_entries": valid_entries,
-                "invalid_entries": invalid_entries
+                "invalid_entries": total_entries - valid_entries,
+                "memory": self.memory.stats(),
+                "lookups": self.lookup_stats()
             }
         except Exception as e:
             print(f"Lỗi khi kiểm tra tình trạng cache: {e}")
@@ -271,6 +550,11 @@ class ResponseCache:
 # Instance mặc định
 cache = ResponseCache(
     cache_dir=os.path.join(os.path.dirname(os.path.abspath(__file__)), "response_cache"),
-    max_age_hours=24,  # 24 giờ
-    cleanup_interval_minutes=30  # 30 phút
-) 
\ No newline at end of file
+    # Câu trả lời bị xóa ngay khi khóa học / giảng viên liên quan thay đổi nên có thể giữ lâu
+    max_age_hours=float(os.getenv('RESPONSE_CACHE_MAX_AGE_HOURS', 168)),  # 7 ngày
+    cleanup_interval_minutes=30,  # 30 phút
+    memory_max_entries=int(os.getenv('RESPONSE_CACHE_MEMORY_ENTRIES', 1000)),
+    memory_max_bytes=int(os.getenv('RESPONSE_CACHE_MEMORY_MB', 32)) * 1024 * 1024,
+    stale_hours=float(os.getenv('RESPONSE_CACHE_STALE_HOURS', 24)),
+    early_refresh_beta=float(os.getenv('RESPONSE_CACHE_EARLY_REFRESH_BETA', 1.0))
+)
@@ -2,6 +2,7 @@ from app import app, socketio
 from dotenv import load_dotenv
 import os
 import sys
+import signal
 import logging
 
 # Set up logging
@@ -18,19 +19,53 @@ if __name__ == "__main__":
     port = int(os.getenv('PORT', 8080))
     debug = os.getenv('DEBUG', 'False').lower() == 'true'
     
-    # Rebuild vector store to ensure latest data
+    # Create the MongoDB indexes for hot queries and verify their query plans (no COLLSCAN allowed)
+    if os.getenv('MONGODB_ENSURE_INDEXES', 'True').lower() == 'true':
+        from db_connector import mongodb
+        from db_indexes import provision_indexes, CollectionScanError
+        try:
+            provision_indexes(mongodb.connect())
+        except CollectionScanError as e:
+            logger.error(f"Index check failed: {e}")
+            sys.exit(1)
+        except Exception as e:
+            logger.warning(f"Could not provision MongoDB indexes: {e}")
+    
+    # Vector store is initialized when lms_rag is imported (snapshot warm-start or rebuild).
+    # Only force a second build when explicitly requested.
     try:
-        logger.info("Rebuilding vector store from latest MongoDB data...")
-        from lms_rag import build_vector_store
-        vector_store = build_vector_store()
-        if vector_store:
-            logger.info("Vector store rebuilt successfully!")
-        else:
-            logger.warning("Failed to rebuild vector store. Chat functionality may be limited.")
+        from lms_rag import vector_store_stats
+        if os.getenv('REBUILD_VECTOR_STORE_ON_START', 'False').lower() == 'true':
+            logger.info("Rebuilding vector store from latest MongoDB data...")
+            from lms_rag import build_vector_store, set_vector_store
+            vector_store = build_vector_store(force_rebuild=True)
+            if vector_store:
+                set_vector_store(vector_store)
+                logger.info("Vector store rebuilt successfully!")
+            else:
+                logger.warning("Failed to rebuild vector store. Chat functionality may be limited.")
+        if vector_store_stats:
+            logger.info(f"Vector store ready from {vector_store_stats.get('source')} "
+                        f"({vector_store_stats.get('chunk_count')} chunks) "
+                        f"in {vector_store_stats.get('seconds')}s")
     except Exception as e:
         logger.error(f"Error rebuilding vector store: {e}")
         logger.warning("Continuing with potentially outdated vector store...")
     
-    # Run the app
-    logger.info(f"Starting LMS RAG Chatbot on port {port} (debug: {debug})")
-    socketio.run(app, debug=debug, host='0.0.0.0', port=port) 
\ No newline at end of file
+    # Keep the vector store in sync with catalog changes (0 disables)
+    sync_interval = int(os.getenv('CATALOG_SYNC_INTERVAL_SECONDS', 0))
+    if sync_interval > 0:
+        from lms_rag import start_incremental_indexing
+        use_change_streams = os.getenv('CATALOG_SYNC_USE_CHANGE_STREAMS', 'False').lower() == 'true'
+        start_incremental_indexing(sync_interval, use_change_streams=use_change_streams)
+    
+    # Run the app: "threaded" (Flask-SocketIO, default) or "async" (aiohttp + python-socketio + motor)
+    server_mode = os.getenv('SERVER_MODE', 'threaded').lower()
+    logger.info(f"Starting LMS RAG Chatbot on port {port} (debug: {debug}, mode: {server_mode})")
+    if server_mode == 'async':
+        from async_app import run_async_server
+        run_async_server(host='0.0.0.0', port=port)
+    else:
+        # SIGTERM (docker stop) exits normally so atexit handlers flush buffered chat history
+        signal.signal(signal.SIGTERM, lambda signum, frame: sys.exit(0))
+        socketio.run(app, debug=debug, host='0.0.0.0', port=port) 
\ No newline at end of file
@@ -0,0 +1,232 @@
+"""
+Semantic Response Cache - Trả lời lại các câu hỏi cùng ý nghĩa dù khác cách diễn đạt
+Cải tiến tỷ lệ trúng cache cho LMS-RAG-Chatbot
+
+Tầng này đứng sau cache khớp chính xác (`response_cache.py`): câu hỏi (đã tiền xử lý) được
+chuyển thành embedding và so sánh cosine với các câu hỏi đã trả lời có cùng intent và cùng
+các từ nội dung (`content_terms`).
+"""
+
+import threading
+import time
+from collections import OrderedDict
+
+import numpy as np
+
+from fuzzy_index import normalize_catalog_text
+
+# Từ chung của câu hỏi (đã bỏ dấu) không xác định chủ đề / entity mà câu hỏi nhắc đến
+CONTENT_STOP_WORDS = frozenset("""
+    khoa hoc giang vien giao su thay co khong ve cho toi minh xem liet ke tat ca cac nhung nao gi
+    la va voi cua hay tim muon biet thong tin danh sach nhe ban duoc mot the nay do nhu thi
+    dang can nen hien giup hoi em anh chi a oi day online course courses
+""".split())
+
+
+def content_terms(query):
+    """
+    Các từ nội dung của câu hỏi (chữ thường, bỏ dấu, bỏ từ chung)
+
+    Hai câu hỏi chỉ khác nhau ở entity ("khóa học python" / "khóa học java") có embeddings rất gần
+    nhau nhưng khác từ nội dung, nên không bao giờ dùng chung câu trả lời.
+    """
+    return frozenset(
+        word for word in normalize_catalog_text(query).replace('?', ' ').replace(',', ' ').split()
+        if word not in CONTENT_STOP_WORDS
+    )
+
+
+class SemanticResponseCache:
+    """
+    Cache câu trả lời theo độ tương đồng embeddings của câu hỏi
+
+    Mỗi cặp (intent, từ nội dung của câu hỏi) có một vùng riêng (ma trận vectors đã chuẩn hóa L2):
+    câu hỏi so sánh khóa học không bao giờ nhận câu trả lời của câu hỏi tìm giảng viên, và
+    "giảng viên dạy React" không nhận câu trả lời của "giảng viên dạy Vue". Embeddings chỉ dùng để
+    khớp các cách diễn đạt khác nhau của cùng một câu hỏi. Khi phiên bản catalog (fingerprint
+    vector store) thay đổi, các câu trả lời nhắc đến entity đã thay đổi bị xóa.
+
+    Độ tương đồng embeddings không phân biệt được entity mà câu hỏi nhắc đến ("giảng viên Nguyễn Văn A"
+    và "giảng viên Nguyễn Văn B" rất gần nhau), nên các intent hỏi về một entity cụ thể được loại
+    khỏi semantic cache qua `excluded_intents` và chỉ dùng cache khớp chính xác.
+    """
+    def __init__(self, embed_query, threshold=0.9, max_entries_per_intent=2000, max_age_hours=24,
+                 excluded_intents=()):
+        """
+        Args:
+            embed_query: Hàm (str) -> vector, ví dụ `CachedEmbeddings.embed_query`
+            threshold (float): Độ tương đồng cosine tối thiểu để coi là trúng cache
+            max_entries_per_intent (int): Số câu hỏi tối đa giữ cho mỗi intent (bỏ vùng ít dùng nhất)
+            max_age_hours (float): Thời gian sống của mỗi câu trả lời
+            excluded_intents: Các intent không tra cứu / lưu semantic cache (câu hỏi về một entity cụ thể)
+        """
+        self.embed_query = embed_query
+        self.threshold = threshold
+        self.max_entries_per_intent = max_entries_per_intent
+        self.max_age_hours = max_age_hours
+        self.excluded_intents = frozenset(excluded_intents)
+        self.catalog_version = None
+
+        # (intent, từ nội dung) -> {"entries": [(query, response, expires_at, dependencies)],
+        #                          "vectors": [...], "matrix": ndarray}; thứ tự LRU
+        self._scopes = OrderedDict()
+        self._intent_counts = {}
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self._lookup_seconds = 0.0
+        self._lookups = 0
+
+    def _embed(self, query):
+        vector = np.asarray(self.embed_query(query), dtype=np.float32)
+        norm = np.linalg.norm(vector)
+        return vector / norm if norm > 0 else vector
+
+    def apply_catalog_change(self, changed_keys, version):
+        """
+        Ghi nhận phiên bản catalog mới và xóa các câu trả lời bị ảnh hưởng
+
+        Args:
+            changed_keys: Tập key entity đã thêm / sửa / xóa, None nếu không biết (xóa toàn bộ)
+            version (str): Phiên bản catalog hiện tại
+        """
+        with self._lock:
+            if version == self.catalog_version and not changed_keys:
+                return
+            dropped = 0
+            for scope_key, scope in list(self._scopes.items()):
+                keep = [
+                    position for position, entry in enumerate(scope["entries"])
+                    if changed_keys is not None and entry[3] and not (entry[3] & changed_keys)
+                ]
+                dropped += len(scope["entries"]) - len(keep)
+                if len(keep) != len(scope["entries"]):
+                    self._intent_counts[scope_key[0]] -= len(scope["entries"]) - len(keep)
+                    scope["entries"] = [scope["entries"][position] for position in keep]
+                    scope["vectors"] = [scope["vectors"][position] for position in keep]
+                    scope["matrix"] = None
+                    if not keep:
+                        del self._scopes[scope_key]
+            self.catalog_version = version
+        if dropped:
+            print(f"Catalog thay đổi, đã xóa {dropped} câu trả lời trong semantic cache")
+
+    def get(self, query, intent):
+        """
+        Lấy câu trả lời của câu hỏi đã cache gần nghĩa nhất (cùng intent và cùng từ nội dung)
+
+        Returns:
+            None nếu không có câu hỏi nào đủ tương đồng
+            str nếu trúng cache
+        """
+        if not query or intent in self.excluded_intents:
+            return None
+
+        start_time = time.perf_counter()
+        scope_key = (intent, content_terms(query))
+        try:
+            with self._lock:
+                if scope_key not in self._scopes:
+                    self.misses += 1
+                    return None
+
+            vector = self._embed(query)
+            now = time.time()
+
+            with self._lock:
+                scope = self._scopes.get(scope_key)
+                if not scope or not scope["entries"]:
+                    self.misses += 1
+                    return None
+                self._scopes.move_to_end(scope_key)
+                if scope["matrix"] is None:
+                    scope["matrix"] = np.vstack(scope["vectors"])
+
+                similarities = scope["matrix"] @ vector
+                best = int(np.argmax(similarities))
+                cached_query, response, expires_at, _ = scope["entries"][best]
+                if similarities[best] < self.threshold or expires_at <= now:
+                    self.misses += 1
+                    return None
+
+                self.hits += 1
+
+            print(f"Đã tìm thấy kết quả semantic cache cho query: '{query[:30]}...' "
+                  f"(giống '{cached_query[:30]}...', cosine {similarities[best]:.3f})")
+            return response
+        except Exception as e:
+            print(f"Lỗi khi đọc semantic cache: {e}")
+            return None
+        finally:
+            with self._lock:
+                self._lookup_seconds += time.perf_counter() - start_time
+                self._lookups += 1
+
+    def set(self, query, intent, response, dependencies=None):
+        """
+        Lưu câu trả lời cho câu hỏi vào vùng của (intent, từ nội dung)
+
+        Args:
+            dependencies: Key các khóa học / giảng viên mà câu trả lời nhắc đến
+        """
+        if not query or not response or intent in self.excluded_intents:
+            return
+
+        try:
+            vector = self._embed(query)
+            expires_at = time.time() + self.max_age_hours * 3600
+
+            scope_key = (intent, content_terms(query))
+            with self._lock:
+                scope = self._scopes.setdefault(scope_key, {"entries": [], "vectors": [], "matrix": None})
+                self._scopes.move_to_end(scope_key)
+                scope["entries"].append((query, response, expires_at, frozenset(dependencies or ())))
+                scope["vectors"].append(vector)
+                scope["matrix"] = None
+                self._intent_counts[intent] = self._intent_counts.get(intent, 0) + 1
+                if self._intent_counts[intent] > self.max_entries_per_intent:
+                    self._evict_oldest(intent)
+        except Exception as e:
+            print(f"Lỗi khi lưu semantic cache: {e}")
+
+    def _evict_oldest(self, intent):
+        """
+        Bỏ câu hỏi cũ nhất trong vùng ít được dùng nhất của intent (gọi khi đang giữ self._lock)
+        """
+        for scope_key, scope in self._scopes.items():
+            if scope_key[0] != intent:
+                continue
+            del scope["entries"][0]
+            del scope["vectors"][0]
+            scope["matrix"] = None
+            if not scope["entries"]:
+                del self._scopes[scope_key]
+            self._intent_counts[intent] -= 1
+            return
+
+    def clear_all(self):
+        """
+        Xóa tất cả câu trả lời trong semantic cache
+        """
+        with self._lock:
+            self._scopes = OrderedDict()
+            self._intent_counts = {}
+        print("Đã xóa toàn bộ semantic cache")
+
+    def stats(self):
+        """
+        Tỷ lệ trúng cache và độ trễ tra cứu trung bình (bao gồm thời gian tính embedding câu hỏi)
+        """
+        with self._lock:
+            total = self.hits + self.misses
+            return {
+                "entries": {intent: count for intent, count in self._intent_counts.items() if count},
+                "scopes": len(self._scopes),
+                "hits": self.hits,
+                "misses": self.misses,
+                "hit_rate": round(self.hits / total, 4) if total else 0.0,
+                "avg_lookup_ms": round(self._lookup_seconds * 1000 / self._lookups, 3) if self._lookups else 0.0,
+                "threshold": self.threshold,
+                "excluded_intents": sorted(self.excluded_intents),
+                "catalog_version": self.catalog_version
+            }
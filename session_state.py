@@ -0,0 +1,165 @@
+"""
+Session State - Trạng thái session chat của từng người dùng trong một document (collection `chat_sessions`)
+Cải tiến độ trễ cho LMS-RAG-Chatbot: xác định session cho tin nhắn mới bằng một lệnh findOneAndUpdate
+
+Mỗi người dùng có một document {_id: user_id, session_number, last_activity, message_count}.
+Việc quyết định bắt đầu session mới (không hoạt động quá 30 phút hoặc session đã có hơn 15 tin nhắn)
+và cập nhật bộ đếm diễn ra trong cùng một update nguyên tử phía MongoDB, nên chi phí không phụ thuộc
+vào độ dài lịch sử chat và hai request đồng thời của cùng người dùng không tạo ra hai session.
+"""
+
+from datetime import datetime, timedelta
+
+from pymongo import ReturnDocument
+from pymongo.errors import DuplicateKeyError
+
+SESSION_IDLE_TIMEOUT = timedelta(minutes=30)
+SESSION_MAX_MESSAGES = 15
+
+# Mỗi lượt hỏi đáp lưu hai tin nhắn (người dùng và bot)
+MESSAGES_PER_EXCHANGE = 2
+
+_NEVER = datetime(1970, 1, 1)
+
+
+class SessionStateStore:
+    """
+    Cấp session cho tin nhắn mới dựa trên document trạng thái của người dùng
+
+    Người dùng chưa có document (dữ liệu cũ) được khởi tạo một lần từ session cuối trong
+    `chat_history`, sau đó mọi lần cấp session chỉ còn một round trip.
+
+    Args:
+        connector: MongoDBConnector (hoặc connector có `get_collection`)
+        idle_timeout (timedelta): Thời gian không hoạt động tối đa của một session
+        max_messages (int): Số tin nhắn tối đa của một session trước khi bắt đầu session mới
+    """
+    def __init__(self, connector, idle_timeout=SESSION_IDLE_TIMEOUT, max_messages=SESSION_MAX_MESSAGES):
+        self.connector = connector
+        self.idle_timeout = idle_timeout
+        self.max_messages = max_messages
+
+    def get_collection(self):
+        return self.connector.get_collection('chat_sessions')
+
+    def get_history_collection(self):
+        return self.connector.get_collection('chat_history')
+
+    def _assign_update(self, now):
+        """
+        Update dạng pipeline: quyết định session mới và cập nhật bộ đếm trong cùng một lệnh
+        """
+        new_session = {"$or": [
+            {"$lt": [{"$ifNull": ["$last_activity", _NEVER]}, now - self.idle_timeout]},
+            {"$gt": [{"$ifNull": ["$message_count", 0]}, self.max_messages]}
+        ]}
+        return [
+            {"$set": {"new_session": new_session}},
+            {"$set": {
+                "session_number": {"$cond": [
+                    "$new_session", {"$add": [{"$ifNull": ["$session_number", 0]}, 1]}, "$session_number"
+                ]},
+                "message_count": {"$cond": [
+                    "$new_session", MESSAGES_PER_EXCHANGE, {"$add": ["$message_count", MESSAGES_PER_EXCHANGE]}
+                ]},
+                "last_activity": now
+            }}
+        ]
+
+    @staticmethod
+    def _initial_state(last_session_number, last_record, message_count):
+        """
+        Document trạng thái khởi tạo từ session cuối trong chat_history
+        """
+        return {
+            "session_number": last_session_number,
+            "message_count": message_count,
+            "last_activity": last_record['created_at'] if last_record else None
+        }
+
+    def _bootstrap(self, user_id):
+        history = self.get_history_collection()
+        last_session_number, last_record, message_count = 0, None, 0
+        last_session = history.find_one({'user_id': user_id}, sort=[('session_number', -1)])
+        if last_session:
+            last_session_number = last_session['session_number']
+            session_filter = {'user_id': user_id, 'session_number': last_session_number}
+            last_record = history.find_one(session_filter, sort=[('created_at', -1)])
+            message_count = history.count_documents(session_filter)
+
+        try:
+            self.get_collection().update_one(
+                {'_id': user_id},
+                {'$setOnInsert': self._initial_state(last_session_number, last_record, message_count)},
+                upsert=True
+            )
+        except DuplicateKeyError:
+            # Request đồng thời khác của cùng người dùng đã khởi tạo document
+            pass
+
+    def assign(self, user_id):
+        """
+        Session cho tin nhắn mới của người dùng
+
+        Returns:
+            tuple: (session_number, is_new_session)
+        """
+        for _ in range(2):
+            state = self.get_collection().find_one_and_update(
+                {'_id': user_id}, self._assign_update(datetime.utcnow()),
+                return_document=ReturnDocument.AFTER
+            )
+            if state is not None:
+                return state['session_number'], state['new_session']
+            self._bootstrap(user_id)
+        raise RuntimeError(f"Không thể khởi tạo trạng thái session cho user {user_id}")
+
+    def reset(self, user_id):
+        """
+        Xóa trạng thái session (khi xóa lịch sử chat của người dùng)
+        """
+        self.get_collection().delete_one({'_id': user_id})
+
+
+class AsyncSessionStateStore(SessionStateStore):
+    """
+    Giống `SessionStateStore` nhưng dùng collection của motor (chế độ server async)
+    """
+    async def _bootstrap(self, user_id):
+        history = self.get_history_collection()
+        last_session_number, last_record, message_count = 0, None, 0
+        last_session = await history.find_one({'user_id': user_id}, sort=[('session_number', -1)])
+        if last_session:
+            last_session_number = last_session['session_number']
+            session_filter = {'user_id': user_id, 'session_number': last_session_number}
+            last_record = await history.find_one(session_filter, sort=[('created_at', -1)])
+            message_count = await history.count_documents(session_filter)
+
+        try:
+            await self.get_collection().update_one(
+                {'_id': user_id},
+                {'$setOnInsert': self._initial_state(last_session_number, last_record, message_count)},
+                upsert=True
+            )
+        except DuplicateKeyError:
+            pass
+
+    async def assign(self, user_id):
+        """
+        Session cho tin nhắn mới của người dùng
+
+        Returns:
+            tuple: (session_number, is_new_session)
+        """
+        for _ in range(2):
+            state = await self.get_collection().find_one_and_update(
+                {'_id': user_id}, self._assign_update(datetime.utcnow()),
+                return_document=ReturnDocument.AFTER
+            )
+            if state is not None:
+                return state['session_number'], state['new_session']
+            await self._bootstrap(user_id)
+        raise RuntimeError(f"Không thể khởi tạo trạng thái session cho user {user_id}")
+
+    async def reset(self, user_id):
+        await self.get_collection().delete_one({'_id': user_id})
@@ -6,7 +6,7 @@ Command Line Interface đơn giản cho LMS-RAG-Chatbot
 import sys
 import os
 import argparse
-from lms_rag import send_continue_chat, cache
+from lms_rag import send_continue_chat, cache, semantic_cache, request_coalescer, llm_gateway
 
 class ChatHistory:
     def __init__(self, content, is_user):
@@ -74,6 +74,9 @@ def handle_special_commands(command, chat_history):
         try:
             status = cache.check_cache_health()
             print(f"Tình trạng cache: {status}")
+            print(f"Semantic cache: {semantic_cache.stats()}")
+            print(f"Gộp request đồng thời: {request_coalescer.stats()}")
+            print(f"LLM gateway: {llm_gateway.stats()}")
         except Exception as e:
             print(f"Lỗi khi kiểm tra cache: {e}")
         return False
@@ -81,6 +84,7 @@ def handle_special_commands(command, chat_history):
     if command == 'cache clear':
         try:
             cache.clear_all()
+            semantic_cache.clear_all()
             print("Đã xóa toàn bộ cache!")
         except Exception as e:
             print(f"Lỗi khi xóa cache: {e}")
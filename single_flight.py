@@ -0,0 +1,131 @@
+"""
+Single Flight - Gộp các request giống hệt nhau đang được xử lý đồng thời
+Cải tiến tải LLM cho LMS-RAG-Chatbot: nhiều học viên hỏi cùng một câu chỉ tốn một lần gọi Gemini
+"""
+
+import asyncio
+import threading
+
+
+class _Call:
+    def __init__(self):
+        self.done = threading.Event()
+        self.result = None
+        self.error = None
+        self.waiters = 0
+
+
+class SingleFlight:
+    """
+    Với mỗi key, chỉ request đầu tiên (leader) thực sự chạy hàm xử lý; các request đến
+    trong lúc leader đang chạy chờ và nhận chung kết quả (hoặc chung exception)
+
+    Key được xóa ngay khi leader xong, nên request đến sau đó chạy lại từ đầu
+    (thường sẽ trúng response cache mà leader vừa ghi).
+    """
+    def __init__(self):
+        self._calls = {}
+        self._lock = threading.Lock()
+        self.leaders = 0
+        self.followers = 0
+
+    def do(self, key, fn):
+        """
+        Chạy `fn()` một lần cho mỗi key đang xử lý
+
+        Returns:
+            Kết quả của `fn()` (dùng chung cho mọi request cùng key)
+        """
+        with self._lock:
+            call = self._calls.get(key)
+            is_leader = call is None
+            if is_leader:
+                call = _Call()
+                self._calls[key] = call
+                self.leaders += 1
+            else:
+                call.waiters += 1
+                self.followers += 1
+
+        if not is_leader:
+            call.done.wait()
+            if call.error is not None:
+                raise call.error
+            return call.result
+
+        try:
+            call.result = fn()
+            return call.result
+        except BaseException as e:
+            call.error = e
+            raise
+        finally:
+            with self._lock:
+                del self._calls[key]
+            if call.waiters:
+                print(f"Đã dùng chung kết quả cho {call.waiters} request giống hệt đang chờ")
+            call.done.set()
+
+    def stats(self):
+        """
+        Số lần thực sự xử lý (leaders) và số request được gộp (followers)
+        """
+        with self._lock:
+            return {
+                "in_flight": len(self._calls),
+                "leaders": self.leaders,
+                "followers": self.followers
+            }
+
+
+class AsyncSingleFlight:
+    """
+    Phiên bản asyncio của `SingleFlight` cho chế độ server bất đồng bộ (một event loop)
+
+    Request theo sau chờ future của leader thay vì chặn một thread.
+    """
+    def __init__(self):
+        self._calls = {}
+        self.leaders = 0
+        self.followers = 0
+
+    async def do(self, key, fn):
+        """
+        Chạy `await fn()` một lần cho mỗi key đang xử lý
+
+        Returns:
+            Kết quả của `fn()` (dùng chung cho mọi request cùng key)
+        """
+        future = self._calls.get(key)
+        if future is not None:
+            self.followers += 1
+            # shield: request theo sau bị hủy không được hủy luôn request của leader
+            return await asyncio.shield(future)
+
+        future = asyncio.get_running_loop().create_future()
+        self._calls[key] = future
+        self.leaders += 1
+        try:
+            result = await fn()
+            future.set_result(result)
+            return result
+        except asyncio.CancelledError:
+            future.cancel()
+            raise
+        except BaseException as e:
+            future.set_exception(e)
+            # Tránh cảnh báo "exception was never retrieved" khi không có request nào chờ
+            future.exception()
+            raise
+        finally:
+            del self._calls[key]
+
+    def stats(self):
+        """
+        Số lần thực sự xử lý (leaders) và số request được gộp (followers)
+        """
+        return {
+            "in_flight": len(self._calls),
+            "leaders": self.leaders,
+            "followers": self.followers
+        }
@@ -0,0 +1,77 @@
+"""
+Kiểm tra Reciprocal Rank Fusion và HybridRetriever: thứ tự gộp, loại trùng và thời hạn chờ
+"""
+import threading
+import time
+
+from hybrid_retriever import reciprocal_rank_fusion, HybridRetriever
+
+
+def _course(course_id, source):
+    return {"id": course_id, "source": source}
+
+
+def _ids(items):
+    return [item["id"] for item in items]
+
+
+def test_items_found_by_both_searches_rank_first():
+    vector = [_course("a", "vector"), _course("b", "vector"), _course("c", "vector")]
+    keyword = [_course("c", "keyword"), _course("d", "keyword")]
+
+    fused = reciprocal_rank_fusion([vector, keyword], key=lambda item: item["id"])
+
+    # "c" có 1/63 + 1/61, lớn hơn "a" (1/61) dù đứng cuối danh sách vector
+    assert _ids(fused) == ["c", "a", "b", "d"]
+
+
+def test_duplicates_are_removed_and_first_item_is_kept():
+    vector = [_course("a", "vector"), _course("a", "vector-chunk-2"), _course("b", "vector")]
+    keyword = [_course("b", "keyword"), _course("a", "keyword")]
+
+    fused = reciprocal_rank_fusion([vector, keyword], key=lambda item: item["id"])
+
+    assert _ids(fused) == ["a", "b"]
+    # Chunk thứ hai của "a" không được cộng điểm lần nữa trong cùng danh sách
+    assert fused[0]["source"] == "vector"
+    assert fused[1]["source"] == "vector"
+
+
+def test_ties_keep_order_of_appearance():
+    fused = reciprocal_rank_fusion([[_course("x", "v")], [_course("y", "k")]], key=lambda item: item["id"])
+    assert _ids(fused) == ["x", "y"]
+
+
+def test_retrieve_fuses_searches_and_ignores_failures():
+    def failing(query):
+        raise RuntimeError("MongoDB lỗi")
+
+    retriever = HybridRetriever(
+        {
+            "vector": lambda query: [_course("a", "vector"), _course("b", "vector")],
+            "keyword": lambda query: [_course("b", "keyword")],
+            "broken": failing,
+        },
+        key=lambda item: item["id"],
+        max_results=1
+    )
+    assert _ids(retriever.retrieve("python")) == ["b"]
+
+
+def test_retrieve_with_timeout_skips_slow_searches():
+    release = threading.Event()
+
+    def slow(query):
+        release.wait(5)
+        return [_course("slow", "vector")]
+
+    retriever = HybridRetriever(
+        {"vector": slow, "keyword": lambda query: [_course("fast", "keyword")]},
+        key=lambda item: item["id"]
+    )
+    start = time.perf_counter()
+    results = retriever.retrieve("python", timeout=0.05)
+    release.set()
+
+    assert _ids(results) == ["fast"]
+    assert time.perf_counter() - start < 1
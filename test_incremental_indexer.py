@@ -0,0 +1,194 @@
+"""
+Kiểm tra IncrementalIndexer (thêm / sửa / xóa entity trên FAISS tại chỗ) và PollingChangeFeed
+"""
+import hashlib
+
+import pytest
+
+pytest.importorskip("faiss")
+pytest.importorskip("langchain_community")
+
+from langchain_core.embeddings import Embeddings
+
+from incremental_indexer import IncrementalIndexer, PollingChangeFeed
+
+
+class FakeEmbeddings(Embeddings):
+    """
+    Embeddings cố định theo nội dung (không cần tải mô hình), đếm số văn bản đã tính
+    """
+    def __init__(self):
+        self.embedded_texts = []
+
+    def _vector(self, text):
+        digest = hashlib.blake2b(text.encode('utf-8'), digest_size=16).digest()
+        return [byte / 255.0 for byte in digest]
+
+    def embed_documents(self, texts):
+        self.embedded_texts.extend(texts)
+        return [self._vector(text) for text in texts]
+
+    def embed_query(self, text):
+        return self._vector(text)
+
+
+def split_entity(entity):
+    return [entity["text"]], [{"id": entity["id"], "type": entity["type"]}], [f"{entity['key']}:small:0"]
+
+
+def _entity(entity_type, entity_id, text, related=()):
+    return {
+        "key": f"{entity_type}:{entity_id}",
+        "id": entity_id,
+        "type": entity_type,
+        "name": text,
+        "text": text,
+        "related": list(related)
+    }
+
+
+def _stored_texts(vector_store):
+    return sorted(doc.page_content for doc in vector_store.docstore._dict.values())
+
+
+@pytest.fixture
+def embeddings():
+    return FakeEmbeddings()
+
+
+@pytest.fixture
+def indexer(embeddings):
+    indexer = IncrementalIndexer(split_entity)
+    indexer.build_full([
+        _entity("course", "a", "Khóa học Python cơ bản"),
+        _entity("course", "b", "Khóa học Java nâng cao"),
+    ], embeddings)
+    embeddings.embedded_texts.clear()
+    return indexer
+
+
+def test_apply_adds_changes_and_removes_entities_in_place(indexer, embeddings):
+    vector_store = indexer.vector_store
+
+    updated_store, stats = indexer.apply([
+        _entity("course", "a", "Khóa học Python cơ bản"),
+        _entity("course", "b", "Khóa học Java nâng cao (cập nhật 2024)"),
+        _entity("course", "c", "Khóa học Rust"),
+    ])
+
+    assert updated_store is vector_store
+    assert (stats["added"], stats["changed"], stats["removed"], stats["unchanged"]) == (1, 1, 0, 1)
+    # Chỉ chunks của entity thêm / sửa được tạo lại embeddings
+    assert sorted(embeddings.embedded_texts) == ["Khóa học Java nâng cao (cập nhật 2024)", "Khóa học Rust"]
+    assert _stored_texts(vector_store) == [
+        "Khóa học Java nâng cao (cập nhật 2024)", "Khóa học Python cơ bản", "Khóa học Rust"
+    ]
+    assert vector_store.index.ntotal == 3
+
+    _, stats = indexer.apply([
+        _entity("course", "a", "Khóa học Python cơ bản"),
+        _entity("course", "c", "Khóa học Rust"),
+    ])
+
+    assert stats["removed"] == 1
+    assert _stored_texts(vector_store) == ["Khóa học Python cơ bản", "Khóa học Rust"]
+    assert vector_store.index.ntotal == 2
+    assert set(indexer.entity_state) == {"course:a", "course:c"}
+
+
+def test_changed_entity_is_found_by_its_new_text(indexer):
+    indexer.apply([_entity("course", "b", "Khóa học Go")], scope_keys={"course:b"})
+
+    results = indexer.vector_store.similarity_search("Khóa học Go", k=1)
+    assert results[0].page_content == "Khóa học Go"
+    assert results[0].metadata["id"] == "b"
+
+
+def test_scoped_apply_only_touches_scope(indexer, embeddings):
+    _, stats = indexer.apply([], scope_keys={"course:b"})
+
+    assert (stats["added"], stats["changed"], stats["removed"]) == (0, 0, 1)
+    assert _stored_texts(indexer.vector_store) == ["Khóa học Python cơ bản"]
+    assert embeddings.embedded_texts == []
+
+
+def test_unchanged_entities_do_not_touch_the_index(indexer, embeddings):
+    _, stats = indexer.apply([
+        _entity("course", "a", "Khóa học Python cơ bản"),
+        _entity("course", "b", "Khóa học Java nâng cao"),
+    ])
+
+    assert stats["unchanged"] == 2
+    assert stats["chunks_embedded"] == stats["chunks_removed"] == 0
+    assert embeddings.embedded_texts == []
+
+
+class FakeCursor(list):
+    def sort(self, field, direction):
+        return FakeCursor(sorted(self, key=lambda doc: doc[field], reverse=direction < 0))
+
+    def limit(self, count):
+        return FakeCursor(self[:count])
+
+
+class FakeCollection:
+    """
+    Collection tối giản cho PollingChangeFeed: find theo `$exists` / `$gte`, distinct và count_documents
+    """
+    def __init__(self, docs):
+        self.docs = docs
+        self.distinct_calls = 0
+
+    def _matches(self, doc, query):
+        for field, condition in query.items():
+            if isinstance(condition, dict):
+                if "$exists" in condition and (field in doc) != condition["$exists"]:
+                    return False
+                if "$gte" in condition and not (field in doc and doc[field] >= condition["$gte"]):
+                    return False
+            elif doc.get(field) != condition:
+                return False
+        return True
+
+    def find(self, query, projection=None):
+        return FakeCursor(dict(doc) for doc in self.docs if self._matches(doc, query))
+
+    def distinct(self, field, query):
+        self.distinct_calls += 1
+        return [doc[field] for doc in self.docs if self._matches(doc, query)]
+
+    def count_documents(self, query):
+        return sum(1 for doc in self.docs if self._matches(doc, query))
+
+
+def test_polling_feed_scans_ids_only_when_counts_diverge():
+    db = {
+        "courses": FakeCollection([
+            {"_id": "a", "status": "active", "updatedAt": 1},
+            {"_id": "b", "status": "active", "updatedAt": 2},
+        ]),
+        "mentors": FakeCollection([{"_id": "m", "updatedAt": 1}]),
+        "users": FakeCollection([]),
+    }
+    feed = PollingChangeFeed(db)
+    initial_scans = db["courses"].distinct_calls
+
+    # Thêm một khóa học: số document khớp với số _id đã biết, không cần đọc lại danh sách _id
+    db["courses"].docs.append({"_id": "c", "status": "active", "updatedAt": 3})
+    batch = feed.poll()
+    assert batch.changed["course"] == {"c"}
+    assert batch.present == {}
+    assert db["courses"].distinct_calls == initial_scans
+
+    # Khóa học chuyển sang inactive được đọc qua updatedAt, cũng không cần đọc lại danh sách _id
+    db["courses"].docs[0] = {"_id": "a", "status": "draft", "updatedAt": 4}
+    batch = feed.poll()
+    assert batch.changed["course"] == {"a"}
+    assert batch.present == {}
+
+    # Xóa hẳn (không có updatedAt mới): số document giảm nên danh sách _id được đọc lại
+    db["courses"].docs = [doc for doc in db["courses"].docs if doc["_id"] != "b"]
+    batch = feed.poll()
+    assert batch.is_empty()
+    assert batch.present == {"course": {"c"}}
+    assert db["courses"].distinct_calls == initial_scans + 1
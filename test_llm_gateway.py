@@ -0,0 +1,133 @@
+"""
+Kiểm tra LLMGateway: từ chối khi hàng đợi đầy, hết thời gian chờ và chuyển slot theo thứ tự FIFO
+"""
+import asyncio
+import threading
+import time
+
+import pytest
+
+from llm_gateway import LLMGateway, LLMOverloadedError
+
+
+def _wait_for_queue_depth(gateway, depth):
+    deadline = time.perf_counter() + 5
+    while gateway.stats()["queue_depth"] != depth:
+        if time.perf_counter() > deadline:
+            raise AssertionError(f"Hàng đợi không đạt độ sâu {depth}")
+        time.sleep(0.005)
+
+
+def test_rejects_when_queue_is_full():
+    gateway = LLMGateway(max_concurrency=1, max_queue=0, max_wait_seconds=1)
+    gateway.acquire()
+
+    with pytest.raises(LLMOverloadedError) as error:
+        gateway.acquire()
+    assert error.value.reason == "queue_full"
+
+    gateway.release()
+    stats = gateway.stats()
+    assert stats["active"] == 0
+    assert stats["rejected_queue_full"] == 1
+
+
+def test_rejects_after_wait_timeout():
+    gateway = LLMGateway(max_concurrency=1, max_queue=4, max_wait_seconds=5)
+    gateway.acquire()
+
+    start = time.perf_counter()
+    with pytest.raises(LLMOverloadedError) as error:
+        # Thời hạn của request ngắn hơn max_wait_seconds
+        gateway.acquire(timeout=0.05)
+    assert error.value.reason == "wait_timeout"
+    assert time.perf_counter() - start < 1
+
+    stats = gateway.stats()
+    assert stats["queue_depth"] == 0
+    assert stats["rejected_timeout"] == 1
+
+    # Request hết thời gian đã rời hàng đợi nên slot trả về không bị chuyển cho nó
+    gateway.release()
+    assert gateway.stats()["active"] == 0
+
+
+def test_slots_are_handed_off_in_fifo_order():
+    gateway = LLMGateway(max_concurrency=1, max_queue=8, max_wait_seconds=5)
+    gateway.acquire()
+    order = []
+
+    def request(name):
+        with gateway.slot():
+            order.append(name)
+
+    threads = []
+    for depth, name in enumerate(["a", "b", "c"], start=1):
+        thread = threading.Thread(target=request, args=(name,))
+        thread.start()
+        threads.append(thread)
+        _wait_for_queue_depth(gateway, depth)
+
+    gateway.release()
+    for thread in threads:
+        thread.join(5)
+
+    assert order == ["a", "b", "c"]
+    stats = gateway.stats()
+    assert stats["active"] == 0
+    assert stats["admitted"] == 4
+
+
+def test_new_request_does_not_jump_the_queue():
+    gateway = LLMGateway(max_concurrency=1, max_queue=8, max_wait_seconds=5)
+    gateway.acquire()
+    granted, done = threading.Event(), threading.Event()
+
+    def waiting_request():
+        with gateway.slot():
+            granted.set()
+            done.wait(5)
+
+    waiting = threading.Thread(target=waiting_request)
+    waiting.start()
+    _wait_for_queue_depth(gateway, 1)
+
+    # Slot được chuyển thẳng cho request đang chờ chứ không trả về cho request mới đến
+    gateway.release()
+    stats = gateway.stats()
+    assert (stats["active"], stats["queue_depth"]) == (1, 0)
+    with pytest.raises(LLMOverloadedError):
+        gateway.acquire(timeout=0.05)
+    assert granted.wait(5)
+
+    done.set()
+    waiting.join(5)
+    assert gateway.stats()["active"] == 0
+
+
+def test_async_slots_share_fifo_queue_and_timeout():
+    async def scenario():
+        gateway = LLMGateway(max_concurrency=1, max_queue=8, max_wait_seconds=5)
+        await gateway.acquire_async()
+        order = []
+
+        async def request(name):
+            async with gateway.async_slot():
+                order.append(name)
+
+        tasks = []
+        for depth, name in enumerate(["a", "b"], start=1):
+            tasks.append(asyncio.create_task(request(name)))
+            while gateway.stats()["queue_depth"] != depth:
+                await asyncio.sleep(0.005)
+
+        with pytest.raises(LLMOverloadedError) as error:
+            await gateway.acquire_async(timeout=0.05)
+        assert error.value.reason == "wait_timeout"
+
+        gateway.release()
+        await asyncio.gather(*tasks)
+        assert order == ["a", "b"]
+        assert gateway.stats()["active"] == 0
+
+    asyncio.run(scenario())
@@ -0,0 +1,75 @@
+"""
+Kiểm tra stale-while-revalidate của ResponseCache: câu trả lời hết hạn vẫn được trả về
+trong khi đúng một worker nền tạo lại nó
+"""
+import threading
+import time
+
+from response_cache import ResponseCache
+
+
+def _make_cache(tmp_path, **kwargs):
+    # max_age_hours=0: câu trả lời hết hạn ngay khi lưu nhưng vẫn nằm trong khoảng stale
+    options = {"max_age_hours": 0, "stale_hours": 1, "early_refresh_beta": 0}
+    options.update(kwargs)
+    return ResponseCache(cache_dir=str(tmp_path), **options)
+
+
+def _wait_until(condition):
+    deadline = time.perf_counter() + 5
+    while not condition():
+        if time.perf_counter() > deadline:
+            raise AssertionError("Điều kiện không xảy ra trong thời gian chờ")
+        time.sleep(0.005)
+
+
+def test_stale_answer_is_served_while_one_refresh_runs(tmp_path):
+    cache = _make_cache(tmp_path)
+    cache.set("khóa học python", "câu trả lời cũ")
+
+    started, release = threading.Event(), threading.Event()
+    refresh_calls = []
+
+    def refresh():
+        refresh_calls.append(1)
+        started.set()
+        release.wait(5)
+        cache.max_age_hours = 1
+        cache.set("khóa học python", "câu trả lời mới")
+
+    results = [cache.get("khóa học python", refresh=refresh) for _ in range(5)]
+    assert started.wait(5)
+    results += [cache.get("khóa học python", refresh=refresh) for _ in range(5)]
+
+    assert results == ["câu trả lời cũ"] * 10
+    assert refresh_calls == [1]
+
+    release.set()
+    _wait_until(lambda: cache.lookup_stats()["refreshing"] == 0)
+    assert cache.get("khóa học python", refresh=refresh) == "câu trả lời mới"
+    assert refresh_calls == [1]
+
+    stats = cache.lookup_stats()
+    assert stats["stale_hits"] == 10
+    assert stats["refreshes"] == 1
+
+
+def test_stale_answer_is_not_served_without_refresh(tmp_path):
+    cache = _make_cache(tmp_path)
+    cache.set("khóa học java", "câu trả lời cũ")
+    assert cache.get("khóa học java") is None
+
+
+def test_failed_refresh_allows_next_refresh(tmp_path):
+    cache = _make_cache(tmp_path)
+    cache.set("giảng viên", "câu trả lời cũ")
+    attempts = []
+
+    def failing_refresh():
+        attempts.append(1)
+        raise RuntimeError("Gemini lỗi")
+
+    assert cache.get("giảng viên", refresh=failing_refresh) == "câu trả lời cũ"
+    _wait_until(lambda: attempts and cache.lookup_stats()["refreshing"] == 0)
+    assert cache.get("giảng viên", refresh=failing_refresh) == "câu trả lời cũ"
+    _wait_until(lambda: len(attempts) == 2 and cache.lookup_stats()["refreshing"] == 0)
@@ -0,0 +1,132 @@
+"""
+Kiểm tra SingleFlight / AsyncSingleFlight: gộp request giống hệt nhau đang xử lý đồng thời
+"""
+import asyncio
+import threading
+
+import pytest
+
+from single_flight import SingleFlight, AsyncSingleFlight
+
+
+def _start_followers(flight, key, fn, count):
+    """
+    Chạy `count` request theo sau trong thread riêng, trả về (threads, results, errors)
+    """
+    results, errors = [], []
+
+    def follower():
+        try:
+            results.append(flight.do(key, fn))
+        except Exception as e:
+            errors.append(e)
+
+    threads = [threading.Thread(target=follower) for _ in range(count)]
+    for thread in threads:
+        thread.start()
+    return threads, results, errors
+
+
+def _wait_for_followers(flight, count):
+    for _ in range(200):
+        if flight.stats()["followers"] >= count:
+            return
+        threading.Event().wait(0.01)
+    raise AssertionError("Các request theo sau không vào hàng chờ")
+
+
+def test_followers_share_leader_result():
+    flight = SingleFlight()
+    started, release = threading.Event(), threading.Event()
+    calls = []
+
+    def leader_fn():
+        calls.append(1)
+        started.set()
+        release.wait(5)
+        return "kết quả"
+
+    leader = threading.Thread(target=lambda: flight.do("python", leader_fn))
+    leader.start()
+    assert started.wait(5)
+
+    threads, results, errors = _start_followers(flight, "python", lambda: calls.append(1) or "khác", 3)
+    _wait_for_followers(flight, 3)
+    release.set()
+    leader.join(5)
+    for thread in threads:
+        thread.join(5)
+
+    assert calls == [1]
+    assert results == ["kết quả"] * 3
+    assert not errors
+    assert flight.stats() == {"in_flight": 0, "leaders": 1, "followers": 3}
+
+
+def test_followers_receive_leader_exception():
+    flight = SingleFlight()
+    started, release = threading.Event(), threading.Event()
+    leader_errors = []
+
+    def leader_fn():
+        started.set()
+        release.wait(5)
+        raise ValueError("lỗi LLM")
+
+    def leader():
+        try:
+            flight.do("java", leader_fn)
+        except ValueError as e:
+            leader_errors.append(e)
+
+    leader_thread = threading.Thread(target=leader)
+    leader_thread.start()
+    assert started.wait(5)
+
+    threads, results, errors = _start_followers(flight, "java", lambda: "không được gọi", 2)
+    _wait_for_followers(flight, 2)
+    release.set()
+    leader_thread.join(5)
+    for thread in threads:
+        thread.join(5)
+
+    assert len(leader_errors) == 1
+    assert not results
+    assert errors == [leader_errors[0]] * 2
+
+
+def test_key_is_released_after_leader_finishes():
+    flight = SingleFlight()
+    assert flight.do("a", lambda: 1) == 1
+    assert flight.do("a", lambda: 2) == 2
+    assert flight.stats()["leaders"] == 2
+
+
+def test_async_followers_share_result_and_exception():
+    async def scenario():
+        flight = AsyncSingleFlight()
+        release = asyncio.Event()
+        calls = []
+
+        async def answer():
+            calls.append(1)
+            await release.wait()
+            return "kết quả"
+
+        async def failing():
+            await release.wait()
+            raise ValueError("lỗi LLM")
+
+        ok_tasks = [asyncio.create_task(flight.do("python", answer)) for _ in range(3)]
+        error_tasks = [asyncio.create_task(flight.do("java", failing)) for _ in range(2)]
+        await asyncio.sleep(0)
+        release.set()
+
+        assert await asyncio.gather(*ok_tasks) == ["kết quả"] * 3
+        for task in error_tasks:
+            with pytest.raises(ValueError):
+                await task
+        assert calls == [1]
+        assert flight.stats() == {"in_flight": 0, "leaders": 2, "followers": 3}
+
+    asyncio.run(scenario())
@@ -0,0 +1,257 @@
+"""
+Vector Index Snapshot - Lưu và nạp FAISS vector store từ đĩa
+Cải tiến thời gian khởi động cho LMS-RAG-Chatbot: chỉ tạo lại embeddings khi dữ liệu thay đổi
+"""
+
+import os
+import json
+import shutil
+import hashlib
+import threading
+import time
+from datetime import datetime
+
+from langchain_community.vectorstores import FAISS
+
+# Tăng giá trị này khi thay đổi định dạng snapshot để các snapshot cũ bị bỏ qua
+INDEX_FORMAT_VERSION = 1
+
+CURRENT_POINTER_FILE = "CURRENT"
+MANIFEST_FILE = "manifest.json"
+ENTITIES_FILE = "entities.json"
+
+
+def compute_index_config_key(model_name, chunking_config=None):
+    """
+    Tính key cấu hình của index: snapshot chỉ dùng lại được (kể cả để cập nhật tăng dần)
+    khi mô hình embedding, cấu hình chia chunk và định dạng snapshot giống nhau
+    """
+    header = {
+        "format_version": INDEX_FORMAT_VERSION,
+        "model_name": model_name,
+        "chunking_config": chunking_config or {},
+    }
+    return hashlib.sha256(json.dumps(header, sort_keys=True, ensure_ascii=False).encode('utf-8')).hexdigest()
+
+
+def compute_catalog_fingerprint(entity_hashes, model_name, chunking_config=None):
+    """
+    Tính fingerprint cho toàn bộ dữ liệu dùng để xây dựng vector store
+
+    Fingerprint thay đổi khi nội dung bất kỳ entity nào thay đổi, khi entity được thêm / xóa,
+    hoặc khi key cấu hình của index thay đổi.
+
+    Args:
+        entity_hashes (dict): {key entity: hash nội dung}
+        model_name (str): Tên mô hình embedding
+        chunking_config (dict): Cấu hình chia chunk
+
+    Returns:
+        str: Chuỗi hex SHA-256
+    """
+    hasher = hashlib.sha256()
+    hasher.update(compute_index_config_key(model_name, chunking_config).encode('utf-8'))
+
+    # Sắp xếp theo key để fingerprint không phụ thuộc thứ tự dữ liệu trả về từ MongoDB
+    for key in sorted(entity_hashes):
+        hasher.update(f"{key}\t{entity_hashes[key]}\n".encode('utf-8'))
+
+    return hasher.hexdigest()
+
+
+class VectorIndexStore:
+    """
+    Quản lý các snapshot FAISS đã được version hóa trên đĩa
+
+    Cấu trúc thư mục:
+        index_dir/CURRENT                  -> tên snapshot đang dùng
+        index_dir/<snapshot>/index.faiss   -> vectors
+        index_dir/<snapshot>/index.pkl     -> docstore và ánh xạ id
+        index_dir/<snapshot>/manifest.json -> metadata (fingerprint, model, thời gian tạo...)
+        index_dir/<snapshot>/entities.json -> trạng thái từng entity (hash, id các chunk) cho cập nhật tăng dần
+    """
+    def __init__(self, index_dir="vector_index", keep_versions=2):
+        self.index_dir = index_dir
+        self.keep_versions = keep_versions
+        self._lock = threading.RLock()
+
+        # Tạo thư mục index nếu chưa tồn tại
+        if not os.path.exists(index_dir):
+            os.makedirs(index_dir, exist_ok=True)
+
+    def _snapshot_path(self, snapshot_name):
+        return os.path.join(self.index_dir, snapshot_name)
+
+    def _read_current_name(self):
+        pointer_path = os.path.join(self.index_dir, CURRENT_POINTER_FILE)
+        if not os.path.exists(pointer_path):
+            return None
+        try:
+            with open(pointer_path, 'r', encoding='utf-8') as f:
+                return f.read().strip() or None
+        except Exception as e:
+            print(f"Lỗi khi đọc con trỏ snapshot: {e}")
+            return None
+
+    def _write_current_name(self, snapshot_name):
+        pointer_path = os.path.join(self.index_dir, CURRENT_POINTER_FILE)
+        temp_path = pointer_path + '.tmp'
+        with open(temp_path, 'w', encoding='utf-8') as f:
+            f.write(snapshot_name)
+        # Atomic replace để tiến trình khác không bao giờ đọc được con trỏ dở dang
+        os.replace(temp_path, pointer_path)
+
+    def current_manifest(self):
+        """
+        Lấy manifest của snapshot hiện tại
+
+        Returns:
+            dict hoặc None nếu chưa có snapshot hợp lệ
+        """
+        with self._lock:
+            snapshot_name = self._read_current_name()
+            if not snapshot_name:
+                return None
+
+            manifest_path = os.path.join(self._snapshot_path(snapshot_name), MANIFEST_FILE)
+            if not os.path.exists(manifest_path):
+                return None
+
+            try:
+                with open(manifest_path, 'r', encoding='utf-8') as f:
+                    manifest = json.load(f)
+            except (json.JSONDecodeError, UnicodeDecodeError) as e:
+                print(f"Lỗi định dạng manifest snapshot: {e}")
+                return None
+
+            manifest['snapshot_name'] = snapshot_name
+            return manifest
+
+    def load(self, embeddings, config_key):
+        """
+        Nạp vector store từ snapshot hiện tại nếu snapshot tương thích với cấu hình index
+
+        Snapshot được trả về kể cả khi fingerprint dữ liệu đã khác, để nơi gọi có thể
+        cập nhật tăng dần thay vì xây dựng lại toàn bộ.
+
+        Args:
+            embeddings: Đối tượng embeddings dùng cho truy vấn
+            config_key (str): Key cấu hình index hiện tại
+
+        Returns:
+            tuple: (FAISS, manifest, trạng thái entity) hoặc (None, None, None) nếu snapshot
+            không tồn tại / không tương thích / bị lỗi
+        """
+        with self._lock:
+            manifest = self.current_manifest()
+            if manifest is None:
+                print("Chưa có snapshot vector store trên đĩa")
+                return None, None, None
+
+            if manifest.get('format_version') != INDEX_FORMAT_VERSION:
+                print(f"Snapshot có định dạng cũ (v{manifest.get('format_version')}), cần xây dựng lại")
+                return None, None, None
+
+            if manifest.get('config_key') != config_key:
+                print("Cấu hình embedding / chia chunk đã thay đổi so với snapshot, cần xây dựng lại")
+                return None, None, None
+
+            snapshot_path = self._snapshot_path(manifest['snapshot_name'])
+            try:
+                start_time = time.perf_counter()
+                vector_store = FAISS.load_local(
+                    snapshot_path,
+                    embeddings,
+                    allow_dangerous_deserialization=True  # Snapshot do chính hệ thống tạo ra
+                )
+                with open(os.path.join(snapshot_path, ENTITIES_FILE), 'r', encoding='utf-8') as f:
+                    entity_state = json.load(f)
+                elapsed = time.perf_counter() - start_time
+                print(f"Đã nạp snapshot vector store '{manifest['snapshot_name']}' "
+                      f"({manifest.get('chunk_count', '?')} chunks) trong {elapsed:.2f}s")
+                return vector_store, manifest, entity_state
+            except Exception as e:
+                print(f"Lỗi khi nạp snapshot vector store: {e}")
+                return None, None, None
+
+    def save(self, vector_store, fingerprint, config_key, entity_state, metadata=None):
+        """
+        Lưu vector store thành snapshot mới và chuyển con trỏ CURRENT sang snapshot đó
+
+        Args:
+            vector_store (FAISS): Vector store cần lưu
+            fingerprint (str): Fingerprint của dữ liệu đã dùng để xây dựng
+            config_key (str): Key cấu hình index
+            entity_state (dict): Trạng thái từng entity trong vector store
+            metadata (dict): Thông tin bổ sung ghi vào manifest
+
+        Returns:
+            str: Tên snapshot vừa lưu, None nếu có lỗi
+        """
+        with self._lock:
+            created_time = datetime.now()
+            # Thời gian đứng trước fingerprint để sắp xếp theo tên cũng là theo thời gian tạo
+            snapshot_name = (f"v{INDEX_FORMAT_VERSION}-{created_time.strftime('%Y%m%d%H%M%S%f')}-"
+                             f"{fingerprint[:16]}")
+            snapshot_path = self._snapshot_path(snapshot_name)
+            temp_path = snapshot_path + '.tmp'
+
+            try:
+                if os.path.exists(temp_path):
+                    shutil.rmtree(temp_path)
+
+                vector_store.save_local(temp_path)
+
+                manifest = dict(metadata or {})
+                manifest.update({
+                    'format_version': INDEX_FORMAT_VERSION,
+                    'fingerprint': fingerprint,
+                    'config_key': config_key,
+                    'entity_count': len(entity_state),
+                    'chunk_count': vector_store.index.ntotal,
+                    'created_time': created_time.isoformat()
+                })
+                with open(os.path.join(temp_path, MANIFEST_FILE), 'w', encoding='utf-8') as f:
+                    json.dump(manifest, f, ensure_ascii=False, indent=2)
+                with open(os.path.join(temp_path, ENTITIES_FILE), 'w', encoding='utf-8') as f:
+                    json.dump(entity_state, f, ensure_ascii=False)
+
+                # Đổi tên thư mục tạm và cập nhật con trỏ sau khi snapshot đã ghi đầy đủ
+                os.replace(temp_path, snapshot_path)
+                self._write_current_name(snapshot_name)
+                print(f"Đã lưu snapshot vector store '{snapshot_name}'")
+            except Exception as e:
+                print(f"Lỗi khi lưu snapshot vector store: {e}")
+                if os.path.exists(temp_path):
+                    shutil.rmtree(temp_path, ignore_errors=True)
+                return None
+
+            self._prune_old_snapshots(snapshot_name)
+            return snapshot_name
+
+    def _prune_old_snapshots(self, current_name):
+        """
+        Xóa các snapshot cũ, chỉ giữ lại `keep_versions` snapshot mới nhất
+        """
+        try:
+            snapshots = sorted(
+                name for name in os.listdir(self.index_dir)
+                if name.startswith('v') and not name.endswith('.tmp')
+                and os.path.isdir(self._snapshot_path(name))
+            )
+            old_snapshots = [name for name in snapshots if name != current_name]
+            for name in old_snapshots[:max(0, len(old_snapshots) - (self.keep_versions - 1))]:
+                shutil.rmtree(self._snapshot_path(name), ignore_errors=True)
+                print(f"Đã xóa snapshot vector store cũ '{name}'")
+        except Exception as e:
+            print(f"Lỗi khi dọn dẹp snapshot cũ: {e}")
+
+
+# Instance mặc định
+index_store = VectorIndexStore(
+    index_dir=os.getenv(
+        'VECTOR_INDEX_DIR',
+        os.path.join(os.path.dirname(os.path.abspath(__file__)), "vector_index")
+    ),
+    keep_versions=2
+)